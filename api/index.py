@@ -1,96 +1,106 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import joblib
-import cv2
-import numpy as np
-import base64
 import os
 import sys
 
-from skimage.feature import graycomatrix, graycoprops, local_binary_pattern
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fungiscope.startup import StartupProfile
+
+# FUNGI_STARTUP_PROFILE=1 prints per-stage cold-start timings and serves
+# them at /api/classify-py/startup
+profile = StartupProfile()
+
+with profile.stage("import flask"):
+    from flask import Flask, request, jsonify
+    from flask_cors import CORS
+
+# cv2 + NumPy only: skimage is never needed, and joblib/sklearn are only
+# imported if the model has to be unpickled
+with profile.stage("import fungiscope"):
+    from fungiscope.cache import cache_from_env
+    from fungiscope.metrics import instrument
+    from fungiscope.model import resolve_model_path
+    from fungiscope.registry import registry_from_env
+    from fungiscope.serving import (InvalidImageError, UploadError, batch_request_images, classify_batch,
+                                    classify_with_similar, model_admin, predict_image, request_image_bytes,
+                                    request_top_k, similar_images, warm_up)
+    from fungiscope.similar import index_from_env
 
 app = Flask(__name__)
 CORS(app)
 
-# Feature extraction functions 
-def extract_glcm_features(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    glcm = graycomatrix(gray, distances=[1], angles=[0, np.pi/4, np.pi/2, 3*np.pi/4], 
-                        levels=256, symmetric=True, normed=True)
-    features = []
-    props = ['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM']
-    for prop in props:
-        val = graycoprops(glcm, prop).mean()
-        features.append(val)
-    return np.array(features)
-
-def extract_lbp_features(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    radius = 1
-    n_points = 8 * radius
-    lbp = local_binary_pattern(gray, n_points, radius, method='uniform')
-    hist, _ = np.histogram(lbp.ravel(), bins=np.arange(0, n_points + 3), range=(0, n_points + 2))
-    hist = hist.astype("float")
-    hist /= (hist.sum() + 1e-7)
-    return hist
-
-def extract_hsv_features(image):
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    bins = 8
-    hist_h = cv2.calcHist([hsv], [0], None, [bins], [0, 180])
-    hist_s = cv2.calcHist([hsv], [1], None, [bins], [0, 256])
-    hist_v = cv2.calcHist([hsv], [2], None, [bins], [0, 256])
-    cv2.normalize(hist_h, hist_h)
-    cv2.normalize(hist_s, hist_s)
-    cv2.normalize(hist_v, hist_v)
-    return np.concatenate([hist_h.flatten(), hist_s.flatten(), hist_v.flatten()])
-
-def extract_all_features(image):
-    img = cv2.resize(image, (256, 256))
-    feat_glcm = extract_glcm_features(img)
-    feat_lbp = extract_lbp_features(img)
-    feat_hsv = extract_hsv_features(img)
-    return np.concatenate([feat_glcm, feat_lbp, feat_hsv])
-
-model = None
+models = None
+similar_index = None
 
-def get_model():
-    global model
-    if model is None:
-        # model
-        model_path = os.path.join(os.getcwd(), 'scripts', 'rf_defungi.joblib')
-        
-        if not os.path.exists(model_path):
-             model_path = os.path.join(os.getcwd(), 'scripts', 'best_xgb_defungi.joblib')
+# Prometheus metrics at /api/classify-py/metrics, Server-Timing on every response
+instrument(app, cache=lambda: models and models.cache(), path='/api/classify-py/metrics')
+
+def get_models():
+    global models
+    if models is None:
+        # model: paths are relative to the repo, not the working directory;
+        # an exported rf_defungi.forest / .npz is picked over the joblib
+        # file when present (build it with scripts/export_forest.py);
+        # FUNGI_MODEL_DIR serves (and follows) the active model of a directory
+        model_path = resolve_model_path(
+            os.environ.get('FUNGI_MODEL_PATH'),
+            os.path.join(ROOT, 'scripts', 'rf_defungi.joblib'),
+            os.path.join(ROOT, 'scripts', 'best_xgb_defungi.joblib'),
+        )
         
-        if os.path.exists(model_path):
-            model = joblib.load(model_path)
-        else:
-            raise FileNotFoundError(f"Model not found at {model_path}")
-    return model
+        if model_path is None and not os.environ.get('FUNGI_MODEL_DIR'):
+            raise FileNotFoundError(f"Model not found in {os.path.join(ROOT, 'scripts')}")
+        with profile.stage("load model"):
+            models = registry_from_env(model_path, cache_factory=cache_from_env)
+        if models.current is not None:
+            with profile.stage("warm up"):
+                warm_up(models.current.model)
+        profile.log_once()
+    return models
+
+def get_model():
+    active = get_models().current
+    if active is None:
+        raise RuntimeError(f"Model not loaded: {models.last_error}")
+    return active.model
+
+def get_similar_index():
+    # FUNGI_SIMILAR_INDEX (scripts/build_similar_index.py), loaded on first use
+    global similar_index
+    if similar_index is None:
+        similar_index = index_from_env()
+    return similar_index
+
+# FUNGI_WARMUP=1 loads and warms the model while the function initializes
+# instead of on the first request
+if os.environ.get('FUNGI_WARMUP'):
+    get_model()
 
 @app.route('/api/classify-py', methods=['POST'])
 def classify():
     try:
-        data = request.json
-        image_data = data.get('image', '')
-        
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            return jsonify({"error": "Invalid image"}), 400
-        
-        current_model = get_model()
-        features = extract_all_features(img)
-        features = features.reshape(1, -1)
-        
-        prediction = current_model.predict(features)[0]
-        probabilities = current_model.predict_proba(features)[0]
+        try:
+            image_bytes = request_image_bytes(request)
+            top_k = request_top_k(request)
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        if top_k and get_similar_index() is None:
+            return jsonify({"error": "Similar-image search is not enabled"}), 400
+
+        # in-flight requests finish on the model they started with
+        with get_models().use() as active:
+            if active is None:
+                return jsonify({"error": f"Model not loaded: {models.last_error}"}), 500
+            similar = None
+            try:
+                if top_k:
+                    prediction, probabilities, stage, similar = classify_with_similar(
+                        active.model, similar_index, image_bytes, top_k, active.cache)
+                else:
+                    prediction, probabilities, stage = predict_image(active.model, image_bytes, active.cache)
+            except InvalidImageError:
+                return jsonify({"error": "Invalid image"}), 400
+
         confidence = max(probabilities)
 
         classes = ["Candida Albicans", "Aspergillus Niger", "Trichophyton Rubrum", 
@@ -101,14 +111,75 @@ def classify():
         except:
              pred_class = "Unknown Class"
 
-        return jsonify({
+        response = {
             "class": pred_class,
             "confidence": float(confidence),
-        })
+            "stage": stage,
+            "model_version": active.version,
+        }
+        if similar is not None:
+            response["similar"] = similar
+        return jsonify(response)
         
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/classify-py/batch', methods=['POST'])
+def classify_batch_route():
+    try:
+        images, error, status = batch_request_images(request)
+        if error:
+            return jsonify({"error": error}), status
+
+        with get_models().use() as active:
+            if active is None:
+                return jsonify({"error": f"Model not loaded: {models.last_error}"}), 500
+            return jsonify({"results": classify_batch(active.model, images, unknown="Unknown Class",
+                                                      cache=active.cache),
+                            "model_version": active.version})
+
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/classify-py/similar', methods=['POST'])
+def similar():
+    try:
+        try:
+            image_bytes = request_image_bytes(request)
+            top_k = request_top_k(request, default=5)
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        if get_similar_index() is None:
+            return jsonify({"error": "Similar-image search is not enabled"}), 404
+
+        try:
+            return jsonify({"similar": similar_images(similar_index, image_bytes, top_k)})
+        except InvalidImageError:
+            return jsonify({"error": "Invalid image"}), 400
+
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/classify-py/warmup', methods=['GET'])
+def warmup():
+    # for a scheduled ping that keeps an instance warm
+    get_model()
+    return jsonify({"status": "warm"})
+
+@app.route('/api/classify-py/admin/model', methods=['GET', 'POST'])
+def model_admin_route():
+    # FUNGI_ADMIN_TOKEN enables it: GET = active version, POST = reload
+    body, status = model_admin(get_models(), request)
+    return jsonify(body), status
+
+@app.route('/api/classify-py/startup', methods=['GET'])
+def startup_profile():
+    if not profile.enabled:
+        return jsonify({"error": "Set FUNGI_STARTUP_PROFILE=1 to record startup timings"}), 404
+    return jsonify(profile.report())
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
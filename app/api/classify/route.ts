@@ -2,7 +2,9 @@ import { NextResponse } from "next/server"
 
 export async function POST(request: Request) {
   try {
-    const body = await request.json()
+    // forward the body untouched (JSON, multipart or raw image bytes)
+    const contentType = request.headers.get("content-type") ?? "application/json"
+    const body = await request.arrayBuffer()
     
     const apiUrl = process.env.NODE_ENV === 'development' 
       ? "http://127.0.0.1:5000/classify" 
@@ -11,9 +13,9 @@ export async function POST(request: Request) {
     const response = await fetch(new URL('/api/classify-py', request.url), {
       method: "POST",
       headers: {
-        "Content-Type": "application/json",
+        "Content-Type": contentType,
       },
-      body: JSON.stringify(body),
+      body,
     })
 
     if (!response.ok) {
@@ -25,7 +27,9 @@ export async function POST(request: Request) {
     }
 
     const data = await response.json()
-    return NextResponse.json(data)
+    // pass the Python stage breakdown (decode/extract/predict) on to the browser
+    const serverTiming = response.headers.get("server-timing")
+    return NextResponse.json(data, serverTiming ? { headers: { "Server-Timing": serverTiming } } : undefined)
 
   } catch (error) {
     console.error("Error communicating with classification server:", error)
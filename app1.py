@@ -1,11 +1,18 @@
 import streamlit as st
-import joblib
 import cv2
 import numpy as np
-from skimage.feature import graycomatrix, graycoprops, local_binary_pattern
-from PIL import Image
+import pandas as pd
 import os
 
+from fungiscope.cache import image_key
+from fungiscope.features import decode_image, extract_all_features
+from fungiscope.model import CLASS_NAMES, class_name, load_model, predict_batch, resolve_model_path
+from fungiscope.serving import REDUCED_DECODE_MIN_SIDE
+
+# previews are rendered at most this many pixels on the long side
+THUMBNAIL_SIDE = 640
+GRID_THUMBNAIL_SIDE = 160
+
 # --- Page Config ---
 st.set_page_config(
     page_title="FungiScope",
@@ -48,60 +55,85 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# feature extraction
-def extract_glcm_features(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    glcm = graycomatrix(gray, distances=[1], angles=[0, np.pi/4, np.pi/2, 3*np.pi/4], 
-                        levels=256, symmetric=True, normed=True)
-    features = []
-    props = ['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM']
-    for prop in props:
-        val = graycoprops(glcm, prop).mean()
-        features.append(val)
-    return np.array(features)
-
-def extract_lbp_features(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    radius = 1
-    n_points = 8 * radius
-    lbp = local_binary_pattern(gray, n_points, radius, method='uniform')
-    hist, _ = np.histogram(lbp.ravel(), bins=np.arange(0, n_points + 3), range=(0, n_points + 2))
-    hist = hist.astype("float")
-    hist /= (hist.sum() + 1e-7)
-    return hist
-
-def extract_hsv_features(image):
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    bins = 8
-    hist_h = cv2.calcHist([hsv], [0], None, [bins], [0, 180])
-    hist_s = cv2.calcHist([hsv], [1], None, [bins], [0, 256])
-    hist_v = cv2.calcHist([hsv], [2], None, [bins], [0, 256])
-    cv2.normalize(hist_h, hist_h)
-    cv2.normalize(hist_s, hist_s)
-    cv2.normalize(hist_v, hist_v)
-    return np.concatenate([hist_h.flatten(), hist_s.flatten(), hist_v.flatten()])
-
-def extract_all_features(image):
-    img = cv2.resize(image, (256, 256))
-    feat_glcm = extract_glcm_features(img)
-    feat_lbp = extract_lbp_features(img)
-    feat_hsv = extract_hsv_features(img)
-    return np.concatenate([feat_glcm, feat_lbp, feat_hsv])
+ROOT = os.path.dirname(os.path.abspath(__file__))
 
 # load model
-@st.cache_resource
-def load_model():
-    possible_paths = [
-        "scripts/rf_defungi.joblib", 
-        "rf_defungi.joblib", 
-        "scripts/best_xgb_defungi.joblib"
-    ]
-    for path in possible_paths:
-        if os.path.exists(path):
-            return joblib.load(path)
-    return None
-
-model = load_model()
+def find_model_path():
+    # same lookup as api/index.py: FUNGI_MODEL_PATH first, paths relative to
+    # the repo, an exported .forest / .npz preferred over the joblib file
+    return resolve_model_path(
+        os.environ.get("FUNGI_MODEL_PATH"),
+        os.path.join(ROOT, "scripts", "rf_defungi.joblib"),
+        os.path.join(ROOT, "rf_defungi.joblib"),
+        os.path.join(ROOT, "scripts", "best_xgb_defungi.joblib"),
+    )
+
+def model_stamp():
+    # key of the loaded model and of cached predictions: a retrained model
+    # file is loaded again and its predictions are not served from the cache
+    path = find_model_path()
+    if path is None:
+        return None
+    st_ = os.stat(path)
+    return path, st_.st_mtime_ns, st_.st_size
+
+@st.cache_resource(max_entries=1)
+def get_model(stamp):
+    # one entry: the previous model is dropped when the file changes
+    return load_model(stamp[0]) if stamp else None
+
+# --- Cached steps, shared by every session on this box ---
+# keyed on the digest of the uploaded bytes; arguments starting with "_" are not hashed by Streamlit
+
+@st.cache_data(max_entries=2048, show_spinner=False)
+def extract_upload(digest, _image_bytes):
+    image = decode_image(_image_bytes, REDUCED_DECODE_MIN_SIDE)
+    if image is None:
+        raise ValueError("Could not decode the image")
+    features, _ = extract_all_features(image)
+    return features
+
+@st.cache_data(max_entries=2048, show_spinner=False)
+def thumbnail(digest, _image_bytes, max_side=THUMBNAIL_SIDE):
+    # JPEGs are decoded straight at 1/2-1/8 scale, then shrunk to max_side
+    image = decode_image(_image_bytes, max_side)
+    if image is None:
+        return None
+    scale = max_side / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def predict_uploads(digests, _features, _model, stamp):
+    # one predict_proba call for the whole set; stamp keys the cache on the model
+    labels, probabilities = predict_batch(_model, np.vstack(_features))
+    return [class_name(label, "Unknown Class") for label in labels], probabilities
+
+def show_result(pred_class, probabilities):
+    confidence = max(probabilities)
+
+    # Display Results
+    st.markdown(f"""
+        <div class="result-box">
+            <h2 style="margin:0; color:#1b5e20;">{pred_class}</h2>
+            <p style="margin:0; font-size:18px;">Confidence Score: <b>{confidence*100:.1f}%</b></p>
+        </div>
+    """, unsafe_allow_html=True)
+    
+    # Bar Chart
+    st.write("Confidence Level:")
+    st.progress(float(confidence), text=f"{confidence*100:.1f}%")
+
+    # Detailed Probabilities Expander
+    with st.expander("See details for all classes"):
+        for i, name in enumerate(CLASS_NAMES):
+            prob = probabilities[i]
+            st.write(f"**{name}**")
+            st.progress(float(prob), text=f"{prob*100:.1f}%")
+
+stamp = model_stamp()
+model = get_model(stamp)
 
 page = st.sidebar.radio("Go to", ["Classify Image", "About Our Model"])
 
@@ -109,69 +141,96 @@ if page == "Classify Image":
     st.title("FungiScope")
     st.write("Microscopic Fungi Classifier, Upload a microscopic image to detect the fungi species.")
 
-    col1, col2 = st.columns([1, 1], gap="large")
+    mode = st.radio("Mode", ["Single image", "Multiple images"], horizontal=True, label_visibility="collapsed")
 
-    with col1:
-        st.subheader("1. Upload Image")
-        uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
-        
-        if uploaded_file is not None:
-            image = Image.open(uploaded_file)
-            st.image(image, caption='Uploaded Microscopic Image', use_container_width=True)
+    if mode == "Single image":
+        col1, col2 = st.columns([1, 1], gap="large")
+
+        with col1:
+            st.subheader("1. Upload Image")
+            uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
             
-            # Convert for OpenCV
-            img_array = np.array(image.convert('RGB'))
-            img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+            if uploaded_file is not None:
+                image_bytes = uploaded_file.getvalue()
+                digest = image_key(image_bytes)
+                preview = thumbnail(digest, image_bytes)
+                if preview is None:
+                    st.error("Could not read this image.")
+                else:
+                    st.image(preview, caption='Uploaded Microscopic Image', channels="BGR", use_container_width=True)
 
-    with col2:
-        st.subheader("2. Classification Results")
-        
-        if uploaded_file is None:
-            st.info("👈 Please upload an image to see the results here.")
+        with col2:
+            st.subheader("2. Classification Results")
+            
+            if uploaded_file is None:
+                st.info("👈 Please upload an image to see the results here.")
+            else:
+                if st.button('Analyze Image', use_container_width=True):
+                    if model is None:
+                        st.error("Model not found! Check your file path.")
+                    else:
+                        with st.spinner('Extracting Features & Predicting...'):
+                            try:
+                                # Prediction Logic (memoized: analyzing the same file again is instant)
+                                features = extract_upload(digest, image_bytes)
+                                names, probabilities = predict_uploads((digest,), [features], model, stamp)
+                                show_result(names[0], probabilities[0])
+
+                            except Exception as e:
+                                st.error(f"Error: {e}")
+
+    else:
+        st.subheader("1. Upload Images")
+        uploaded_files = st.file_uploader("Choose images...", type=["jpg", "jpeg", "png"],
+                                          accept_multiple_files=True)
+
+        if not uploaded_files:
+            st.info("Upload a set of images to classify them together.")
         else:
-            if st.button('Analyze Image', use_container_width=True):
+            uploads = [(f.name, f.getvalue()) for f in uploaded_files]
+            uploads = [(name, data, image_key(data)) for name, data in uploads]
+
+            with st.expander(f"Previews ({len(uploads)} images)", expanded=len(uploads) <= 12):
+                columns = st.columns(6)
+                for i, (name, data, digest) in enumerate(uploads):
+                    preview = thumbnail(digest, data, GRID_THUMBNAIL_SIDE)
+                    if preview is not None:
+                        columns[i % 6].image(preview, caption=name, channels="BGR", use_container_width=True)
+
+            st.subheader("2. Classification Results")
+            if st.button(f'Analyze {len(uploads)} Images', use_container_width=True):
                 if model is None:
                     st.error("Model not found! Check your file path.")
                 else:
-                    with st.spinner('Extracting Features & Predicting...'):
+                    progress = st.progress(0.0, text="Extracting features...")
+                    rows, features, failed = [], [], []
+                    for i, (name, data, digest) in enumerate(uploads):
                         try:
-                            # Prediction Logic
-                            features = extract_all_features(img_bgr)
-                            features = features.reshape(1, -1)
-                            prediction = model.predict(features)[0]
-                            probabilities = model.predict_proba(features)[0]
-                            confidence = max(probabilities)
-
-                            # Classes
-                            classes = ["Candida Albicans", "Aspergillus Niger", "Trichophyton Rubrum", 
-                                       "Trichophyton Mentagrophytes", "Epidermophyton Floccosum"]
-                            
-                            try:
-                                pred_class = classes[int(prediction)]
-                            except:
-                                pred_class = "Unknown Class"
-
-                            # Display Results
-                            st.markdown(f"""
-                                <div class="result-box">
-                                    <h2 style="margin:0; color:#1b5e20;">{pred_class}</h2>
-                                    <p style="margin:0; font-size:18px;">Confidence Score: <b>{confidence*100:.1f}%</b></p>
-                                </div>
-                            """, unsafe_allow_html=True)
-                            
-                            # Bar Chart
-                            st.write("Confidence Level:")
-                            st.progress(float(confidence), text=f"{confidence*100:.1f}%")
-
-                            # Detailed Probabilities Expander
-                            with st.expander("See details for all classes"):
-                                for i, class_name in enumerate(classes):
-                                    prob = probabilities[i]
-                                    st.write(f"**{class_name}**")
-                                    st.progress(float(prob), text=f"{prob*100:.1f}%")
-
+                            features.append(extract_upload(digest, data))
+                            rows.append((name, digest))
                         except Exception as e:
-                            st.error(f"Error: {e}")
+                            failed.append((name, str(e)))
+                        progress.progress((i + 1) / len(uploads), text=f"Extracted {i + 1}/{len(uploads)}")
+
+                    results = []
+                    if rows:
+                        progress.progress(1.0, text="Predicting...")
+                        names, probabilities = predict_uploads(tuple(d for _, d in rows), features, model, stamp)
+                        for (file_name, _), pred_class, probs in zip(rows, names, probabilities):
+                            result = {"File": file_name, "Class": pred_class,
+                                      "Confidence (%)": round(float(max(probs)) * 100, 1)}
+                            result.update({name: round(float(p) * 100, 1) for name, p in zip(CLASS_NAMES, probs)})
+                            results.append(result)
+                    progress.empty()
+
+                    if results:
+                        table = pd.DataFrame(results).sort_values("Confidence (%)", ascending=False)
+                        # click a column header to sort
+                        st.dataframe(table, hide_index=True, use_container_width=True)
+                        st.download_button("Download CSV", table.to_csv(index=False), "fungiscope_results.csv",
+                                           "text/csv")
+                    for file_name, error in failed:
+                        st.error(f"{file_name}: {error}")
 
 # about model page
 elif page == "About Our Model":
@@ -21,6 +21,7 @@ interface PredictionResult {
 
 export function DetectionSection() {
   const [image, setImage] = useState<string | null>(null)
+  const [file, setFile] = useState<File | null>(null)
   const [fileName, setFileName] = useState<string>("")
   const [isLoading, setIsLoading] = useState(false)
   const [result, setResult] = useState<PredictionResult | null>(null)
@@ -29,6 +30,7 @@ export function DetectionSection() {
   const onDrop = useCallback((acceptedFiles: File[]) => {
     const file = acceptedFiles[0]
     if (file) {
+      setFile(file)
       setFileName(file.name)
       setResult(null)
       setError(null)
@@ -49,18 +51,18 @@ export function DetectionSection() {
   })
 
   const handleAnalyze = async () => {
-    if (!image) return
+    if (!image || !file) return
 
     setIsLoading(true)
     setError(null)
 
     try {
+      // send the file itself instead of a base64 data URL in JSON
+      const form = new FormData()
+      form.append("image", file)
       const response = await fetch("/api/classify", {
         method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({ image }),
+        body: form,
       })
 
       if (!response.ok) {
@@ -78,6 +80,7 @@ export function DetectionSection() {
 
   const clearImage = () => {
     setImage(null)
+    setFile(null)
     setFileName("")
     setResult(null)
     setError(null)
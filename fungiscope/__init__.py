@@ -0,0 +1,6 @@
+"""FungiScope: shared image feature extraction and model helpers.
+
+The Streamlit app (``app1.py``), the Flask servers (``render_app.py``,
+``api/index.py``) and the CLI (``scripts/classify_fungi.py``) all import
+from here so the feature vector stays identical across entry points.
+"""
@@ -0,0 +1,228 @@
+"""ASGI front for the Flask servers with a bounded worker pool.
+
+``BoundedASGI(flask_app)`` serves the same routes as the WSGI app, but
+reads request bodies on the event loop, so a slow 12 MP upload costs a
+coroutine instead of a worker thread. Only a fully received request is
+handed to the Flask app, in a fixed-size thread pool (cv2 and NumPy
+release the GIL, so the threads do run in parallel).
+
+Admission control keeps overload from turning into timeouts:
+
+- more than ``max_queue`` requests waiting for a thread: 429 straight
+  away, before the body is read
+- a request not finished within ``deadline`` seconds of arriving: 503; a
+  request still queued at that point is dropped without running
+
+    uvicorn render_asgi:app --host 0.0.0.0 --port 5000 --workers 4
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fungiscope.metrics import METRICS
+from fungiscope.serving import MAX_BATCH_SIZE, MAX_UPLOAD_BYTES
+
+REJECTED = METRICS.counter("fungi_asgi_rejected_total", "Requests refused by admission control", ["reason"])
+QUEUE_WAIT = METRICS.histogram("fungi_asgi_queue_wait_seconds", "Time from arrival until a worker thread picks it up")
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def _environ(scope, body):
+    """WSGI environ for an ASGI http scope whose body has been read."""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(wsgi_app, environ):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = headers
+
+    chunks = wsgi_app(environ, start_response)
+    try:
+        body = b"".join(chunks)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return response["status"], response["headers"], body
+
+
+class BoundedASGI:
+
+    def __init__(self, wsgi_app, threads=None, max_queue=None, deadline=10.0,
+                 max_body=MAX_UPLOAD_BYTES * MAX_BATCH_SIZE):
+        self.wsgi_app = wsgi_app
+        self.threads = threads or min(8, os.cpu_count() or 1)
+        self.max_queue = self.threads * 4 if max_queue is None else max_queue
+        self.deadline = deadline
+        self.max_body = max_body
+        self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="asgi")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        METRICS.collector(self._samples)
+
+    def _samples(self):
+        yield "gauge", "fungi_asgi_queued", "Requests waiting for a worker thread", self._queued
+        yield "gauge", "fungi_asgi_running", "Requests being handled by worker threads", self._running
+
+    def stats(self):
+        return {"threads": self.threads, "max_queue": self.max_queue, "deadline": self.deadline,
+                "queued": self._queued, "running": self._running}
+
+    def _run(self, environ, expires):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            QUEUE_WAIT.observe(time.monotonic() - environ["fungi.arrived"])
+            if time.monotonic() > expires:
+                raise DeadlineExceeded()
+            return _call_wsgi(self.wsgi_app, environ)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        arrived = time.monotonic()
+        expires = arrived + self.deadline
+
+        # cheap checks before the body is read
+        length = dict(scope.get("headers", [])).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_body:
+            REJECTED.inc(reason="too_large")
+            return await _respond(send, 413, f"Upload too large (max {self.max_body} bytes)")
+        if self._queued >= self.max_queue:
+            REJECTED.inc(reason="queue_full")
+            return await _respond(send, 429, "Server busy, retry shortly", retry_after=1)
+
+        try:
+            body = await asyncio.wait_for(_read_body(receive, self.max_body), max(expires - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            REJECTED.inc(reason="deadline")
+            return await _respond(send, 503, "Request deadline exceeded while receiving the upload")
+        except ClientDisconnected:
+            return
+        if body is None:
+            REJECTED.inc(reason="too_large")
+            return await _respond(send, 413, f"Upload too large (max {self.max_body} bytes)")
+
+        environ = _environ(scope, body)
+        environ["fungi.arrived"] = arrived
+        with self._lock:
+            if self._queued >= self.max_queue:
+                full = True
+            else:
+                full = False
+                self._queued += 1
+        if full:
+            REJECTED.inc(reason="queue_full")
+            return await _respond(send, 429, "Server busy, retry shortly", retry_after=1)
+        future = self._executor.submit(self._run, environ, expires)
+        waiter = asyncio.wrap_future(future)
+        try:
+            status, headers, content = await asyncio.wait_for(asyncio.shield(waiter),
+                                                              max(expires - time.monotonic(), 0))
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            # still queued: drop it; already running: let it finish, the answer is lost
+            waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+            if future.cancel():
+                with self._lock:
+                    self._queued -= 1
+            REJECTED.inc(reason="deadline")
+            return await _respond(send, 503, "Request deadline exceeded", retry_after=1)
+
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+        await send({"type": "http.response.body", "body": content})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def _read_body(receive, limit):
+    """The request body, or None once it grows past ``limit``."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _respond(send, status, message, retry_after=None):
+    body = json.dumps({"error": message}).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def asgi_from_env(wsgi_app):
+    """BoundedASGI configured from FUNGI_ASGI_THREADS / _MAX_QUEUE / _DEADLINE_MS."""
+    threads = os.environ.get("FUNGI_ASGI_THREADS")
+    max_queue = os.environ.get("FUNGI_ASGI_MAX_QUEUE")
+    return BoundedASGI(wsgi_app, threads=int(threads) if threads else None,
+                       max_queue=int(max_queue) if max_queue is not None else None,
+                       deadline=float(os.environ.get("FUNGI_ASGI_DEADLINE_MS", 10000)) / 1000)
@@ -0,0 +1,157 @@
+"""Server-side micro-batching of single-image predictions.
+
+Forest/XGBoost ``predict_proba`` has a large fixed cost per call (tree
+iteration setup, joblib dispatch), so under concurrent load it is cheaper
+to score many rows at once. ``MicroBatcher`` sits between the request
+handlers and the model: each handler submits its feature vector and
+blocks; a background thread collects vectors for up to ``max_wait_ms``
+(or until ``max_batch_size`` are queued), runs one batched prediction and
+hands every caller its own row.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from fungiscope.cascade import main_model
+from fungiscope.model import predict_batch
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, float("inf"))
+
+
+class MicroBatcher:
+
+    def __init__(self, model, max_wait_ms=5.0, max_batch_size=32):
+        self.model = model
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._stats = {
+            "batches": 0,
+            "requests": 0,
+            "queue_wait_sum": 0.0,
+            "queue_wait_max": 0.0,
+            "predict_time_sum": 0.0,
+            "batch_size_max": 0,
+            "batch_size_buckets": dict.fromkeys(BATCH_SIZE_BUCKETS, 0),
+        }
+
+    def _ensure_started(self):
+        # started lazily (and again after a fork) so that gunicorn workers
+        # each get their own scheduler thread
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None:
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name="microbatch", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def submit(self, features):
+        """Queue one feature vector; returns a Future of ``(label, probabilities)``."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((np.asarray(features).ravel(), time.perf_counter(), future))
+        return future
+
+    def predict(self, features, timeout=None):
+        return self.submit(features).result(timeout)
+
+    def close(self):
+        """Stop the scheduler thread once the rows already queued are predicted."""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                self._queue.put(None)
+                self._thread = None
+
+    def _collect(self):
+        """Rows for the next batch, and whether ``close`` was called."""
+        item = self._queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch, closed = self._collect()
+            if not batch:
+                break
+            started = time.perf_counter()
+            futures = [future for _, _, future in batch]
+            try:
+                labels, probabilities = predict_batch(self.model, np.vstack([row for row, _, _ in batch]))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                for future, label, probs in zip(futures, labels, probabilities):
+                    future.set_result((label, probs))
+            self._record(batch, started, time.perf_counter())
+
+    def _record(self, batch, started, finished):
+        waits = [started - queued for _, queued, _ in batch]
+        with self._stats_lock:
+            stats = self._stats
+            stats["batches"] += 1
+            stats["requests"] += len(batch)
+            stats["queue_wait_sum"] += sum(waits)
+            stats["queue_wait_max"] = max(stats["queue_wait_max"], max(waits))
+            stats["predict_time_sum"] += finished - started
+            stats["batch_size_max"] = max(stats["batch_size_max"], len(batch))
+            for bound in BATCH_SIZE_BUCKETS:
+                if len(batch) <= bound:
+                    stats["batch_size_buckets"][bound] += 1
+                    break
+
+    def stats(self):
+        """Snapshot of queue-wait and batch-size metrics since start."""
+        with self._stats_lock:
+            stats = dict(self._stats, batch_size_buckets=dict(self._stats["batch_size_buckets"]))
+        batches, requests = stats["batches"], stats["requests"]
+        return {
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch_size": self.max_batch_size,
+            "batches": batches,
+            "requests": requests,
+            "mean_batch_size": requests / batches if batches else 0.0,
+            "max_batch_size_seen": stats["batch_size_max"],
+            "batch_size_buckets": {f"le_{k}": v for k, v in stats["batch_size_buckets"].items()},
+            "mean_queue_wait_ms": stats["queue_wait_sum"] / requests * 1000 if requests else 0.0,
+            "max_queue_wait_ms": stats["queue_wait_max"] * 1000,
+            "mean_predict_ms": stats["predict_time_sum"] / batches * 1000 if batches else 0.0,
+        }
+
+
+def batcher_from_env(model):
+    """Build a MicroBatcher if FUNGI_MICROBATCH_WAIT_MS is set, else None."""
+    wait_ms = os.environ.get("FUNGI_MICROBATCH_WAIT_MS")
+    if not wait_ms or model is None:
+        return None
+    max_size = int(os.environ.get("FUNGI_MICROBATCH_MAX_SIZE", 32))
+    # only rows a cascade's colour stage passed on are batched
+    return MicroBatcher(main_model(model), max_wait_ms=float(wait_ms), max_batch_size=max_size)
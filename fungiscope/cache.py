@@ -0,0 +1,161 @@
+"""Prediction cache in front of feature extraction and the model.
+
+Two tiers:
+
+* exact: keyed on a BLAKE2 hash of the encoded image bytes, checked before
+  anything is decoded;
+* near-duplicate (optional): a 64-bit difference hash of the resized
+  256x256 gray image, so a re-encoded or re-saved copy of a capture is
+  found after decode/resize but before GLCM/LBP/HSV and prediction.
+
+Entries are evicted least-recently-used beyond ``max_entries`` and after
+``ttl`` seconds. When ``model_path`` is given, the cache clears itself as
+soon as that file's mtime/size changes, so predictions from an old model
+are never served.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def image_key(image_bytes):
+    return hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+
+def dhash(gray, hash_size=8):
+    """Difference hash of a gray image as a ``hash_size ** 2``-bit int."""
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _model_stamp(model_path):
+    try:
+        st = os.stat(model_path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class PredictionCache:
+
+    def __init__(self, max_entries=1024, ttl=None, phash_distance=None, model_path=None,
+                 check_interval=1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.phash_distance = phash_distance
+        self.model_path = model_path
+        self.check_interval = check_interval
+        self._entries = OrderedDict()  # key -> (value, phash, expires)
+        self._lock = threading.Lock()
+        self._model_stamp = _model_stamp(model_path) if model_path else None
+        self._checked = time.monotonic()
+        self._counts = dict.fromkeys(["exact_hits", "near_hits", "misses", "evictions", "invalidations"], 0)
+
+    @property
+    def near_duplicates(self):
+        return self.phash_distance is not None
+
+    def _check_model(self, now):
+        # called with the lock held; stat at most once per check_interval
+        if self.model_path is None or now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        stamp = _model_stamp(self.model_path)
+        if stamp != self._model_stamp:
+            self._model_stamp = stamp
+            if self._entries:
+                self._entries.clear()
+                self._counts["invalidations"] += 1
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] is not None and entry[2] <= now:
+            del self._entries[key]
+            self._counts["evictions"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def get(self, key):
+        """Exact-tier lookup by ``image_key``; None if absent."""
+        now = time.monotonic()
+        with self._lock:
+            self._check_model(now)
+            value = self._live(key, now)
+            if value is not None:
+                self._counts["exact_hits"] += 1
+            return value
+
+    def get_near(self, phash):
+        """Closest entry within ``phash_distance`` bits of ``phash``, or None."""
+        if not self.near_duplicates:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._check_model(now)
+            best_key, best_distance = None, self.phash_distance + 1
+            for key, (_, other, _) in self._entries.items():
+                if other is not None:
+                    distance = (phash ^ other).bit_count()
+                    if distance < best_distance:
+                        best_key, best_distance = key, distance
+            value = self._live(best_key, now) if best_key is not None else None
+            if value is not None:
+                self._counts["near_hits"] += 1
+            return value
+
+    def put(self, key, value, phash=None):
+        """Store a freshly computed prediction (each put counts as a miss)."""
+        now = time.monotonic()
+        expires = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._check_model(now)
+            self._counts["misses"] += 1
+            self._entries[key] = (value, phash, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    def alias(self, key, value):
+        """Also file a near-duplicate hit under its own exact key."""
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (value, None, expires)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counts["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            size = len(self._entries)
+        lookups = counts["exact_hits"] + counts["near_hits"] + counts["misses"]
+        hits = counts["exact_hits"] + counts["near_hits"]
+        return dict(counts, size=size, max_entries=self.max_entries, ttl=self.ttl,
+                    phash_distance=self.phash_distance,
+                    hit_rate=hits / lookups if lookups else 0.0)
+
+
+def cache_from_env(model_path=None):
+    """PredictionCache configured from FUNGI_CACHE_* (FUNGI_CACHE_SIZE=0 disables it)."""
+    size = int(os.environ.get("FUNGI_CACHE_SIZE", 1024))
+    if size <= 0:
+        return None
+    ttl = os.environ.get("FUNGI_CACHE_TTL")
+    distance = os.environ.get("FUNGI_CACHE_PHASH_DISTANCE")
+    return PredictionCache(max_entries=size, ttl=float(ttl) if ttl else None,
+                           phash_distance=int(distance) if distance else None,
+                           model_path=model_path)
@@ -0,0 +1,83 @@
+"""Two-stage early-exit cascade: a colour model first, texture only when needed.
+
+The 24 HSV histogram bins cost a fraction of GLCM + LBP, and colour alone
+separates some classes (Aspergillus Niger) well. A ``Cascade`` holds a
+small forest trained on the HSV columns and the main model: the colour
+model answers when its top-class probability reaches ``threshold``, the
+full extraction and the main model run for everything else.
+
+``scripts/train_cascade.py`` trains the colour model, reports accuracy
+and average latency per threshold and writes a cascade directory;
+point FUNGI_MODEL_PATH at it. FUNGI_CASCADE_THRESHOLD overrides the
+threshold chosen at training time.
+
+The servers extract only the HSV group first (see
+``serving.lookup_or_extract``). With FUNGI_EXTRACT_BACKEND=process the
+worker extracts the whole vector, so there only the second model is
+skipped.
+"""
+import json
+import os
+
+import numpy as np
+
+from fungiscope.features import FEATURE_GROUPS
+
+COLOR = "color"
+FULL = "full"
+
+
+class Cascade:
+
+    def __init__(self, color_model, model, threshold):
+        self.color_model = color_model
+        self.model = model
+        self.threshold = threshold
+        self.classes_ = np.asarray(model.classes_)
+        if not np.array_equal(np.asarray(color_model.classes_), self.classes_):
+            raise ValueError("colour model and main model have different classes")
+
+    def predict_color(self, color_features):
+        """``(probabilities, confident)`` of the colour stage for HSV feature rows."""
+        probabilities = self.color_model.predict_proba(np.atleast_2d(color_features))
+        return probabilities, probabilities.max(axis=1) >= self.threshold
+
+    def predict_stages(self, X):
+        """``(probabilities, stages)`` for full feature rows; stages are "color" or "full"."""
+        X = np.atleast_2d(X)
+        probabilities, confident = self.predict_color(X[:, FEATURE_GROUPS["hsv"]])
+        if not confident.all():
+            probabilities[~confident] = self.model.predict_proba(X[~confident])
+        return probabilities, np.where(confident, COLOR, FULL)
+
+    def predict_proba(self, X):
+        return self.predict_stages(X)[0]
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def main_model(model):
+    """The model for rows the colour stage passed on (``model`` itself if not a cascade)."""
+    return model.model if isinstance(model, Cascade) else model
+
+
+def is_cascade(path):
+    try:
+        with open(os.path.join(path, "metadata.json")) as f:
+            return "cascade" in json.load(f)
+    except (OSError, ValueError):
+        return False
+
+
+def load_cascade(path):
+    """Load a directory written by scripts/train_cascade.py."""
+    from fungiscope.forest import load_bundle
+    from fungiscope.model import load_model
+
+    with open(os.path.join(path, "metadata.json")) as f:
+        config = json.load(f)["cascade"]
+    # the main model path is stored relative to the cascade directory
+    model_path = os.path.normpath(os.path.join(path, config["model"]))
+    threshold = float(os.environ.get("FUNGI_CASCADE_THRESHOLD") or config["threshold"])
+    return Cascade(load_bundle(os.path.join(path, "color")), load_model(model_path), threshold)
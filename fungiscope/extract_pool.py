@@ -0,0 +1,146 @@
+"""Feature extraction in a pool of worker processes.
+
+The GLCM and LBP code is NumPy, but between the GIL-free loops it runs
+many small Python-level operations, so extraction threads in one server
+process do not scale to all cores. ``ProcessExtractor`` runs
+``extract_all_features`` in worker processes instead.
+
+Decoded images are not pickled: the caller copies each image into one of
+a fixed set of ``multiprocessing.shared_memory`` slots and the worker
+reads it in place; only the 40-float feature vector (and the dhash, when
+the near-duplicate cache wants it) comes back. A slot grows when a larger
+image arrives, so peak shared memory is ``slots`` times the largest
+decoded image. With every slot in use, callers wait for one to free up.
+
+Select it with FUNGI_EXTRACT_BACKEND=process; FUNGI_EXTRACT_PROCESSES
+sets the pool size (default: the cores this process may run on). Each
+gunicorn worker gets its own pool, so run fewer gunicorn workers with it.
+"""
+import atexit
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+# worker side: slot index -> attached SharedMemory
+_attached = {}
+
+
+def _init_worker():
+    import cv2
+
+    # one process per core already; keep OpenCV from spawning its own threads
+    cv2.setNumThreads(1)
+    # import and run the pipeline once so the first real task is not slower
+    _extract(np.zeros((64, 64, 3), np.uint8), False)
+
+
+def _extract(image, want_phash):
+    from fungiscope.cache import dhash
+    from fungiscope.features import features_from_buffers, prepare_image
+
+    gray, hsv = prepare_image(image)
+    features, _ = features_from_buffers(gray, hsv)
+    return features, dhash(gray) if want_phash else None
+
+
+def _extract_slot(index, name, shape, want_phash):
+    shm = _attached.get(index)
+    if shm is None or shm.name != name:
+        if shm is not None:
+            shm.close()
+        shm = _attached[index] = SharedMemory(name=name)
+    image = np.ndarray(shape, np.uint8, buffer=shm.buf)
+    try:
+        return _extract(image, want_phash)
+    finally:
+        del image
+
+
+def _ready():
+    return os.getpid()
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class ProcessExtractor:
+
+    def __init__(self, processes=None, slots=None):
+        self.processes = processes or available_cores()
+        self._slots = queue.Queue()
+        self._all_slots = []
+        for index in range(slots or 2 * self.processes):
+            self._slots.put(index)
+            self._all_slots.append(None)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._start()
+        atexit.register(self.close)
+
+    def _start(self):
+        self._executor = ProcessPoolExecutor(self.processes, mp_context=get_context("spawn"),
+                                             initializer=_init_worker)
+        # start and warm every process now rather than on the first requests
+        pids = [self._executor.submit(_ready) for _ in range(self.processes)]
+        for future in pids:
+            future.result()
+
+    def _slot(self, index, nbytes):
+        shm = self._all_slots[index]
+        if shm is None or shm.size < nbytes:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            shm = self._all_slots[index] = SharedMemory(create=True, size=max(nbytes, 256 * 256 * 3))
+        return shm
+
+    def extract(self, image, phash=False):
+        """``(features, dhash or None)`` of a decoded BGR image."""
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        index = self._slots.get()
+        try:
+            shm = self._slot(index, image.nbytes)
+            np.ndarray(image.shape, np.uint8, buffer=shm.buf)[...] = image
+            executor = self._executor
+            try:
+                return executor.submit(_extract_slot, index, shm.name, image.shape, phash).result()
+            except BrokenProcessPool:
+                # a worker died (OOM killer, segfault): restart the pool once
+                with self._lock:
+                    if self._executor is executor:
+                        executor.shutdown(wait=False)
+                        self._start()
+                return self._executor.submit(_extract_slot, index, shm.name, image.shape, phash).result()
+        finally:
+            self._slots.put(index)
+
+    def close(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        for shm in self._all_slots:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        self._all_slots = [None] * len(self._all_slots)
+
+
+def extractor_from_env():
+    """ProcessExtractor if FUNGI_EXTRACT_BACKEND=process, else None (extract in-thread)."""
+    backend = os.environ.get("FUNGI_EXTRACT_BACKEND", "thread")
+    if backend == "thread":
+        return None
+    if backend != "process":
+        raise ValueError(f"Unknown FUNGI_EXTRACT_BACKEND: {backend} (expected 'thread' or 'process')")
+    processes = os.environ.get("FUNGI_EXTRACT_PROCESSES")
+    return ProcessExtractor(int(processes) if processes else None)
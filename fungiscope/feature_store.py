@@ -0,0 +1,308 @@
+"""Incremental on-disk feature store for the training dataset.
+
+The store is a directory with one ``.npy`` matrix per feature group
+(rows = images, memory-mappable) and a ``manifest.json`` that records,
+per image, its path, size, mtime and content hash, and per group the
+extractor configuration that produced its columns.
+
+``update_store`` rescans the dataset and only extracts what is missing:
+new images and images whose content changed get every group, and a group
+whose configuration changed (say the LBP radius) is recomputed for every
+image while the other groups are kept. Extraction runs in a process pool.
+
+Two configurations are predefined: ``SERVING_CONFIG`` reproduces
+``extract_all_features`` (the 40 features the servers use) and
+``NOTEBOOK_CONFIG`` the training notebook's ``build_features`` (blur +
+CLAHE gray, 5 GLCM props, LBP P=24 R=3; 55 features).
+"""
+import glob
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+from fungiscope.features import GLCM_LEVELS, HSV_BINS, IMAGE_SIZE, LBP_POINTS, LBP_RADIUS
+from fungiscope.glcm import PROPS as GLCM_PROPS, glcm_features
+from fungiscope.lbp import lbp_histogram
+
+STORE_VERSION = 1
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+
+SERVING_CONFIG = {
+    "order": ["glcm", "lbp", "hsv"],
+    "groups": {
+        "glcm": {"size": IMAGE_SIZE[0], "gray": None, "levels": GLCM_LEVELS, "props": GLCM_PROPS},
+        "lbp": {"size": IMAGE_SIZE[0], "gray": None, "points": LBP_POINTS, "radius": LBP_RADIUS,
+                "normalize": "sum"},
+        "hsv": {"size": IMAGE_SIZE[0], "bins": HSV_BINS},
+    },
+}
+
+_CLAHE = {"blur": 5, "clip_limit": 2.0, "tile": 8}
+
+NOTEBOOK_CONFIG = {
+    "order": ["hsv", "glcm", "lbp"],
+    "groups": {
+        "hsv": {"size": 256, "bins": 8},
+        "glcm": {"size": 256, "gray": _CLAHE, "levels": 256, "props": GLCM_PROPS[:5]},
+        "lbp": {"size": 256, "gray": _CLAHE, "points": 24, "radius": 3, "normalize": "density"},
+    },
+}
+
+PRESETS = {"serving": SERVING_CONFIG, "notebook": NOTEBOOK_CONFIG}
+
+
+def group_key(config):
+    """Stable hash of one group's configuration."""
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def group_width(name, config):
+    if name == "glcm":
+        return len(config["props"])
+    if name == "lbp":
+        return config["points"] + 2
+    if name == "hsv":
+        return 3 * config["bins"]
+    raise ValueError(f"Unknown feature group: {name}")
+
+
+# extraction
+
+def _enhance(gray, spec):
+    if not spec:
+        return gray
+    if spec.get("blur"):
+        gray = cv2.GaussianBlur(gray, (spec["blur"], spec["blur"]), 0)
+    clahe = cv2.createCLAHE(clipLimit=spec["clip_limit"], tileGridSize=(spec["tile"], spec["tile"]))
+    return clahe.apply(gray)
+
+
+def _glcm(gray, config):
+    values = glcm_features(gray, levels=config["levels"])
+    return values[[GLCM_PROPS.index(prop) for prop in config["props"]]]
+
+
+def _lbp(gray, config):
+    hist = lbp_histogram(gray, config["points"], config["radius"]).astype(np.float64)
+    if config["normalize"] == "density":
+        return hist / hist.sum()
+    hist /= (hist.sum() + 1e-7)
+    return hist
+
+
+def _hsv(hsv, config):
+    bins = config["bins"]
+    out = np.empty(3 * bins)
+    for channel, hist_range in enumerate([[0, 180], [0, 256], [0, 256]]):
+        hist = cv2.calcHist([hsv], [channel], None, [bins], hist_range)
+        cv2.normalize(hist, hist)
+        out[channel * bins:(channel + 1) * bins] = hist.ravel()
+    return out
+
+
+def extract_groups(image, groups):
+    """``{name: vector}`` for the requested ``{name: config}`` groups.
+
+    Resizing, color conversion and gray enhancement are shared between
+    groups that use the same settings.
+    """
+    resized, grays, out = {}, {}, {}
+    for name, config in groups.items():
+        size = config["size"]
+        if size not in resized:
+            img = cv2.resize(image, (size, size))
+            resized[size] = img, cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        img, gray = resized[size]
+        if name == "hsv":
+            out[name] = _hsv(cv2.cvtColor(img, cv2.COLOR_BGR2HSV), config)
+            continue
+        gray_key = (size, json.dumps(config.get("gray"), sort_keys=True))
+        if gray_key not in grays:
+            grays[gray_key] = _enhance(gray, config.get("gray"))
+        extract = _glcm if name == "glcm" else _lbp
+        out[name] = extract(grays[gray_key], config)
+    return out
+
+
+def _init_worker():
+    cv2.setNumThreads(1)
+
+
+def _extract_task(task):
+    """Pool worker: hash the file and extract the groups it still needs.
+
+    ``reusable`` names groups whose stored columns are still valid if the
+    content hash matches ``known_hash`` (the file was only touched).
+    """
+    path, relpath, groups, known_hash, reusable = task
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        if reusable and digest == known_hash:
+            groups = {name: config for name, config in groups.items() if name not in reusable}
+        if not groups:
+            return relpath, digest, {}, None
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return relpath, digest, None, "Could not load image"
+        return relpath, digest, extract_groups(image, groups), None
+    except Exception as e:
+        return relpath, None, None, str(e)
+
+
+# store
+
+def scan_dataset(dataset_dir):
+    """``{relpath: (size, mtime_ns)}`` for every image under ``dataset_dir``."""
+    files = {}
+    for path in glob.glob(os.path.join(dataset_dir, "**", "*"), recursive=True):
+        if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+            st = os.stat(path)
+            files[os.path.relpath(path, dataset_dir).replace(os.sep, "/")] = (st.st_size, st.st_mtime_ns)
+    return files
+
+
+def read_manifest(store_dir):
+    path = os.path.join(store_dir, "manifest.json")
+    if not os.path.exists(path):
+        return {"version": STORE_VERSION, "files": [], "groups": {}, "order": []}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != STORE_VERSION:
+        raise ValueError(f"Unsupported feature store version {manifest.get('version')} in {store_dir}")
+    return manifest
+
+
+def _write_array(store_dir, filename, array):
+    target = os.path.join(store_dir, filename)
+    with open(target + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(target + ".tmp", target)
+
+
+def update_store(dataset_dir, store_dir, config=SERVING_CONFIG, workers=None, chunk_size=8, progress=None):
+    """Bring the store in ``store_dir`` up to date with ``dataset_dir``.
+
+    Returns a summary dict (counts of new/changed/unchanged/removed/failed
+    images, rows recomputed per group). ``progress(done, total)`` is
+    called as extraction results arrive.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = read_manifest(store_dir)
+    old_rows = {entry["path"]: (i, entry) for i, entry in enumerate(manifest["files"])}
+    groups = config["groups"]
+    keys = {name: group_key(group) for name, group in groups.items()}
+    stale = {}
+    for name, key in keys.items():
+        info = manifest["groups"].get(name, {})
+        # a group whose matrix went missing is recomputed like a changed one
+        stale[name] = info.get("key") != key or not os.path.exists(os.path.join(store_dir, info["file"]))
+
+    files = scan_dataset(dataset_dir)
+    stale_groups = {name: group for name, group in groups.items() if stale[name]}
+    reusable = [name for name in groups if not stale[name]]
+    tasks, status = [], {}
+    for relpath, (size, mtime_ns) in sorted(files.items()):
+        path = os.path.join(dataset_dir, relpath)
+        entry = old_rows[relpath][1] if relpath in old_rows else None
+        if entry is None:
+            status[relpath] = "new"
+            tasks.append((path, relpath, groups, None, None))
+        elif entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+            status[relpath] = "unchanged"
+            if stale_groups:
+                tasks.append((path, relpath, stale_groups, entry["hash"], None))
+        else:
+            # stat changed: the worker hashes the file and keeps the stored
+            # columns if the content turns out to be identical
+            status[relpath] = "touched"
+            tasks.append((path, relpath, groups, entry["hash"], reusable))
+
+    results = {}
+    if tasks:
+        with Pool(workers, initializer=_init_worker) as pool:
+            for done, result in enumerate(pool.imap_unordered(_extract_task, tasks, chunksize=chunk_size), 1):
+                results[result[0]] = result
+                if progress is not None:
+                    progress(done, len(tasks))
+
+    summary = {"new": 0, "changed": 0, "unchanged": 0, "failed": 0,
+               "removed": len(set(old_rows) - set(files)), "recomputed": dict.fromkeys(groups, 0)}
+    rows, hashes, computed = [], {}, {}
+    for relpath in sorted(files):
+        kind = status[relpath]
+        if relpath in results:
+            _, digest, features, error = results[relpath]
+            if error is not None:
+                summary["failed"] += 1
+                continue
+            hashes[relpath] = digest
+            computed[relpath] = features
+        else:
+            hashes[relpath] = old_rows[relpath][1]["hash"]
+        if kind == "touched":
+            kind = "unchanged" if hashes[relpath] == old_rows[relpath][1]["hash"] else "changed"
+        summary[kind] += 1
+        rows.append(relpath)
+
+    # assemble every group, copying rows that did not need recomputing
+    old_arrays = {}
+    for name, info in manifest["groups"].items():
+        path = os.path.join(store_dir, info["file"])
+        if name in groups and not stale[name]:
+            old_arrays[name] = np.load(path, mmap_mode="r")
+    new_groups = {}
+    for name, group in groups.items():
+        array = np.zeros((len(rows), group_width(name, group)))
+        for i, relpath in enumerate(rows):
+            features = computed.get(relpath) or {}
+            if name in features:
+                array[i] = features[name]
+                summary["recomputed"][name] += 1
+            else:
+                array[i] = old_arrays[name][old_rows[relpath][0]]
+        filename = f"{name}-{keys[name]}.npy"
+        _write_array(store_dir, filename, array)
+        new_groups[name] = {"key": keys[name], "config": group, "file": filename, "width": array.shape[1]}
+    old_arrays.clear()
+
+    manifest = {
+        "version": STORE_VERSION,
+        "order": config["order"],
+        "groups": new_groups,
+        "files": [{"path": relpath, "label": relpath.split("/")[0] if "/" in relpath else "",
+                   "size": files[relpath][0], "mtime_ns": files[relpath][1], "hash": hashes[relpath]}
+                  for relpath in rows],
+    }
+    with open(os.path.join(store_dir, "manifest.json.tmp"), "w") as f:
+        json.dump(manifest, f)
+    os.replace(os.path.join(store_dir, "manifest.json.tmp"), os.path.join(store_dir, "manifest.json"))
+
+    # matrices of replaced configurations
+    current = {info["file"] for info in new_groups.values()}
+    for filename in os.listdir(store_dir):
+        if filename.endswith(".npy") and filename not in current:
+            os.remove(os.path.join(store_dir, filename))
+    summary["rows"] = len(rows)
+    return summary
+
+
+def load_features(store_dir, groups=None, mmap_mode="r"):
+    """``(X, labels, paths)`` from a store; ``groups`` picks and orders columns.
+
+    Labels are the top-level folder of each image (``dataset/<class>/...``).
+    """
+    manifest = read_manifest(store_dir)
+    names = groups or manifest["order"]
+    arrays = [np.load(os.path.join(store_dir, manifest["groups"][name]["file"]), mmap_mode=mmap_mode)
+              for name in names]
+    X = np.hstack(arrays) if arrays else np.empty((len(manifest["files"]), 0))
+    labels = np.array([entry["label"] for entry in manifest["files"]])
+    paths = [entry["path"] for entry in manifest["files"]]
+    return X, labels, paths
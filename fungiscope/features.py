@@ -0,0 +1,161 @@
+import base64
+
+import cv2
+import numpy as np
+
+from fungiscope.glcm import PROPS as GLCM_PROPS, glcm_features
+from fungiscope.lbp import lbp_histogram
+
+# feature layout: 6 GLCM props, 10 uniform LBP bins, 3 x 8 HSV bins
+
+IMAGE_SIZE = (256, 256)
+
+# 32 or 64 quantizes the gray levels first: faster, but the model must be
+# trained with the same setting
+GLCM_LEVELS = 256
+
+LBP_RADIUS = 1
+LBP_POINTS = 8 * LBP_RADIUS
+LBP_BINS = LBP_POINTS + 2
+
+HSV_BINS = 8
+
+FEATURE_GROUPS = {
+    "glcm": slice(0, len(GLCM_PROPS)),
+    "lbp": slice(len(GLCM_PROPS), len(GLCM_PROPS) + LBP_BINS),
+    "hsv": slice(len(GLCM_PROPS) + LBP_BINS, len(GLCM_PROPS) + LBP_BINS + 3 * HSV_BINS),
+}
+N_FEATURES = FEATURE_GROUPS["hsv"].stop
+
+
+# decoding
+
+def decode_data_url(image_data):
+    """Decode a base64 string (optionally a ``data:`` URL) into raw bytes."""
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return base64.b64decode(image_data)
+
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 scale, which is much
+# cheaper than decoding a 4000x3000 capture and resizing it afterwards
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# JPEG start-of-frame markers (baseline, progressive, ...), which carry the size
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(image_bytes):
+    """``(width, height)`` from a JPEG header, or None if not a JPEG."""
+    data = memoryview(image_bytes)
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in _JPEG_SOF:
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+
+def reduced_decode_factor(width, height, min_side=IMAGE_SIZE[0]):
+    """Largest JPEG reduction that keeps both sides >= ``min_side``."""
+    for factor, _ in REDUCED_DECODE_FLAGS:
+        if -(-width // factor) >= min_side and -(-height // factor) >= min_side:
+            return factor
+    return 1
+
+
+def decode_image(image_bytes, min_side=None):
+    """Decode encoded image bytes into a BGR array, or None if unreadable.
+
+    With ``min_side`` set, a JPEG is decoded at 1/2, 1/4 or 1/8 scale when
+    both sides stay >= ``min_side``. The scaled decode averages pixels
+    while the 256x256 resize samples them, so texture features drift;
+    scripts/check_decode.py measures time and drift per ``min_side``.
+    """
+    if not image_bytes:
+        # cv2.imdecode asserts on an empty buffer instead of returning None
+        return None
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    flags = cv2.IMREAD_COLOR
+    if min_side:
+        size = jpeg_size(image_bytes)
+        if size is not None:
+            factor = reduced_decode_factor(*size, min_side=min_side)
+            flags = dict(REDUCED_DECODE_FLAGS).get(factor, cv2.IMREAD_COLOR)
+    return cv2.imdecode(nparr, flags)
+
+
+def prepare_image(image):
+    """Resize once and return the shared gray and HSV buffers."""
+    img = cv2.resize(image, IMAGE_SIZE)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    return gray, hsv
+
+
+# per-group extractors, each working on the shared buffers
+
+def extract_glcm_features(gray, out=None):
+    return glcm_features(gray, levels=GLCM_LEVELS, out=out)
+
+
+def extract_lbp_features(gray, out=None):
+    if out is None:
+        out = np.empty(LBP_BINS)
+    out[:] = lbp_histogram(gray, LBP_POINTS, LBP_RADIUS)
+    out /= (out.sum() + 1e-7)
+    return out
+
+
+def extract_hsv_features(hsv, out=None):
+    if out is None:
+        out = np.empty(3 * HSV_BINS)
+    ranges = [[0, 180], [0, 256], [0, 256]]
+    for channel, hist_range in enumerate(ranges):
+        hist = cv2.calcHist([hsv], [channel], None, [HSV_BINS], hist_range)
+        cv2.normalize(hist, hist)
+        out[channel * HSV_BINS:(channel + 1) * HSV_BINS] = hist.ravel()
+    return out
+
+
+def split_features(features):
+    """Return a dict of per-group views into a feature vector (or matrix)."""
+    return {name: features[..., group] for name, group in FEATURE_GROUPS.items()}
+
+
+def extract_all_features(image):
+    """Compute the full feature vector for a decoded BGR image.
+
+    The image is resized and converted to gray/HSV exactly once; every
+    group writes straight into its slice of the output vector. Returns
+    ``(features, groups)`` where ``groups`` maps "glcm", "lbp" and "hsv"
+    to views of ``features``.
+    """
+    return features_from_buffers(*prepare_image(image))
+
+
+def features_from_buffers(gray, hsv, color=None):
+    """``extract_all_features`` for buffers already made by ``prepare_image``.
+
+    ``color`` is the HSV group when the caller already has it.
+    """
+    features = np.empty(N_FEATURES)
+    groups = split_features(features)
+    extract_glcm_features(gray, out=groups["glcm"])
+    extract_lbp_features(gray, out=groups["lbp"])
+    if color is None:
+        extract_hsv_features(hsv, out=groups["hsv"])
+    else:
+        groups["hsv"][:] = color
+    return features, groups
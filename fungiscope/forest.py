@@ -0,0 +1,387 @@
+"""Array-backed tree ensembles for inference without sklearn/xgboost.
+
+``export_forest`` flattens a fitted ``RandomForestClassifier`` or
+``XGBClassifier`` into a handful of contiguous arrays (split feature,
+threshold, children, leaf values). ``ArrayForest`` evaluates every tree for
+a batch of rows at once: one gather per tree level for all rows x trees,
+instead of walking each estimator through the library call stack.
+
+The arrays are saved as a single ``.npz`` file, or as a directory of
+``.npy`` files (``save_bundle``) that ``load_bundle`` memory-maps read-only
+so every worker process shares the same page-cache pages. Both loaders
+need only NumPy, so a server using them does not import the model
+libraries at all.
+"""
+import json
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+
+class ArrayForest:
+    """Flattened ensemble with the ``predict``/``predict_proba`` interface.
+
+    All trees share one node table; ``roots[t]`` is the first node of tree
+    ``t`` and leaves point at themselves. ``kind`` is ``"rf"`` (leaf values
+    are class probabilities that are averaged, splits are
+    ``x <= threshold``) or ``"xgb"`` (leaf values are margins summed per
+    class then softmaxed, splits are ``x < threshold`` with a per-node
+    default branch for NaN).
+    """
+
+    def __init__(self, kind, feature, threshold, left, right, default_left, value,
+                 roots, tree_class, base_margin, classes, max_depth, n_features,
+                 children=None, is_leaf=None):
+        self.kind = kind
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.value = value
+        self.roots = roots
+        self.tree_class = tree_class
+        self.base_margin = base_margin
+        self.classes_ = classes
+        self.max_depth = int(max_depth)
+        self.n_features_in_ = int(n_features)
+        # digest of the joblib this was exported from, see resolve_model_path
+        self.source = None
+        # child of node n is _children[2 * n + went_right]; both are stored
+        # in bundles so memory-mapped forests do not rebuild them per process
+        self._children = np.column_stack([left, right]).ravel() if children is None else children
+        self._is_leaf = left == np.arange(len(left), dtype=left.dtype) if is_leaf is None else is_leaf
+        # sums each tree's margin into its class column
+        self._tree_onehot = np.zeros((len(roots), len(classes)))
+        self._tree_onehot[np.arange(len(roots)), tree_class] = 1.0
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    def apply(self, X):
+        """Leaf node index for every row and tree, shape (n_rows, n_trees).
+
+        Each round advances every (row, tree) pair that has not reached a
+        leaf yet by one level; pairs that land on a leaf drop out of the
+        active set, so shallow trees stop costing anything early.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        n_rows, n_cols = X.shape
+        flat_x = X.ravel()
+        node = np.tile(self.roots, n_rows)
+        row_start = np.repeat(np.arange(n_rows) * n_cols, self.n_trees)
+        active = np.flatnonzero(~self._is_leaf[node])
+        while active.size:
+            current = node[active]
+            x = flat_x[row_start[active] + self.feature[current]]
+            if self.kind == "xgb":
+                went_right = ~(x < self.threshold[current])
+                missing = np.isnan(x)
+                if missing.any():
+                    went_right[missing] = ~self.default_left[current[missing]]
+            else:
+                went_right = ~(x <= self.threshold[current])
+            current = self._children[2 * current + went_right]
+            node[active] = current
+            active = active[~self._is_leaf[current]]
+        return node.reshape(n_rows, self.n_trees)
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        if self.kind == "rf":
+            return self.value[leaves].mean(axis=1)
+        margin = self.value[leaves, 0] @ self._tree_onehot + self.base_margin
+        margin -= margin.max(axis=1, keepdims=True)
+        np.exp(margin, out=margin)
+        margin /= margin.sum(axis=1, keepdims=True)
+        return margin
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def tree_slices(self):
+        """Node range of every tree (each tree's nodes are contiguous)."""
+        ends = np.append(self.roots[1:], self.n_nodes)
+        return [slice(int(start), int(end)) for start, end in zip(self.roots, ends)]
+
+    def subset(self, trees):
+        """A forest of only the given trees, in the given order.
+
+        For ``rf`` the probabilities become the mean over those trees; for
+        ``xgb`` keep whole boosting rounds (a prefix of the trees) or the
+        margins no longer add up to the model.
+        """
+        slices = self.tree_slices()
+        parts, roots, base = [], [], 0
+        for t in trees:
+            nodes = slices[t]
+            shift = base - nodes.start
+            parts.append((self.feature[nodes], self.threshold[nodes], self.left[nodes] + shift,
+                          self.right[nodes] + shift, self.default_left[nodes], self.value[nodes]))
+            roots.append(base)
+            base += nodes.stop - nodes.start
+        feature, threshold, left, right, default_left, value = (np.concatenate(column) for column in zip(*parts))
+        return ArrayForest(self.kind, feature, threshold, left.astype(self.left.dtype),
+                           right.astype(self.right.dtype), default_left, value,
+                           np.asarray(roots, dtype=np.int32), np.asarray(self.tree_class)[list(trees)],
+                           self.base_margin, self.classes_, self.max_depth, self.n_features_in_)
+
+    def to_float32(self):
+        """Copy with float32 thresholds and leaf values and a narrow feature index.
+
+        ``apply`` compares float32 features, so an ``rf`` threshold rounded
+        down to the nearest float32 takes exactly the same branches
+        (``x <= t`` iff ``x <= float32_floor(t)`` for float32 ``x``); only
+        the leaf values lose precision.
+        """
+        threshold = self.threshold.astype(np.float32)
+        if self.kind == "rf":
+            above = threshold.astype(np.float64) > self.threshold
+            threshold[above] = np.nextafter(threshold[above], np.float32(-np.inf))
+        feature = self.feature.astype(np.uint8 if self.n_features_in_ <= 256 else np.int32)
+        return ArrayForest(self.kind, feature, threshold, self.left, self.right, self.default_left,
+                           self.value.astype(np.float32), self.roots, self.tree_class, self.base_margin,
+                           self.classes_, self.max_depth, self.n_features_in_)
+
+    def _meta(self):
+        meta = {"format_version": FORMAT_VERSION, "kind": self.kind,
+                "max_depth": self.max_depth, "n_features": self.n_features_in_}
+        if self.source:
+            meta["source"] = self.source
+        return meta
+
+    def _arrays(self):
+        return dict(feature=self.feature, threshold=self.threshold, left=self.left,
+                    right=self.right, default_left=self.default_left, value=self.value,
+                    roots=self.roots, tree_class=self.tree_class,
+                    base_margin=self.base_margin, classes=self.classes_)
+
+    def save(self, path):
+        meta = np.frombuffer(json.dumps(self._meta()).encode(), dtype=np.uint8)
+        with open(path, "wb") as f:
+            np.savez(f, meta=meta, **self._arrays())
+
+    def save_bundle(self, path):
+        """Write a directory of ``.npy`` files for ``load_bundle``."""
+        os.makedirs(path, exist_ok=True)
+        arrays = dict(self._arrays(), children=self._children, is_leaf=self._is_leaf)
+        # write then rename, so processes still mapping the old files keep
+        # their (unlinked) inodes instead of seeing them change underneath
+        for name, array in arrays.items():
+            target = os.path.join(path, name + ".npy")
+            with open(target + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(target + ".tmp", target)
+        with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+            json.dump(self._meta(), f)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+
+
+def _from_arrays(meta, arrays, path):
+    if meta["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported forest format {meta['format_version']} in {path}")
+    forest = ArrayForest(meta["kind"], arrays["feature"], arrays["threshold"], arrays["left"],
+                       arrays["right"], arrays["default_left"], arrays["value"], arrays["roots"],
+                       arrays["tree_class"], arrays["base_margin"], arrays["classes"],
+                       meta["max_depth"], meta["n_features"],
+                       children=arrays.get("children"), is_leaf=arrays.get("is_leaf"))
+    forest.source = meta.get("source")
+    return forest
+
+
+def read_meta(path):
+    """Metadata of a ``.npz`` or bundle directory, without loading the trees."""
+    if os.path.isdir(path):
+        with open(os.path.join(path, "meta.json")) as f:
+            return json.load(f)
+    with np.load(path, allow_pickle=False) as data:
+        return json.loads(data["meta"].tobytes().decode())
+
+
+def load_forest(path):
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(data["meta"].tobytes().decode())
+        arrays = {name: data[name] for name in data.files if name != "meta"}
+    return _from_arrays(meta, arrays, path)
+
+
+def load_bundle(path, mmap_mode="r"):
+    """Load a ``save_bundle`` directory, memory-mapping the arrays by default.
+
+    Read-only maps of the same files are backed by the same page-cache
+    pages, so N worker processes hold one copy of the trees between them.
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    arrays = {}
+    for filename in os.listdir(path):
+        if filename.endswith(".npy"):
+            arrays[filename[:-4]] = np.load(os.path.join(path, filename), mmap_mode=mmap_mode,
+                                            allow_pickle=False)
+    return _from_arrays(meta, arrays, path)
+
+
+# exporters
+
+class _NodeTable:
+    """Accumulates trees into one node table, renumbering nodes globally."""
+
+    def __init__(self):
+        self.parts = []
+        self.roots, self.tree_class = [], []
+        self.n_nodes = 0
+        self.max_depth = 0
+
+    def add_tree(self, feature, threshold, left, right, default_left, value, depth, tree_class=0):
+        """Arrays indexed by tree-local node id; leaves have ``feature < 0``."""
+        feature = np.asarray(feature)
+        leaf = feature < 0
+        local = np.arange(len(feature))
+        base = self.n_nodes
+        self.parts.append((
+            np.where(leaf, 0, feature),
+            np.asarray(threshold, dtype=np.float64),
+            base + np.where(leaf, local, left),
+            base + np.where(leaf, local, right),
+            np.asarray(default_left, dtype=bool),
+            np.where(leaf[:, None], value, 0.0),
+        ))
+        self.roots.append(base)
+        self.tree_class.append(tree_class)
+        self.n_nodes += len(feature)
+        self.max_depth = max(self.max_depth, int(np.max(depth)))
+
+    def build(self, kind, base_margin, classes, n_features, threshold_dtype):
+        feature, threshold, left, right, default_left, value = (
+            np.concatenate(column) for column in zip(*self.parts))
+        return ArrayForest(
+            kind,
+            feature.astype(np.int32),
+            threshold.astype(threshold_dtype),
+            left.astype(np.int32),
+            right.astype(np.int32),
+            default_left,
+            value.astype(np.float64),
+            np.asarray(self.roots, dtype=np.int32),
+            np.asarray(self.tree_class, dtype=np.int32),
+            np.asarray(base_margin, dtype=np.float64),
+            np.asarray(classes),
+            self.max_depth,
+            n_features,
+        )
+
+
+def _node_depths(left, right):
+    depth = np.zeros(len(left), dtype=int)
+    # children always have larger ids than their parent in sklearn trees
+    for i in range(len(left)):
+        if left[i] >= 0:
+            depth[left[i]] = depth[right[i]] = depth[i] + 1
+    return depth
+
+
+def _export_sklearn(model, max_depth=None):
+    classes = np.asarray(model.classes_)
+    table = _NodeTable()
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        depth = _node_depths(tree.children_left, tree.children_right)
+        leaf = tree.children_left < 0
+        # tree predict_proba normalizes each leaf's class distribution
+        values = tree.value[:, 0, :].astype(np.float64)
+        totals = values.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1.0
+        feature, threshold, left, right = tree.feature, tree.threshold, tree.children_left, tree.children_right
+        if max_depth is not None and depth.max() > max_depth:
+            # nodes at the cap become leaves with their own class distribution;
+            # everything below them is dropped and the rest renumbered
+            keep = depth <= max_depth
+            leaf = leaf[keep] | (depth[keep] == max_depth)
+            local = np.cumsum(keep) - 1
+            left, right = local[np.maximum(left[keep], 0)], local[np.maximum(right[keep], 0)]
+            feature, threshold = feature[keep], threshold[keep]
+            values, totals, depth = values[keep], totals[keep], depth[keep]
+        table.add_tree(np.where(leaf, -1, feature), threshold, left, right, np.ones(len(leaf), dtype=bool),
+                       values / totals, depth)
+    # sklearn casts X to float32 and compares it against float64 thresholds
+    return table.build("rf", np.zeros(len(classes)), classes, model.n_features_in_, np.float64)
+
+
+def _export_xgboost(model):
+    import xgboost
+
+    booster = model.get_booster()
+    config = json.loads(booster.save_config())
+    n_parallel = int(config["learner"]["gradient_booster"]["gbtree_model_param"]["num_parallel_tree"])
+    classes = np.asarray(model.classes_)
+    if len(classes) <= 2:
+        raise NotImplementedError("only multi-class (softprob) XGBoost models are supported")
+    names = booster.feature_names
+
+    def feature_index(split):
+        if names is not None and split in names:
+            return names.index(split)
+        return int(split.lstrip("f"))
+
+    table = _NodeTable()
+    for t, dump in enumerate(booster.get_dump(dump_format="json")):
+        # leaves carry no "depth" key in the dump, so track it while walking
+        flat, depths = {}, {}
+        stack = [(json.loads(dump), 0)]
+        while stack:
+            node, depth = stack.pop()
+            flat[node["nodeid"]] = node
+            depths[node["nodeid"]] = depth
+            stack.extend((child, depth + 1) for child in node.get("children", []))
+        order = sorted(flat)
+        local = {nodeid: i for i, nodeid in enumerate(order)}
+        columns = {"feature": [], "threshold": [], "left": [], "right": [],
+                   "default_left": [], "value": [], "depth": []}
+        for nodeid in order:
+            node = flat[nodeid]
+            leaf = "leaf" in node
+            columns["feature"].append(-1 if leaf else feature_index(node["split"]))
+            columns["threshold"].append(0.0 if leaf else node["split_condition"])
+            columns["left"].append(0 if leaf else local[node["yes"]])
+            columns["right"].append(0 if leaf else local[node["no"]])
+            columns["default_left"].append(not leaf and node["missing"] == node["yes"])
+            columns["value"].append([node["leaf"] if leaf else 0.0])
+            columns["depth"].append(depths[nodeid])
+        table.add_tree(tree_class=(t // n_parallel) % len(classes), **columns)
+
+    n_features = booster.num_features()
+    forest = table.build("xgb", np.zeros(len(classes)), classes, n_features, np.float32)
+    # The intercept is stored differently across xgboost versions; recover
+    # it as the booster's margin minus the sum of leaf values on a probe row
+    probe = np.zeros((1, n_features), dtype=np.float32)
+    margin = booster.predict(xgboost.DMatrix(probe), output_margin=True).reshape(-1)
+    leaves = forest.apply(probe)[0]
+    leaf_sum = np.array([forest.value[leaves[forest.tree_class == k], 0].sum()
+                         for k in range(len(classes))])
+    forest.base_margin = (margin - leaf_sum).astype(np.float64)
+    return forest
+
+
+def export_forest(model, max_depth=None):
+    """Flatten a fitted RandomForestClassifier or XGBClassifier.
+
+    ``max_depth`` cuts random-forest trees at that depth, turning the nodes
+    there into leaves (not supported for XGBoost, whose inner nodes carry
+    no values).
+    """
+    if hasattr(model, "get_booster"):
+        if max_depth is not None:
+            raise NotImplementedError("max_depth is only supported for random forests")
+        return _export_xgboost(model)
+    if hasattr(model, "estimators_") and hasattr(model.estimators_[0], "tree_"):
+        return _export_sklearn(model, max_depth)
+    raise TypeError(f"Cannot export {type(model).__name__}: expected a random forest or XGBoost classifier")
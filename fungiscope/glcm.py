@@ -0,0 +1,121 @@
+"""Gray-level co-occurrence features without building a dense float GLCM.
+
+skimage's ``graycomatrix`` allocates and normalizes a levels x levels x 1 x 4
+float64 matrix, and every ``graycoprops`` call sweeps all of it again. Here
+the pair counts for all four offsets come from a single integer
+``np.bincount``, folded onto the upper triangle (pairs keyed on
+``(min, max)``), and the properties are read off compact statistics of it:
+
+* the ``|i - j|`` histogram (the diagonals): contrast, dissimilarity,
+  homogeneity,
+* the marginal histogram (row + column sums): mean and variance, and with
+  the contrast the covariance, hence correlation,
+* the sum of squared counts: ASM and energy.
+
+At 256 levels the result matches ``graycomatrix(..., symmetric=True,
+normed=True)`` + ``graycoprops(...).mean()`` up to floating-point rounding.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+PROPS = ['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM']
+
+# (row, col) offsets for distance 1 at angles 0, 45, 90 and 135 degrees,
+# i.e. round(sin(angle)), round(cos(angle)) as skimage computes them
+OFFSETS = [(0, 1), (1, 1), (1, 0), (1, -1)]
+
+
+def quantize(gray, levels):
+    """Map 8-bit gray values onto ``levels`` bins (levels must divide 256)."""
+    if levels == 256:
+        return gray
+    if levels < 2 or 256 % levels:
+        raise ValueError(f"levels must be a divisor of 256, got {levels}")
+    return gray // (256 // levels)
+
+
+def pair_counts(gray, levels=256):
+    """Folded pair counts for every offset in one ``bincount``.
+
+    Returns an int64 array of shape ``(len(OFFSETS), levels * (levels + 1))``.
+    Row ``k`` holds the upper triangle of ``C + C.T`` for offset ``k``
+    (diagonal cells hold ``C_ii``) as a ``levels x levels`` block followed
+    by ``levels`` zero bins, which lets ``_diagonal_sums`` read the
+    diagonals through a strided view without copying.
+    """
+    gray = quantize(np.asarray(gray, dtype=np.uint8), levels)
+    rows, cols = gray.shape
+    block = levels * (levels + 1)
+    codes = np.empty(len(OFFSETS) * rows * cols, dtype=np.intp)
+    start = 0
+    for k, (dr, dc) in enumerate(OFFSETS):
+        c0, c1 = max(0, -dc), cols - max(0, dc)
+        first = gray[:rows - dr, c0:c1]
+        second = gray[dr:, c0 + dc:c1 + dc]
+        code = codes[start:start + first.size].reshape(first.shape)
+        np.minimum(first, second, out=code, casting='unsafe')
+        code *= levels
+        code += np.maximum(first, second)
+        code += k * block
+        start += first.size
+    counts = np.bincount(codes[:start], minlength=len(OFFSETS) * block)
+    return counts.reshape(len(OFFSETS), block)
+
+
+def _diagonal_sums(counts, levels):
+    """Sum of each upper diagonal, i.e. the histogram of ``|i - j|``."""
+    # cell (i, i + d) sits at i * (levels + 1) + d; past the last column the
+    # view runs into the (empty) lower triangle or the zero padding
+    step = counts.strides[1]
+    view = as_strided(counts, shape=(counts.shape[0], levels, levels),
+                      strides=(counts.strides[0], (levels + 1) * step, step))
+    return view.sum(axis=1)
+
+
+def glcm_props(counts, levels=256):
+    """Symmetric, normalized GLCM properties, shape ``(len(PROPS), n_offsets)``."""
+    n_offsets = counts.shape[0]
+    joint = counts[:, :levels * levels].reshape(n_offsets, levels, levels)
+    diff = _diagonal_sums(counts, levels).astype(np.float64)
+    n_pairs = diff.sum(axis=1)
+    n_pairs[n_pairs == 0] = 1
+    diff /= n_pairs[:, None]
+
+    d = np.arange(levels, dtype=np.float64)
+    contrast = diff @ (d * d)
+    dissimilarity = diff @ d
+    homogeneity = diff @ (1.0 / (1.0 + d * d))
+
+    # Both marginals of C + C.T are the row + column sums of the folded
+    # triangle. E[(i - mu)(j - mu)] = var - E[(i - j)^2] / 2 keeps the
+    # covariance centered instead of forming E[ij] - mu^2.
+    marginal = (joint.sum(axis=1) + joint.sum(axis=2)) / (2 * n_pairs[:, None])
+    mean = marginal @ d
+    var = (marginal * (d - mean[:, None]) ** 2).sum(axis=1)
+    cov = var - contrast / 2
+    std = np.sqrt(var)
+    correlation = np.ones(n_offsets)
+    ok = std >= 1e-15
+    correlation[ok] = cov[ok] / var[ok]
+
+    # Off-diagonal cells of the triangle appear twice in C + C.T and the
+    # diagonal holds C_ii where C + C.T has 2 * C_ii, so
+    # sum((C + C.T)^2) = 2 * sum(T^2) + 2 * sum(diag(T)^2).
+    diagonal = joint.diagonal(axis1=1, axis2=2)
+    squares = 2 * np.einsum('kij,kij->k', joint, joint) + 2 * np.einsum('ki,ki->k', diagonal, diagonal)
+    asm = squares / (4 * n_pairs * n_pairs)
+    energy = np.sqrt(asm)
+
+    by_name = {'contrast': contrast, 'dissimilarity': dissimilarity,
+               'homogeneity': homogeneity, 'energy': energy,
+               'correlation': correlation, 'ASM': asm}
+    return np.array([by_name[prop] for prop in PROPS])
+
+
+def glcm_features(gray, levels=256, out=None):
+    """The six GLCM properties averaged over the four angles."""
+    props = glcm_props(pair_counts(gray, levels), levels)
+    if out is None:
+        return props.mean(axis=1)
+    out[:] = props.mean(axis=1)
+    return out
@@ -0,0 +1,111 @@
+"""Uniform local binary patterns on uint8 images.
+
+A drop-in for ``skimage.feature.local_binary_pattern(gray, P, R,
+method='uniform')`` followed by a histogram, without the float64 LBP image:
+each neighbour is compared against the centre with whole-array operations,
+the comparison bits are packed into an integer code image and mapped to
+uniform-pattern labels, and the labels are counted with ``np.bincount``.
+
+Sampling replicates skimage exactly: neighbour ``i`` sits at
+``(-R sin(2 pi i / P), R cos(2 pi i / P))`` rounded to 5 decimals,
+off-grid neighbours are bilinearly interpolated with the same float64
+operations in the same order, and pixels outside the image read as 0. Note
+that skimage counts 0/1 transitions along the bit string without wrapping
+around from the last bit to the first; the labels here do the same, so the
+histograms are bit-identical.
+"""
+import numpy as np
+
+
+def sample_offsets(points, radius):
+    """Neighbour (row, col) offsets, rounded as skimage rounds them."""
+    angles = 2 * np.pi * np.arange(points, dtype=np.float64) / points
+    rows = np.round(-radius * np.sin(angles), 5)
+    cols = np.round(radius * np.cos(angles), 5)
+    return rows, cols
+
+
+def uniform_lut(points=8):
+    """Uniform label for every ``points``-bit code (bit i = neighbour i)."""
+    codes = np.arange(2 ** points)
+    bits = (codes[:, None] >> np.arange(points)) & 1
+    changes = (bits[:, :-1] != bits[:, 1:]).sum(axis=1)
+    return np.where(changes <= 2, bits.sum(axis=1), points + 1).astype(np.uint8)
+
+
+UNIFORM_LUT_8 = uniform_lut(8)
+
+
+def _neighbour_bits(gray, points, radius, row_offset=0):
+    """Yield a boolean ``neighbour >= centre`` image for each neighbour."""
+    rows, cols = gray.shape
+    pad = int(np.ceil(radius)) + 1
+    padded = np.pad(gray, pad)
+    padded_f = center = None
+    r_idx = np.arange(row_offset, row_offset + rows, dtype=np.float64)
+    c_idx = np.arange(cols, dtype=np.float64)
+
+    for rp, cp in zip(*sample_offsets(points, radius)):
+        if rp % 1 == 0 and cp % 1 == 0:
+            # on-grid neighbour: integer comparison on the uint8 image
+            r0, c0 = pad + int(rp), pad + int(cp)
+            yield padded[r0:r0 + rows, c0:c0 + cols] >= gray
+            continue
+
+        if padded_f is None:
+            padded_f = padded.astype(np.float64)
+            center = gray.astype(np.float64)
+            top, bottom, tmp = (np.empty(gray.shape) for _ in range(3))
+        # skimage takes dr, dc as (r + rp) - floor(r + rp) per pixel, so the
+        # weights are computed per row and per column, not once per offset
+        rr, cc = r_idx + rp, c_idx + cp
+        minr, minc = np.floor(rr), np.floor(cc)
+        dr = (rr - minr)[:, None]
+        dc = cc - minc
+        r0, c0 = pad + int(minr[0]) - row_offset, pad + int(minc[0])
+        r1 = r0 + (1 if rp % 1 else 0)
+        c1 = c0 + (1 if cp % 1 else 0)
+
+        # (1 - dc) * tl + dc * tr, (1 - dc) * bl + dc * br, then
+        # (1 - dr) * top + dr * bottom: same operations as skimage, in place
+        np.multiply(padded_f[r0:r0 + rows, c0:c0 + cols], 1 - dc, out=top)
+        top += np.multiply(padded_f[r0:r0 + rows, c1:c1 + cols], dc, out=tmp)
+        np.multiply(padded_f[r1:r1 + rows, c0:c0 + cols], 1 - dc, out=bottom)
+        bottom += np.multiply(padded_f[r1:r1 + rows, c1:c1 + cols], dc, out=tmp)
+        top *= 1 - dr
+        top += np.multiply(bottom, dr, out=tmp)
+        top -= center
+        yield top >= 0
+
+
+def uniform_lbp(gray, points=8, radius=1, row_offset=0):
+    """Uniform LBP label image (uint8, values 0..points + 1).
+
+    ``row_offset`` is the row of ``gray`` within a larger image: the
+    interpolation weights depend on the absolute row, so a strip labelled
+    with its offset matches the labels of the whole image.
+    """
+    gray = np.ascontiguousarray(gray, dtype=np.uint8)
+    if points <= 8:
+        codes = np.zeros(gray.shape, dtype=np.uint8)
+        for i, bit in enumerate(_neighbour_bits(gray, points, radius, row_offset)):
+            codes |= bit.view(np.uint8) << i
+        lut = UNIFORM_LUT_8 if points == 8 else uniform_lut(points)
+        return lut[codes]
+
+    # too many bits for a lookup table: count ones and transitions directly
+    ones = np.zeros(gray.shape, dtype=np.uint8)
+    changes = np.zeros(gray.shape, dtype=np.uint8)
+    previous = None
+    for bit in _neighbour_bits(gray, points, radius, row_offset):
+        ones += bit
+        if previous is not None:
+            changes += bit != previous
+        previous = bit
+    ones[changes > 2] = points + 1
+    return ones
+
+
+def lbp_histogram(gray, points=8, radius=1):
+    """Counts of each uniform label, length ``points + 2``."""
+    return np.bincount(uniform_lbp(gray, points, radius).ravel(), minlength=points + 2)
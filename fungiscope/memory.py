@@ -0,0 +1,86 @@
+"""Per-process memory figures for sizing worker counts.
+
+On Linux ``/proc/<pid>/smaps_rollup`` splits resident memory into pages
+shared with other processes (the memory-mapped or preloaded model) and
+pages private to this one. PSS divides every shared page by the number of
+processes mapping it, so the PSS of all workers adds up to their real
+footprint.
+"""
+import os
+import resource
+import threading
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared_clean",
+    "Shared_Dirty": "shared_dirty",
+    "Private_Clean": "private_clean",
+    "Private_Dirty": "private_dirty",
+}
+
+
+def process_memory(pid="self"):
+    """Memory of a process in bytes: rss, pss, shared, private (Linux), else just rss."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        # no /proc: peak RSS of this process (kB on Linux, bytes on macOS)
+        scale = 1 if os.uname().sysname == "Darwin" else 1024
+        return {"pid": os.getpid(), "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale}
+    memory = {}
+    for line in lines:
+        key, _, value = line.partition(":")
+        if key in _FIELDS:
+            memory[_FIELDS[key]] = int(value.split()[0]) * 1024
+    memory["shared"] = memory.get("shared_clean", 0) + memory.get("shared_dirty", 0)
+    memory["private"] = memory.get("private_clean", 0) + memory.get("private_dirty", 0)
+    memory["pid"] = os.getpid() if pid == "self" else int(pid)
+    return memory
+
+
+class PeakRSS:
+    """Context manager tracking the peak RSS of this process while it is open.
+
+    A daemon thread samples ``/proc/self/statm`` every ``interval`` seconds;
+    ``peak`` and ``start`` are in bytes, ``delta`` is how far it grew.
+    Without /proc it falls back to the lifetime ``ru_maxrss``.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _rss():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * _PAGE_SIZE
+        except OSError:
+            scale = 1 if os.uname().sysname == "Darwin" else 1024
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+    def __enter__(self):
+        self.start = self.peak = self._rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+    @property
+    def delta(self):
+        return self.peak - self.start
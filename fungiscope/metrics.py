@@ -0,0 +1,370 @@
+"""Prometheus metrics and Server-Timing headers for the Flask servers.
+
+``instrument(app)`` adds a ``/metrics`` endpoint in the Prometheus text
+format and an ``after_request`` hook that counts requests by endpoint and
+status, observes request latency and payload size, and sets a
+``Server-Timing`` header with the stages of that request, e.g.
+``decode;dur=2.1, extract;dur=9.8, predict;dur=0.6, total;dur=13.0``.
+
+Stages are timed with ``stage(name)`` (see ``fungiscope.serving``); each
+one is observed in ``fungi_stage_seconds`` and, inside a request, added to
+that request's header. Everything is plain counters behind a lock, a few
+microseconds per request, so it can stay on at full load.
+
+Every gunicorn worker has its own counters. Set FUNGI_METRICS_DIR to a
+directory shared by the workers and each one writes a snapshot there (at
+most once a second, and on every scrape); ``/metrics`` then sums counters
+and histograms over all workers and labels gauges with the worker pid.
+"""
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 1 KB .. 64 MB
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+
+SNAPSHOT_INTERVAL = 1.0
+
+# (stage, seconds) of the request being handled, None outside requests
+_timings = contextvars.ContextVar("fungi_timings", default=None)
+
+
+class Metric:
+    """A counter, gauge or histogram with optional labels."""
+
+    def __init__(self, kind, name, help, labelnames=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else ()
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # one count per bucket plus +Inf, then the sum
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[i] += 1
+            entry[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(key), list(value) if isinstance(value, list) else value]
+                      for key, value in self._values.items()]
+        return {"kind": self.kind, "help": self.help, "labelnames": list(self.labelnames),
+                "buckets": list(self.buckets), "values": values}
+
+
+class Registry:
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    def _get(self, kind, name, help, labelnames=(), buckets=None):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Metric(kind, name, help, labelnames, buckets)
+            return self._metrics[name]
+
+    def counter(self, name, help, labelnames=()):
+        return self._get("counter", name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get("gauge", name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._get("histogram", name, help, labelnames, buckets)
+
+    def collector(self, collect):
+        """``collect()`` yields ``(kind, name, help, value)`` samples at scrape time."""
+        self._collectors.append(collect)
+
+    def snapshot(self):
+        metrics = {name: metric.snapshot() for name, metric in list(self._metrics.items())}
+        for collect in self._collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                print(f"metrics collector failed: {e}")
+                continue
+            for kind, name, help, value in samples:
+                metrics[name] = {"kind": kind, "help": help, "labelnames": [], "buckets": [],
+                                 "values": [[[], value]]}
+        return metrics
+
+    def write_snapshot(self, force=False):
+        """Write this process's snapshot to ``directory`` (at most once per interval)."""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_write < SNAPSHOT_INTERVAL:
+            return
+        self._last_write = now
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        if not self.directory:
+            return _render(self.snapshot())
+        self.write_snapshot(force=True)
+        return _render(_merge(_read_snapshots(self.directory)))
+
+
+def _read_snapshots(directory):
+    snapshots = {}
+    for filename in os.listdir(directory):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshots[int(filename[:-5])] = json.load(f)
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(snapshots):
+    """Sum counters and histograms over workers; gauges of live workers get a pid label."""
+    merged = {}
+    for pid, metrics in sorted(snapshots.items()):
+        alive = _alive(pid)
+        for name, metric in metrics.items():
+            gauge = metric["kind"] == "gauge"
+            if gauge and not alive:
+                continue
+            target = merged.setdefault(name, dict(metric, values={}))
+            if gauge:
+                target["labelnames"] = metric["labelnames"] + ["pid"]
+            for labels, value in metric["values"]:
+                key = tuple(labels + [str(pid)] if gauge else labels)
+                if key not in target["values"]:
+                    target["values"][key] = value
+                elif isinstance(value, list):
+                    target["values"][key] = [a + b for a, b in zip(target["values"][key], value)]
+                else:
+                    target["values"][key] += value
+    for metric in merged.values():
+        metric["values"] = [[list(key), value] for key, value in metric["values"].items()]
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _render(metrics):
+    lines = []
+    for name, metric in sorted(metrics.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric["labelnames"]
+        for labels, value in metric["values"]:
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + [float("inf")], value[:-1]):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{name}_bucket{_labels(names, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, labels)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(names, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+METRICS = Registry(os.environ.get("FUNGI_METRICS_DIR") or None)
+
+REQUESTS = METRICS.counter("fungi_requests_total", "HTTP requests by endpoint and status",
+                           ["endpoint", "method", "status"])
+ERRORS = METRICS.counter("fungi_request_errors_total", "HTTP responses with status >= 400",
+                         ["endpoint", "status"])
+LATENCY = METRICS.histogram("fungi_request_duration_seconds", "Request latency", ["endpoint"])
+PAYLOAD = METRICS.histogram("fungi_request_size_bytes", "Request body size", ["endpoint"], SIZE_BUCKETS)
+STAGES = METRICS.histogram("fungi_stage_seconds", "Time per pipeline stage (decode, extract, predict)",
+                           ["stage"])
+MODEL_LOAD = METRICS.gauge("fungi_model_load_seconds", "Time the last model load took")
+MODEL_LOADED_AT = METRICS.gauge("fungi_model_loaded_timestamp_seconds", "Unix time of the last model load")
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage into ``fungi_stage_seconds`` and the Server-Timing header."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGES.observe(elapsed, stage=name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+@contextmanager
+def model_load():
+    """Time a model load into ``fungi_model_load_seconds``."""
+    start = time.perf_counter()
+    yield
+    MODEL_LOAD.set(time.perf_counter() - start)
+    MODEL_LOADED_AT.set(time.time())
+
+
+def server_timing(timings, total):
+    """Server-Timing value; repeated stages (batch items) are summed."""
+    durations, counts = {}, {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+        counts[name] = counts.get(name, 0) + 1
+    parts = []
+    for name, seconds in durations.items():
+        desc = f';desc="{counts[name]}x"' if counts[name] > 1 else ""
+        parts.append(f"{name}{desc};dur={seconds * 1000:.1f}")
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _resolve(source):
+    return source() if callable(source) else source
+
+
+def cache_samples(source):
+    def collect():
+        cache = _resolve(source)
+        if cache is None:
+            return
+        stats = cache.stats()
+        for result in ("exact_hits", "near_hits", "misses"):
+            yield "counter", f"fungi_cache_{result}_total", f"Prediction cache {result.replace('_', ' ')}", \
+                stats[result]
+        yield "counter", "fungi_cache_evictions_total", "Prediction cache evictions", stats["evictions"]
+        yield "counter", "fungi_cache_invalidations_total", "Cache clears after a model change", \
+            stats["invalidations"]
+        yield "gauge", "fungi_cache_entries", "Prediction cache entries", stats["size"]
+    return collect
+
+
+def batcher_samples(source):
+    def collect():
+        batcher = _resolve(source)
+        if batcher is None:
+            return
+        stats = batcher.stats()
+        yield "counter", "fungi_microbatch_batches_total", "Micro-batches predicted", stats["batches"]
+        yield "counter", "fungi_microbatch_requests_total", "Requests served by micro-batches", stats["requests"]
+        yield "counter", "fungi_microbatch_queue_wait_seconds_total", "Time requests waited for their batch", \
+            stats["mean_queue_wait_ms"] * stats["requests"] / 1000
+    return collect
+
+
+def memory_samples():
+    from fungiscope.memory import process_memory
+
+    memory = process_memory()
+    for key in ("rss", "pss", "shared", "private"):
+        if key in memory:
+            yield "gauge", f"fungi_process_{key}_bytes", f"Process memory ({key})", memory[key]
+
+
+def instrument(app, cache=None, batcher=None, path="/metrics", registry=METRICS):
+    """Add request metrics, Server-Timing headers and a ``path`` endpoint to a Flask app.
+
+    ``cache`` and ``batcher`` (objects or callables returning them, for
+    apps that create them lazily) are exported as ``fungi_cache_*`` and
+    ``fungi_microbatch_*``.
+    """
+    from flask import Response, request
+
+    if cache is not None:
+        registry.collector(cache_samples(cache))
+    if batcher is not None:
+        registry.collector(batcher_samples(batcher))
+    registry.collector(memory_samples)
+
+    @app.before_request
+    def _start_timing():
+        request.environ["fungi.start"] = time.perf_counter()
+        _timings.set([])
+
+    @app.after_request
+    def _record(response):
+        start = request.environ.get("fungi.start")
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        status = response.status_code
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+        if status >= 400:
+            ERRORS.inc(endpoint=endpoint, status=status)
+        LATENCY.observe(elapsed, endpoint=endpoint)
+        if request.content_length:
+            PAYLOAD.observe(request.content_length, endpoint=endpoint)
+        response.headers["Server-Timing"] = server_timing(_timings.get() or (), elapsed)
+        # lets browsers expose the header to cross-origin pages (Resource Timing)
+        response.headers.setdefault("Timing-Allow-Origin", "*")
+        registry.write_snapshot()
+        return response
+
+    @app.teardown_request
+    def _stop_timing(exc=None):
+        _timings.set(None)
+
+    @app.route(path, methods=["GET"])
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return app
@@ -0,0 +1,404 @@
+"""Hot model reload for the servers.
+
+``ModelRegistry`` owns the model a server answers with. A reload loads the
+new artifact on a background thread, warms it up, checks it against a
+canary feature set and only then swaps it in, so requests never see a
+half-loaded or broken model and the workers keep serving while it loads.
+
+Each loaded model is an ``ActiveModel`` with its own prediction cache and
+micro-batcher, so a swap can never mix predictions of two models. A
+request takes the active model once with ``registry.use()`` and keeps it
+to the end: in-flight requests finish on the old model, new ones get the
+new model, and the old model's batcher is closed when its last request
+is done. Responses carry ``model_version`` and ``/metrics`` has
+``fungi_model_info{version=...}`` and ``fungi_model_reloads_total``.
+
+What to serve comes from FUNGI_MODEL_DIR, a directory of artifacts
+(``scripts/train_model.py`` output, ``.forest`` bundles, ``.npz`` or
+``.joblib`` files): the one named in its ``ACTIVE`` file, else the newest.
+Without it the server's own model path is watched. Every worker polls
+that every FUNGI_MODEL_WATCH_INTERVAL seconds (default 5 with a model
+directory, else 0 = only on request) and reloads once a changed model has
+looked the same on two polls, so a copy still being written is not
+picked up. ``POST .../admin/model`` (enabled by FUNGI_ADMIN_TOKEN) reloads
+on demand or, with ``{"model": "<name>"}``, rewrites ``ACTIVE`` so every
+gunicorn worker follows on its next poll. Reloads happen in each worker
+after the fork: a joblib model becomes a private copy per worker, while a
+bundle (``.forest``, artifact directory) is memory-mapped and stays shared.
+
+The canary is FUNGI_CANARY_PATH, an ``.npz`` from ``scripts/make_canary.py``
+with feature rows ``X`` and optional labels ``y``; without it a few
+synthetic images are used. A new model is rejected if it fails on the
+rows, gives non-finite probabilities or rows that do not sum to 1,
+changes the class list, or (with labels) scores below
+FUNGI_CANARY_MIN_ACCURACY.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from fungiscope.metrics import METRICS, model_load
+from fungiscope.model import load_model, predict_batch
+
+ACTIVE_FILE = "ACTIVE"
+MODEL_SUFFIXES = (".joblib", ".npz", ".forest")
+
+MODEL_INFO = METRICS.gauge("fungi_model_info", "Model version serving new requests (1) in this process",
+                           ["version"])
+MODEL_RELOADS = METRICS.counter("fungi_model_reloads_total", "Model reloads by result (ok, rejected, failed)",
+                                ["result"])
+
+
+class CanaryError(ValueError):
+    """A new model failed validation and was not swapped in."""
+
+
+class ActiveModel:
+    """A loaded model and what is bound to it; never changed after the swap."""
+
+    def __init__(self, model, path, version, stamp, cache=None, batcher=None, canary=None):
+        self.model = model
+        self.path = path
+        self.version = version
+        self.stamp = stamp
+        self.cache = cache
+        self.batcher = batcher
+        self.canary = canary or {}
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.retired = False
+
+    @property
+    def predict(self):
+        return self.batcher.predict if self.batcher is not None else None
+
+    def close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.cache is not None:
+            self.cache.clear()
+
+    def describe(self):
+        return {"version": self.version, "path": self.path, "loaded_at": self.loaded_at,
+                "in_flight": self.in_flight, "canary": self.canary}
+
+
+def model_stamp(path):
+    """Identity of a model file, or of the metadata an artifact directory writes last.
+
+    ``(real path, inode, mtime_ns, ctime_ns, size)``: a copy that keeps the
+    old mtime (``cp -p``, ``shutil.copytree``) still gets a new inode and ctime.
+    """
+    real = os.path.realpath(path)
+    target = real
+    if os.path.isdir(real):
+        for name in ("metadata.json", "meta.json"):
+            if os.path.exists(os.path.join(real, name)):
+                target = os.path.join(real, name)
+                break
+    st = os.stat(target)
+    return real, st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size
+
+
+def model_version(path, stamp):
+    """``<name>@<hash>``: the artifact name plus a hash of the file identity."""
+    name = os.path.basename(stamp[0].rstrip(os.sep))
+    metadata = os.path.join(stamp[0], "metadata.json")
+    if os.path.isfile(metadata):
+        try:
+            with open(metadata) as f:
+                name = json.load(f).get("name") or name
+        except (OSError, ValueError):
+            pass
+    digest = hashlib.sha1(repr(stamp).encode()).hexdigest()[:8]
+    return f"{name}@{digest}"
+
+
+def _is_model(path):
+    if os.path.isdir(path):
+        return path.endswith(".forest") or os.path.exists(os.path.join(path, "metadata.json"))
+    return path.endswith(MODEL_SUFFIXES)
+
+
+def active_in_dir(model_dir):
+    """The model named in ``<model_dir>/ACTIVE``, else the newest model there."""
+    pointer = os.path.join(model_dir, ACTIVE_FILE)
+    if os.path.exists(pointer):
+        with open(pointer) as f:
+            name = f.read().strip()
+        if name:
+            return os.path.join(model_dir, name)
+    candidates = [os.path.join(model_dir, name) for name in os.listdir(model_dir)
+                  if not name.startswith(".")]
+    candidates = [path for path in candidates if _is_model(path)]
+    if not candidates:
+        raise FileNotFoundError(f"No model in {model_dir}")
+    # newest to arrive: copies keep their mtime but not their ctime
+    return max(candidates, key=lambda path: max(model_stamp(path)[2:4]))
+
+
+def set_active(model_dir, name):
+    """Point ``<model_dir>/ACTIVE`` at ``name``, a model directly inside ``model_dir``."""
+    target = os.path.realpath(os.path.join(model_dir, name))
+    if os.path.dirname(target) != os.path.realpath(model_dir) or not _is_model(target):
+        raise FileNotFoundError(f"No model {name!r} in {model_dir}")
+    pointer = os.path.join(model_dir, ACTIVE_FILE)
+    with open(pointer + ".tmp", "w") as f:
+        f.write(os.path.basename(target) + "\n")
+    os.replace(pointer + ".tmp", pointer)
+    return target
+
+
+def synthetic_canary(n=8):
+    """Feature rows of a few synthetic textures, for when no canary file is set."""
+    from fungiscope.features import extract_all_features
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for i in range(n):
+        image = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+        image[:, :, i % 3] = np.linspace(0, 255, 64, dtype=np.uint8)
+        rows.append(extract_all_features(image)[0])
+    return np.vstack(rows), None
+
+
+def load_canary(path=None):
+    """``(X, y)`` from a canary ``.npz`` (``y`` may be None), or the synthetic rows."""
+    if not path:
+        return synthetic_canary()
+    with np.load(path, allow_pickle=False) as data:
+        return np.asarray(data["X"], dtype=np.float64), (data["y"] if "y" in data else None)
+
+
+def validate(model, X, y=None, previous=None, min_accuracy=0.0):
+    """Check a model on canary rows; returns a summary or raises CanaryError."""
+    try:
+        labels, probabilities = predict_batch(model, X)
+    except Exception as e:
+        raise CanaryError(f"predict failed on the canary rows: {e}") from e
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    if probabilities.shape[0] != len(X):
+        raise CanaryError(f"{probabilities.shape[0]} predictions for {len(X)} canary rows")
+    if not np.isfinite(probabilities).all():
+        raise CanaryError("non-finite probabilities on the canary rows")
+    if not np.allclose(probabilities.sum(axis=1), 1.0, atol=1e-3):
+        raise CanaryError("canary probabilities do not sum to 1")
+    summary = {"rows": len(X)}
+    classes = getattr(model, "classes_", None)
+    if previous is not None and classes is not None:
+        old = getattr(previous.model, "classes_", None)
+        if old is not None and np.asarray(old).tolist() != np.asarray(classes).tolist():
+            raise CanaryError(f"classes changed from {np.asarray(old).tolist()} to {np.asarray(classes).tolist()}")
+    if previous is not None:
+        try:
+            old_labels, _ = predict_batch(previous.model, X)
+            summary["agreement"] = float(np.mean(np.asarray(old_labels) == np.asarray(labels)))
+        except Exception:
+            pass
+    if y is not None:
+        accuracy = float(np.mean(np.asarray(labels).astype(str) == np.asarray(y).astype(str)))
+        summary["accuracy"] = accuracy
+        if accuracy < min_accuracy:
+            raise CanaryError(f"canary accuracy {accuracy:.3f} is below {min_accuracy:.3f}")
+    return summary
+
+
+class ModelRegistry:
+
+    def __init__(self, model_path=None, model_dir=None, cache_factory=None, batcher_factory=None,
+                 canary_path=None, min_accuracy=0.0, interval=0.0):
+        self.model_path = model_path
+        self.model_dir = model_dir
+        self.cache_factory = cache_factory
+        self.batcher_factory = batcher_factory
+        self.canary_path = canary_path
+        self.min_accuracy = min_accuracy
+        self.interval = interval
+        self.current = None
+        self.last_error = None
+        self.history = deque(maxlen=20)
+        self._canary = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        self._watch_pid = None
+        self._rejected = None
+
+    def resolve(self):
+        """Path of the model that should be active."""
+        if self.model_dir:
+            return active_in_dir(self.model_dir)
+        return self.model_path
+
+    def canary(self):
+        if self._canary is None:
+            self._canary = load_canary(self.canary_path)
+        return self._canary
+
+    def load(self, path=None):
+        """Load, validate, warm up and swap in a model; raises on failure, old model kept."""
+        with self._reload_lock:
+            path = path or self.resolve()
+            stamp = None
+            try:
+                stamp = model_stamp(path)
+                version = model_version(path, stamp)
+                with model_load():
+                    model = load_model(path)
+                X, y = self.canary()
+                summary = validate(model, X, y, self.current, self.min_accuracy)
+                # the canary ran the batched path; a one-row predict warms the
+                # single-request path before a request needs it
+                predict_batch(model, X[:1])
+            except Exception as e:
+                result = "rejected" if isinstance(e, CanaryError) else "failed"
+                MODEL_RELOADS.inc(result=result)
+                self._rejected = stamp
+                self.last_error = f"{path}: {e}"
+                self.history.append({"time": time.time(), "path": path, "result": result, "error": str(e)})
+                print(f"Model load {result}, keeping {self.version() or 'no model'}: {self.last_error}")
+                raise
+            active = ActiveModel(model, path, version, stamp,
+                                 cache=self.cache_factory(path) if self.cache_factory else None,
+                                 batcher=self.batcher_factory(model) if self.batcher_factory else None,
+                                 canary=summary)
+            self._swap(active)
+            MODEL_RELOADS.inc(result="ok")
+            self.last_error = None
+            self.history.append({"time": time.time(), "path": path, "result": "ok", "version": version})
+            print(f"Model {version} loaded from {path}")
+            return active
+
+    def _swap(self, active):
+        with self._lock:
+            old, self.current = self.current, active
+            idle = old is not None and old.in_flight == 0
+            if old is not None:
+                old.retired = True
+        if old is not None:
+            MODEL_INFO.set(0, version=old.version)
+        MODEL_INFO.set(1, version=active.version)
+        if idle:
+            old.close()
+
+    def reload(self, path=None, wait=False):
+        """Start a background reload; False if one is already running."""
+        with self._lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return False
+            self._reload_thread = threading.Thread(target=self._reload, args=(path,), name="model-reload",
+                                                   daemon=True)
+            self._reload_thread.start()
+            thread = self._reload_thread
+        if wait:
+            thread.join()
+        return True
+
+    def _reload(self, path):
+        try:
+            self.load(path)
+        except Exception:
+            # already counted and logged by load()
+            pass
+
+    @contextmanager
+    def use(self):
+        """The active model for one request (None if nothing is loaded yet)."""
+        self._ensure_watching()
+        with self._lock:
+            active = self.current
+            if active is not None:
+                active.in_flight += 1
+        try:
+            yield active
+        finally:
+            if active is not None:
+                with self._lock:
+                    active.in_flight -= 1
+                    done = active.retired and active.in_flight == 0
+                if done:
+                    active.close()
+
+    def version(self):
+        active = self.current
+        return active.version if active is not None else None
+
+    def cache(self):
+        active = self.current
+        return active.cache if active is not None else None
+
+    def batcher(self):
+        active = self.current
+        return active.batcher if active is not None else None
+
+    def _ensure_watching(self):
+        # started lazily (and again after a fork), like the micro-batcher
+        if self.interval <= 0 or self._watch_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watch_pid != os.getpid():
+                self._watch_pid = os.getpid()
+                threading.Thread(target=self._watch, name="model-watch", daemon=True).start()
+
+    def _watch(self):
+        pending = None
+        while True:
+            time.sleep(self.interval)
+            try:
+                path = self.resolve()
+                stamp = model_stamp(path)
+            except OSError:
+                continue
+            active = self.current
+            if (active is not None and stamp == active.stamp) or stamp == self._rejected:
+                pending = None
+                continue
+            # reload once the new model looked the same on two polls
+            if stamp != pending:
+                pending = stamp
+                continue
+            pending = None
+            try:
+                self.load(path)
+            except Exception:
+                pass
+
+    def status(self):
+        active = self.current
+        return {
+            "active": active.describe() if active is not None else None,
+            "model_dir": self.model_dir,
+            "watch_interval": self.interval,
+            "reloading": self._reload_thread is not None and self._reload_thread.is_alive(),
+            "last_error": self.last_error,
+            "history": list(self.history),
+        }
+
+
+def registry_from_env(model_path=None, cache_factory=None, batcher_factory=None):
+    """ModelRegistry configured from FUNGI_MODEL_DIR / FUNGI_MODEL_WATCH_INTERVAL / FUNGI_CANARY_*.
+
+    The first model is loaded here, synchronously; if that fails the
+    registry starts empty and the watcher (or an admin reload) fills it.
+    """
+    model_dir = os.environ.get("FUNGI_MODEL_DIR") or None
+    interval = os.environ.get("FUNGI_MODEL_WATCH_INTERVAL")
+    registry = ModelRegistry(
+        model_path=model_path, model_dir=model_dir,
+        cache_factory=cache_factory, batcher_factory=batcher_factory,
+        canary_path=os.environ.get("FUNGI_CANARY_PATH") or None,
+        min_accuracy=float(os.environ.get("FUNGI_CANARY_MIN_ACCURACY", 0)),
+        interval=float(interval) if interval else (5.0 if model_dir else 0.0),
+    )
+    try:
+        registry.load()
+    except Exception:
+        # logged by load()
+        pass
+    return registry
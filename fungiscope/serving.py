@@ -0,0 +1,403 @@
+"""Request-handling helpers shared by the Flask servers."""
+import contextvars
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from fungiscope.cache import dhash, image_key
+from fungiscope.extract_pool import extractor_from_env
+from fungiscope.cascade import COLOR, FULL, Cascade, main_model
+from fungiscope.features import (FEATURE_GROUPS, decode_data_url, decode_image, extract_all_features,
+                                 extract_hsv_features, features_from_buffers, prepare_image)
+from fungiscope.metrics import stage
+from fungiscope.model import class_name, predict_batch
+from fungiscope.registry import set_active
+from fungiscope.similar import MAX_TOP_K
+
+MAX_BATCH_SIZE = int(os.environ.get("FUNGI_MAX_BATCH_SIZE", 64))
+MAX_UPLOAD_BYTES = int(os.environ.get("FUNGI_MAX_UPLOAD_BYTES", 16 * 1024 * 1024))
+
+# opt-in: decode large JPEGs at 1/2-1/8 scale keeping each side >= this many
+# pixels (256 is fastest, larger values drift less; see scripts/check_decode.py)
+REDUCED_DECODE_MIN_SIDE = int(os.environ.get("FUNGI_REDUCED_DECODE", 0)) or None
+
+_executor = None
+_extractor = None
+_extractor_lock = threading.Lock()
+
+
+def get_extractor():
+    """The FUNGI_EXTRACT_BACKEND=process pool, started on first use; None for in-thread extraction.
+
+    Call it once per server process after forking (gunicorn's
+    ``post_worker_init`` does) so the first request does not start the pool.
+    """
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                _extractor = extractor_from_env() or False
+    return _extractor or None
+
+
+def extract_features(image):
+    """Feature vector of a decoded BGR image, on the configured backend."""
+    extractor = get_extractor()
+    if extractor is not None:
+        return extractor.extract(image)[0]
+    return extract_all_features(image)[0]
+
+
+def get_executor():
+    """Thread pool for feature extraction (cv2 and NumPy release the GIL)."""
+    global _executor
+    if _executor is None:
+        workers = int(os.environ.get("FUNGI_EXTRACT_THREADS", min(8, os.cpu_count() or 1)))
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract")
+    return _executor
+
+
+class InvalidImageError(ValueError):
+    pass
+
+
+class UploadError(ValueError):
+    """Bad request body; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# request bodies
+
+def _check_size(size, limit=None):
+    limit = MAX_UPLOAD_BYTES if limit is None else limit
+    if size is not None and size > limit:
+        raise UploadError(f"Upload too large: {size} bytes (max {limit})", 413)
+
+
+def _read_file(storage):
+    # read one byte past the limit so oversized files fail without a full read
+    data = storage.read(MAX_UPLOAD_BYTES + 1)
+    _check_size(len(data))
+    return data
+
+
+def request_image_bytes(request, field="image"):
+    """Encoded image bytes from a Flask request.
+
+    Accepts a raw body (``application/octet-stream`` or ``image/*``), a
+    ``multipart/form-data`` file under ``field``, or the original JSON body
+    with a base64 data URL. The raw and multipart bodies are passed to
+    ``cv2.imdecode`` without base64/JSON round trips. Raises UploadError.
+    """
+    _check_size(request.content_length)
+    mimetype = request.mimetype
+    if mimetype == "application/octet-stream" or mimetype.startswith("image/"):
+        data = request.get_data(cache=False)
+        _check_size(len(data))
+        if not data:
+            raise UploadError("Empty request body")
+        return data
+    if mimetype == "multipart/form-data":
+        storage = request.files.get(field)
+        if storage is None:
+            raise UploadError(f"Expected a file field named '{field}'")
+        return _read_file(storage)
+    data = request.get_json(silent=True)
+    image_data = (data or {}).get(field)
+    if not isinstance(image_data, str) or not image_data:
+        raise UploadError(f"Expected a base64 '{field}' in the JSON body")
+    try:
+        image_bytes = decode_data_url(image_data)
+    except ValueError:
+        raise UploadError("Invalid base64 image data")
+    if not image_bytes:
+        # e.g. "@@@", which decodes to nothing
+        raise UploadError("Invalid base64 image data")
+    _check_size(len(image_bytes))
+    return image_bytes
+
+
+def lookup_or_extract(image_bytes, cache=None, image=None, model=None, features=None):
+    """Look an encoded image up in the cache, extracting features on a miss.
+
+    Returns ``(cached, features, key, phash)``: ``cached`` is a finished
+    ``(label, probabilities, stage)`` (a cache hit, or the colour stage of
+    a ``Cascade`` ``model``, already stored in the cache), otherwise None
+    and ``features`` is the feature vector for ``main_model(model)``
+    (store the result under ``key``/``phash``). ``image`` skips decoding
+    when the caller already has the BGR array, ``features`` (its full
+    feature vector) skips extraction and the near-duplicate lookup.
+    """
+    key = phash = None
+    if cache is not None:
+        key = image_key(image_bytes)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached, None, key, None
+    cascade = isinstance(model, Cascade)
+    if features is not None:
+        color = features[FEATURE_GROUPS["hsv"]]
+    else:
+        if image is None:
+            with stage("decode"):
+                image = decode_image(image_bytes, REDUCED_DECODE_MIN_SIDE)
+            if image is None:
+                raise InvalidImageError("Invalid image")
+        extractor = get_extractor()
+        with stage("extract"):
+            if extractor is not None:
+                features, phash = extractor.extract(image, phash=cache is not None and cache.near_duplicates)
+                cached = cache.get_near(phash) if phash is not None else None
+                if cached is not None:
+                    cache.alias(key, cached)
+                    return cached, None, key, phash
+                color = features[FEATURE_GROUPS["hsv"]]
+            else:
+                gray, hsv = prepare_image(image)
+                if cache is not None and cache.near_duplicates:
+                    phash = dhash(gray)
+                    cached = cache.get_near(phash)
+                    if cached is not None:
+                        cache.alias(key, cached)
+                        return cached, None, key, phash
+                if not cascade:
+                    features, _ = features_from_buffers(gray, hsv)
+                    return None, features, key, phash
+                color = extract_hsv_features(hsv)
+    if not cascade:
+        return None, features, key, phash
+
+    # cascade: GLCM and LBP (in-thread) and the main model only when the colour model is unsure
+    with stage("color"):
+        probabilities, confident = model.predict_color(color)
+    if confident[0]:
+        result = (model.classes_[probabilities[0].argmax()], probabilities[0], COLOR)
+        if cache is not None:
+            cache.put(key, result, phash)
+        return result, None, key, phash
+    if features is None:
+        with stage("texture"):
+            features, _ = features_from_buffers(gray, hsv, color)
+    return None, features, key, phash
+
+
+def predict_image(model, image_bytes, cache=None, predict=None, image=None, features=None):
+    """``(label, probabilities, stage)`` for one encoded image, through the cache if given.
+
+    ``stage`` is "color" when the colour stage of a ``Cascade`` answered,
+    otherwise "full". ``predict`` replaces the direct model call (e.g.
+    ``MicroBatcher.predict``); ``image`` and ``features`` are passed on to
+    ``lookup_or_extract``. Raises InvalidImageError if the bytes do not
+    decode.
+    """
+    cached, features, key, phash = lookup_or_extract(image_bytes, cache, image, model, features)
+    if cached is not None:
+        return cached
+    with stage("predict"):
+        if predict is None:
+            labels, probabilities = predict_batch(main_model(model), features)
+            result = (labels[0], probabilities[0], FULL)
+        else:
+            result = (*predict(features), FULL)
+    if cache is not None:
+        cache.put(key, result, phash)
+    return result
+
+
+def request_top_k(request, default=0):
+    """``top_k`` from the query string, a multipart form field or the JSON body.
+
+    ``default`` when absent; raises UploadError unless it is an integer
+    from 0 to ``similar.MAX_TOP_K``.
+    """
+    value = request.args.get("top_k")
+    if value is None and request.mimetype == "multipart/form-data":
+        value = request.form.get("top_k")
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get("top_k")
+    if value is None:
+        return default
+    try:
+        top_k = int(value)
+    except (TypeError, ValueError):
+        raise UploadError("'top_k' must be an integer")
+    if not 0 <= top_k <= MAX_TOP_K:
+        raise UploadError(f"'top_k' must be between 0 and {MAX_TOP_K}")
+    return top_k
+
+
+def model_admin(registry, request):
+    """The admin model endpoint: ``(body, status)`` for a GET (status) or POST (reload).
+
+    Disabled (404) unless FUNGI_ADMIN_TOKEN is set, and every request must
+    send ``Authorization: Bearer <token>``. A POST reloads in the background
+    (202); ``{"model": "<name>"}`` first points FUNGI_MODEL_DIR's ACTIVE file
+    at that model, so the other workers switch too, and ``{"wait": true}``
+    answers after the reload (422 if the new model was not swapped in).
+    """
+    token = os.environ.get("FUNGI_ADMIN_TOKEN")
+    if not token:
+        return {"error": "Model admin is not enabled"}, 404
+    sent = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(sent, f"Bearer {token}".encode()):
+        return {"error": "Unauthorized"}, 401
+    if request.method == "GET":
+        return registry.status(), 200
+
+    data = request.get_json(silent=True) or {}
+    path = None
+    if data.get("model"):
+        if not registry.model_dir:
+            return {"error": "Switching models needs FUNGI_MODEL_DIR"}, 400
+        try:
+            path = set_active(registry.model_dir, str(data["model"]))
+        except FileNotFoundError as e:
+            return {"error": str(e)}, 404
+    wait = bool(data.get("wait"))
+    if not registry.reload(path, wait=wait):
+        return dict(registry.status(), error="A reload is already running"), 409
+    if not wait:
+        return registry.status(), 202
+    return registry.status(), 422 if registry.last_error else 200
+
+
+def similar_images(index, image_bytes, top_k, image=None, features=None):
+    """Nearest reference samples of one encoded image (see ``SimilarIndex.similar``)."""
+    if features is None:
+        if image is None:
+            with stage("decode"):
+                image = decode_image(image_bytes, REDUCED_DECODE_MIN_SIDE)
+            if image is None:
+                raise InvalidImageError("Invalid image")
+        with stage("extract"):
+            features = extract_features(image)
+    with stage("similar"):
+        return index.similar(features, top_k)
+
+
+def classify_with_similar(model, index, image_bytes, top_k, cache=None, predict=None):
+    """``(label, probabilities, stage, similar)``: ``predict_image`` plus the ``top_k`` nearest references.
+
+    The image is decoded and extracted once for both; a cached prediction
+    or the colour stage of a cascade still answer the classification.
+    """
+    with stage("decode"):
+        image = decode_image(image_bytes, REDUCED_DECODE_MIN_SIDE)
+    if image is None:
+        raise InvalidImageError("Invalid image")
+    with stage("extract"):
+        features = extract_features(image)
+    label, probabilities, stage_ = predict_image(model, image_bytes, cache, predict, image, features)
+    return label, probabilities, stage_, similar_images(index, image_bytes, top_k, features=features)
+
+
+def warm_up(model):
+    """Push one small synthetic image through decode, extraction and the model.
+
+    Pays the one-time costs (codec and ufunc setup, first page faults on a
+    memory-mapped model) before the first real request does.
+    """
+    image = np.zeros((64, 64, 3), np.uint8)
+    image[::4] = 200
+    encoded = cv2.imencode(".jpg", image)[1].tobytes()
+    return predict_image(model, encoded)
+
+
+def _batch_item(image_data, cache, model):
+    if isinstance(image_data, bytes):
+        return lookup_or_extract(image_data, cache, model=model)
+    if not isinstance(image_data, str):
+        raise ValueError("Expected a base64 image string")
+    image_bytes = decode_data_url(image_data)
+    # the same per-image limit as single uploads and multipart batch files;
+    # classify_batch reports it in this item's slot
+    _check_size(len(image_bytes))
+    return lookup_or_extract(image_bytes, cache, model=model)
+
+
+def classify_batch(model, images, unknown="Unable to Classify Species", cache=None):
+    """Classify a list of images (base64 strings or raw bytes) with one ``predict_proba`` call.
+
+    Extraction runs in parallel on the shared pool; cache hits skip it and
+    only the misses go to the model. An image that fails to decode or
+    extract gets ``{"index": i, "error": ...}`` in its slot; the rest of
+    the batch is still scored.
+    """
+    # each task runs in a copy of this context so its stages land in the request's Server-Timing
+    futures = [get_executor().submit(contextvars.copy_context().run, _batch_item, image, cache, model)
+               for image in images]
+    results = [None] * len(images)
+    predictions = {}
+    rows, misses = [], []
+    for i, future in enumerate(futures):
+        try:
+            cached, features, key, phash = future.result()
+        except Exception as e:
+            results[i] = {"index": i, "error": str(e)}
+            continue
+        if cached is not None:
+            predictions[i] = cached
+        else:
+            rows.append(features)
+            misses.append((i, key, phash))
+
+    if rows:
+        with stage("predict"):
+            labels, probabilities = predict_batch(main_model(model), np.vstack(rows))
+        for (i, key, phash), label, probs in zip(misses, labels, probabilities):
+            predictions[i] = (label, probs, FULL)
+            if cache is not None:
+                cache.put(key, predictions[i], phash)
+
+    for i, (label, probs, stage_) in predictions.items():
+        results[i] = {
+            "index": i,
+            "class": class_name(label, unknown),
+            "confidence": float(probs.max()),
+            "stage": stage_,
+        }
+    return results
+
+
+def batch_request_images(data):
+    """Validate a batch request body; returns ``(images, error_message, status)``.
+
+    ``data`` is either the parsed JSON body or a Flask request; a
+    ``multipart/form-data`` request yields the raw bytes of every
+    ``images`` file, anything else is read as JSON. ``status`` is the HTTP
+    status for the error (413 for an oversized upload, else 400).
+    """
+    if hasattr(data, "mimetype"):
+        request = data
+        if request.mimetype != "multipart/form-data":
+            return batch_request_images(request.get_json(silent=True))
+        try:
+            _check_size(request.content_length, MAX_UPLOAD_BYTES * MAX_BATCH_SIZE)
+            files = request.files.getlist('images')
+            if len(files) > MAX_BATCH_SIZE:
+                return None, f"Too many images: {len(files)} (max {MAX_BATCH_SIZE})", 400
+            images = [_read_file(storage) for storage in files]
+        except UploadError as e:
+            return None, str(e), e.status
+        if not images:
+            return None, "Expected one or more 'images' files", 400
+        return images, None, None
+    images = (data or {}).get('images')
+    if not isinstance(images, list) or not images:
+        return None, "Expected a non-empty 'images' array", 400
+    if len(images) > MAX_BATCH_SIZE:
+        return None, f"Too many images: {len(images)} (max {MAX_BATCH_SIZE})", 400
+    return images, None, None
+    images = (data or {}).get('images')
+    if not isinstance(images, list) or not images:
+        return None, "Expected a non-empty 'images' array"
+    if len(images) > MAX_BATCH_SIZE:
+        return None, f"Too many images: {len(images)} (max {MAX_BATCH_SIZE})"
+    return images, None
@@ -0,0 +1,45 @@
+"""Cold-start timing for the serverless entry point.
+
+``StartupProfile`` records how long each startup stage takes (imports,
+model load, warm-up). With FUNGI_STARTUP_PROFILE=1 the report is printed
+once startup completes and served by the entry point;
+``scripts/bench_cold_start.py`` times whole cold invocations against a
+budget.
+"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+
+class StartupProfile:
+
+    def __init__(self, enabled=None):
+        self.enabled = bool(os.environ.get("FUNGI_STARTUP_PROFILE")) if enabled is None else enabled
+        self.started = time.perf_counter()
+        self.stages = []
+        self._reported = False
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.perf_counter() - start))
+
+    def report(self):
+        return {
+            "since_start_ms": (time.perf_counter() - self.started) * 1000,
+            "stages": [{"stage": name, "ms": seconds * 1000} for name, seconds in self.stages],
+            # a heavy dependency showing up here means something imported it eagerly
+            "loaded": sorted(name for name in ("cv2", "joblib", "sklearn", "skimage", "xgboost")
+                             if name in sys.modules),
+        }
+
+    def log_once(self):
+        if self.enabled and not self._reported:
+            self._reported = True
+            report = self.report()
+            stages = ", ".join(f"{s['stage']} {s['ms']:.0f} ms" for s in report["stages"])
+            print(f"startup: {stages}; loaded {', '.join(report['loaded'])}")
@@ -0,0 +1,185 @@
+"""Tiled classification of large slide images.
+
+``extract_all_features`` squashes the whole image to 256x256, which throws
+away the detail of a slide scan. ``classify_tiles`` instead slides a
+256x256 window over the image at native resolution with a configurable
+stride, extracts the usual 40 features for every window and predicts them
+in batches, giving a per-tile probability map and an aggregated slide
+label.
+
+Overlapping windows share most of their pixels, so LBP labels and HSV
+bins are computed once per pixel, not once per window. Window histograms
+come from an integral histogram: ``C(y)[bin, x]`` counts the pixels of each
+bin in column ``x`` above row ``y``, the band of rows ``[y, y + 256)`` is
+``C(y + 256) - C(y)``, and a cumulative sum along x turns that into the
+histogram of every window in the band with two lookups per window.
+
+Rows are read in strips of ``strip_rows`` and ``C`` is only kept for the
+tile rows still open (at most ``256 / stride + 1`` of them), so besides the
+input (which may be an ``np.memmap``) memory is
+O(bins x width x 256 / stride), independent of the image height.
+
+Differences from running ``extract_all_features`` on each window:
+
+- LBP sees the pixels around a window instead of zero padding, so the
+  labels on its one-pixel border ring can differ (they match the LBP of
+  the whole image exactly)
+- GLCM needs a 256 x 256 pair matrix per window, too large for an
+  integral histogram; it runs per window on the gray band, bit-identical
+  to the single-image path
+
+scripts/check_tiles.py measures both against per-window extraction.
+"""
+import cv2
+import numpy as np
+
+from fungiscope.features import (FEATURE_GROUPS, HSV_BINS, IMAGE_SIZE, LBP_BINS, LBP_POINTS, LBP_RADIUS,
+                                 N_FEATURES, extract_glcm_features)
+from fungiscope.lbp import uniform_lbp
+from fungiscope.model import class_name, predict_batch
+
+TILE = IMAGE_SIZE[0]
+DEFAULT_STRIDE = TILE // 2
+
+# integral-histogram bins: LBP labels, then H, S and V bins
+LBP_OFFSET = 0
+HSV_OFFSET = LBP_BINS
+N_BINS = LBP_BINS + 3 * HSV_BINS
+
+# value -> bin, as cv2.calcHist bins H over [0, 180) and S, V over [0, 256)
+HSV_LUTS = [np.minimum(np.arange(256) * HSV_BINS // high, HSV_BINS - 1).astype(np.intp)
+            for high in (180, 256, 256)]
+
+# rows of context LBP needs above and below a strip
+LBP_HALO = int(np.ceil(LBP_RADIUS)) + 1
+
+
+def tile_origins(length, tile=TILE, stride=DEFAULT_STRIDE):
+    """Window starts along one axis; the last window is flush with the edge."""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, stride))
+    if starts[-1] != length - tile:
+        starts.append(length - tile)
+    return starts
+
+
+def _column_counts(image, start, stop, out):
+    """Add per-column bin counts of rows ``[start, stop)`` to ``out`` (N_BINS x width)."""
+    height, width = image.shape[:2]
+    top, bottom = max(start - LBP_HALO, 0), min(stop + LBP_HALO, height)
+    strip = np.ascontiguousarray(image[top:bottom])
+    gray = cv2.cvtColor(strip, cv2.COLOR_BGR2GRAY)
+    lbp = uniform_lbp(gray, LBP_POINTS, LBP_RADIUS, row_offset=top)[start - top:stop - top]
+    hsv = cv2.cvtColor(strip[start - top:stop - top], cv2.COLOR_BGR2HSV)
+
+    columns = np.arange(width, dtype=np.intp)
+    labels = [(lbp.astype(np.intp), LBP_OFFSET)]
+    labels += [(HSV_LUTS[c][hsv[..., c]], HSV_OFFSET + c * HSV_BINS) for c in range(3)]
+    for label, offset in labels:
+        # one bincount per label image: index = bin * width + column
+        index = label
+        index += offset
+        index *= width
+        index += columns
+        out += np.bincount(index.ravel(), minlength=N_BINS * width).reshape(N_BINS, width).astype(out.dtype)
+
+
+def _band_features(image, y, band_counts, xs):
+    """Feature matrix of the windows at ``(y, x) for x in xs``."""
+    features = np.empty((len(xs), N_FEATURES))
+
+    # histograms of every window in the band from the cumulative column counts
+    integral = np.zeros((N_BINS, band_counts.shape[1] + 1), np.int64)
+    np.cumsum(band_counts, axis=1, out=integral[:, 1:])
+    xs = np.asarray(xs)
+    hist = (integral[:, xs + TILE] - integral[:, xs]).T.astype(np.float64)
+
+    lbp = hist[:, LBP_OFFSET:LBP_OFFSET + LBP_BINS]
+    features[:, FEATURE_GROUPS["lbp"]] = lbp / (lbp.sum(axis=1, keepdims=True) + 1e-7)
+    hsv = hist[:, HSV_OFFSET:].reshape(len(xs), 3, HSV_BINS)
+    # cv2.normalize's default: L2 norm per channel (cv2 works in float32, so
+    # values agree up to float32 rounding)
+    norm = np.sqrt((hsv * hsv).sum(axis=2, keepdims=True))
+    norm[norm == 0] = 1
+    features[:, FEATURE_GROUPS["hsv"]] = (hsv / norm).reshape(len(xs), -1)
+
+    gray = cv2.cvtColor(np.ascontiguousarray(image[y:y + TILE]), cv2.COLOR_BGR2GRAY)
+    for i, x in enumerate(xs):
+        extract_glcm_features(gray[:, x:x + TILE], out=features[i, FEATURE_GROUPS["glcm"]])
+    return features
+
+
+def _fit(image):
+    """Upscale an image smaller than one window so it holds at least one."""
+    height, width = image.shape[:2]
+    if min(height, width) >= TILE:
+        return image
+    scale = TILE / min(height, width)
+    return cv2.resize(np.asarray(image), (max(TILE, round(width * scale)), max(TILE, round(height * scale))))
+
+
+def tile_features(image, stride=DEFAULT_STRIDE, strip_rows=64):
+    """Yield ``(y, xs, features)`` for each row of windows, top to bottom.
+
+    ``image`` is a BGR array or anything sliceable like one (``np.memmap``);
+    only ``strip_rows`` rows of it (plus a small halo) are converted at once.
+    """
+    image = _fit(image)
+    height, width = image.shape[:2]
+    ys = tile_origins(height, stride=stride)
+    xs = tile_origins(width, stride=stride)
+    starts, ends = set(ys), {y + TILE for y in ys}
+
+    counts = np.zeros((N_BINS, width), np.int32)
+    open_rows = {}
+    position = 0
+    for row in sorted(starts | ends):
+        # advance the running column counts to this row
+        for start in range(position, row, strip_rows):
+            _column_counts(image, start, min(start + strip_rows, row), counts)
+        position = row
+        if row in ends:
+            y = row - TILE
+            yield y, xs, _band_features(image, y, counts - open_rows.pop(y), xs)
+        if row in starts:
+            open_rows[row] = counts.copy()
+
+
+def classify_tiles(model, image, stride=DEFAULT_STRIDE, strip_rows=64, method="mean"):
+    """Probability map of every window and the aggregated slide prediction.
+
+    Each row of windows is predicted with one ``predict_proba`` call, so
+    the feature matrix never holds more than one row. Returns a dict with
+    ``ys`` and ``xs`` (window origins), ``probabilities`` (rows x cols x
+    classes) and the slide-level ``label``, ``class``, ``confidence`` and
+    ``scores`` from ``aggregate_tiles``.
+    """
+    ys, rows = [], []
+    for y, xs, features in tile_features(image, stride, strip_rows):
+        ys.append(y)
+        rows.append(predict_batch(model, features)[1])
+    probabilities = np.stack(rows)
+    result = {"ys": ys, "xs": xs, "probabilities": probabilities}
+    result.update(aggregate_tiles(model, probabilities, method))
+    return result
+
+
+def aggregate_tiles(model, probabilities, method="mean"):
+    """Slide label from a tile probability map.
+
+    ``mean`` averages the tile probabilities (soft vote); ``vote`` counts
+    each tile's argmax (majority vote). ``scores`` holds the per-class
+    mean probability or share of tiles.
+    """
+    flat = probabilities.reshape(-1, probabilities.shape[-1])
+    if method == "mean":
+        scores = flat.mean(axis=0)
+    elif method == "vote":
+        scores = np.bincount(flat.argmax(axis=1), minlength=flat.shape[1]) / len(flat)
+    else:
+        raise ValueError(f"Unknown aggregation: {method} (expected 'mean' or 'vote')")
+    best = int(scores.argmax())
+    label = np.asarray(model.classes_)[best]
+    return {"label": label, "class": class_name(label, "Unknown Class"), "confidence": float(scores[best]),
+            "scores": scores}
@@ -0,0 +1,48 @@
+"""gunicorn settings for the Flask servers.
+
+    gunicorn -c gunicorn.conf.py render_app:app
+    FUNGI_MODEL_PATH=scripts/rf_defungi.forest WEB_CONCURRENCY=16 gunicorn -c gunicorn.conf.py render_app:app
+
+The app (and the model) is imported once in the master and the workers are
+forked from it, so they share the model pages copy-on-write instead of
+each deserializing a private copy. With a bundle exported by
+``scripts/export_forest.py --bundle`` the trees are memory-mapped read-only
+and stay shared for the life of the workers.
+"""
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = True
+
+
+def on_starting(server):
+    # FUNGI_METRICS_DIR holds one metrics snapshot per worker; start empty
+    directory = os.environ.get("FUNGI_METRICS_DIR")
+    if directory and os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if filename.endswith((".json", ".tmp")):
+                os.remove(os.path.join(directory, filename))
+
+
+def when_ready(server):
+    # runs in the master after the preload and before the first fork;
+    # api/index.py loads its model lazily, so load it here for the workers
+    module = sys.modules.get(getattr(server.app, "app_uri", "").split(":")[0])
+    if module is not None and hasattr(module, "get_model"):
+        module.get_model()
+
+
+def post_worker_init(worker):
+    from fungiscope.memory import process_memory
+    from fungiscope.serving import get_extractor
+
+    # FUNGI_EXTRACT_BACKEND=process: start this worker's extraction pool now
+    get_extractor()
+
+    memory = process_memory()
+    worker.log.info("worker %s memory: rss %.1f MB, shared %.1f MB, private %.1f MB, pss %.1f MB",
+                    worker.pid, memory.get("rss", 0) / 1e6, memory.get("shared", 0) / 1e6,
+                    memory.get("private", 0) / 1e6, memory.get("pss", 0) / 1e6)
@@ -1,91 +1,78 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
-import joblib
-import cv2
-import numpy as np
-import base64
 import os
-from skimage.feature import graycomatrix, graycoprops, local_binary_pattern
+
+from fungiscope.batching import batcher_from_env
+from fungiscope.cache import cache_from_env
+from fungiscope.memory import process_memory
+from fungiscope.metrics import instrument
+from fungiscope.registry import registry_from_env
+from fungiscope.serving import (InvalidImageError, UploadError, batch_request_images, classify_batch,
+                                classify_with_similar, model_admin, predict_image, request_image_bytes,
+                                request_top_k, similar_images)
+from fungiscope.similar import index_from_env
 
 app = Flask(__name__)
 CORS(app)
 
-MODEL_PATH = os.path.join(os.getcwd(), 'scripts', 'rf_defungi.joblib')
+# FUNGI_MODEL_PATH can point at a .npz exported by scripts/export_forest.py
+MODEL_PATH = os.environ.get('FUNGI_MODEL_PATH', os.path.join(os.getcwd(), 'scripts', 'rf_defungi.joblib'))
+if not os.path.exists(MODEL_PATH):
+    MODEL_PATH = os.path.join(os.getcwd(), 'scripts', 'best_xgb_defungi.joblib')
+
+# Load model; FUNGI_MODEL_DIR / FUNGI_MODEL_WATCH_INTERVAL reload it without a
+# restart (checked against FUNGI_CANARY_PATH first), each model with its own:
+# - micro-batcher, opt-in: FUNGI_MICROBATCH_WAIT_MS=5 coalesces concurrent
+#   /classify calls into one predict_proba per window (FUNGI_MICROBATCH_MAX_SIZE caps it)
+# - exact + (FUNGI_CACHE_PHASH_DISTANCE) near-duplicate prediction cache;
+#   FUNGI_CACHE_SIZE=0 disables it
+models = registry_from_env(MODEL_PATH, cache_factory=cache_from_env, batcher_factory=batcher_from_env)
 
-# Load model 
+# FUNGI_SIMILAR_INDEX (scripts/build_similar_index.py) enables /similar and
+# "top_k" on /classify; FUNGI_SIMILAR_IMAGES (the dataset directory) serves
+# the reference images at /similar/images/<path>
 try:
-    if os.path.exists(MODEL_PATH):
-        model = joblib.load(MODEL_PATH)
-        print(f"Model loaded from {MODEL_PATH}")
-    else:
-        model = joblib.load(os.path.join(os.getcwd(), 'scripts', 'best_xgb_defungi.joblib'))
+    similar_index = index_from_env()
 except Exception as e:
-    print(f"Error loading model: {e}")
-    model = None
-
-def extract_glcm_features(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    glcm = graycomatrix(gray, distances=[1], angles=[0, np.pi/4, np.pi/2, 3*np.pi/4], 
-                        levels=256, symmetric=True, normed=True)
-    features = []
-    props = ['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM']
-    for prop in props:
-        val = graycoprops(glcm, prop).mean()
-        features.append(val)
-    return np.array(features)
-
-def extract_lbp_features(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    radius = 1
-    n_points = 8 * radius
-    lbp = local_binary_pattern(gray, n_points, radius, method='uniform')
-    hist, _ = np.histogram(lbp.ravel(), bins=np.arange(0, n_points + 3), range=(0, n_points + 2))
-    hist = hist.astype("float")
-    hist /= (hist.sum() + 1e-7)
-    return hist
-
-def extract_hsv_features(image):
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    bins = 8
-    hist_h = cv2.calcHist([hsv], [0], None, [bins], [0, 180])
-    hist_s = cv2.calcHist([hsv], [1], None, [bins], [0, 256])
-    hist_v = cv2.calcHist([hsv], [2], None, [bins], [0, 256])
-    cv2.normalize(hist_h, hist_h)
-    cv2.normalize(hist_s, hist_s)
-    cv2.normalize(hist_v, hist_v)
-    return np.concatenate([hist_h.flatten(), hist_s.flatten(), hist_v.flatten()])
-
-def extract_all_features(image):
-    img = cv2.resize(image, (256, 256))
-    feat_glcm = extract_glcm_features(img)
-    feat_lbp = extract_lbp_features(img)
-    feat_hsv = extract_hsv_features(img)
-    return np.concatenate([feat_glcm, feat_lbp, feat_hsv])
+    print(f"Error loading similar index: {e}")
+    similar_index = None
+SIMILAR_IMAGES = os.environ.get('FUNGI_SIMILAR_IMAGES')
+
+# GET /metrics (Prometheus) and a Server-Timing header on every response;
+# FUNGI_METRICS_DIR aggregates the metrics of all gunicorn workers
+instrument(app, cache=models.cache, batcher=models.batcher)
 
 @app.route('/classify', methods=['POST'])
 def classify():
-    if not model:
-        return jsonify({"error": "Model not loaded"}), 500
-        
+    # in-flight requests finish on the model they started with
+    with models.use() as active:
+        if active is None:
+            return jsonify({"error": "Model not loaded"}), 500
+        return classify_with(active)
+
+def classify_with(active):
     try:
-        data = request.json
-        image_data = data.get('image', '')
-        
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
+        # raw body, multipart file "image" or JSON {"image": <base64>};
+        # optional "top_k" (query string, form field or JSON) adds the nearest references
+        try:
+            image_bytes = request_image_bytes(request)
+            top_k = request_top_k(request)
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        if top_k and similar_index is None:
+            return jsonify({"error": "Similar-image search is not enabled"}), 400
+
+        similar = None
+        try:
+            if top_k:
+                prediction, probabilities, stage, similar = classify_with_similar(
+                    active.model, similar_index, image_bytes, top_k, active.cache, active.predict)
+            else:
+                prediction, probabilities, stage = predict_image(active.model, image_bytes, active.cache,
+                                                                 predict=active.predict)
+        except InvalidImageError:
             return jsonify({"error": "Invalid image"}), 400
         
-        features = extract_all_features(img)
-        features = features.reshape(1, -1)
-        
-        prediction = model.predict(features)[0]
-        probabilities = model.predict_proba(features)[0]
         confidence = max(probabilities)
         
         # Class mapping
@@ -97,13 +84,88 @@ def classify():
         except:
             pred_class = "Unable to Classify Species"
 
-        return jsonify({
+        response = {
             "class": pred_class,
-            "confidence": float(confidence)
-        })
+            "confidence": float(confidence),
+            # "color" when the cascade's colour model answered, else "full"
+            "stage": stage,
+            "model_version": active.version
+        }
+        if similar is not None:
+            response["similar"] = similar
+        return jsonify(response)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/classify/batch', methods=['POST'])
+def classify_batch_route():
+    with models.use() as active:
+        if active is None:
+            return jsonify({"error": "Model not loaded"}), 500
+
+        try:
+            images, error, status = batch_request_images(request)
+            if error:
+                return jsonify({"error": error}), status
+            return jsonify({"results": classify_batch(active.model, images, cache=active.cache),
+                            "model_version": active.version})
+
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+@app.route('/similar', methods=['POST'])
+def similar():
+    if similar_index is None:
+        return jsonify({"error": "Similar-image search is not enabled"}), 404
+
+    try:
+        try:
+            image_bytes = request_image_bytes(request)
+            top_k = request_top_k(request, default=5)
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+
+        try:
+            return jsonify({"similar": similar_images(similar_index, image_bytes, top_k)})
+        except InvalidImageError:
+            return jsonify({"error": "Invalid image"}), 400
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/similar/images/<path:path>', methods=['GET'])
+def similar_image(path):
+    if not SIMILAR_IMAGES:
+        return jsonify({"error": "Reference images are not served"}), 404
+    # send_from_directory refuses paths outside the directory
+    return send_from_directory(SIMILAR_IMAGES, path)
+
+@app.route('/stats/batching', methods=['GET'])
+def batching_stats():
+    batcher = models.batcher()
+    if batcher is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(batcher.stats(), enabled=True))
+
+@app.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    cache = models.cache()
+    if cache is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(cache.stats(), enabled=True))
+
+@app.route('/admin/model', methods=['GET', 'POST'])
+def model_admin_route():
+    # FUNGI_ADMIN_TOKEN enables it: GET = active version, POST = reload
+    # ({"model": "<name in FUNGI_MODEL_DIR>"} switches, {"wait": true} blocks)
+    body, status = model_admin(models, request)
+    return jsonify(body), status
+
+@app.route('/stats/memory', methods=['GET'])
+def memory_stats():
+    # per worker: compare "shared" (model pages) with "private"
+    return jsonify(process_memory())
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000)
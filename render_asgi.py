@@ -0,0 +1,9 @@
+# ASGI mode: the render_app routes behind a bounded thread pool with
+# backpressure (429 when FUNGI_ASGI_MAX_QUEUE requests are waiting, 503
+# after FUNGI_ASGI_DEADLINE_MS); see fungiscope/asgi.py
+#
+#   uvicorn render_asgi:app --host 0.0.0.0 --port 5000 --workers 4
+from fungiscope.asgi import asgi_from_env
+from render_app import app as flask_app
+
+app = asgi_from_env(flask_app)
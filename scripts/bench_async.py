@@ -0,0 +1,170 @@
+"""Local load test: sync gunicorn vs the ASGI mode under slow uploads.
+
+Starts each server on a free port with the same worker/thread budget,
+then runs ``--clients`` clients posting a 640x480 JPEG back to back while
+``--slow-clients`` trickle 12 MP JPEGs at ``--slow-rate`` bytes/s, the
+way phones on a bad connection do. Reports latency percentiles and
+status counts of the fast requests per mode.
+
+    python scripts/bench_async.py
+    python scripts/bench_async.py --model scripts/rf_defungi.forest --clients 16 --slow-clients 8 --duration 30
+    python scripts/bench_async.py --modes asgi --max-queue 4 --deadline-ms 2000
+
+With sync workers every slow upload holds a thread while its body
+arrives, so the fast requests queue behind it; the ASGI mode reads bodies
+on the event loop and only uses a thread for the actual work.
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def jpeg(width, height, seed):
+    rng = np.random.default_rng(seed)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8), (9, 9), 0)
+    img = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = np.clip(img + rng.normal(0, 6, img.shape), 0, 255).astype(np.uint8)
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, args):
+    env = dict(os.environ, FUNGI_ASGI_THREADS=str(args.threads), FUNGI_ASGI_MAX_QUEUE=str(args.max_queue),
+               FUNGI_ASGI_DEADLINE_MS=str(args.deadline_ms), FUNGI_CACHE_SIZE="0")
+    if args.model:
+        env["FUNGI_MODEL_PATH"] = os.path.abspath(args.model)
+    if mode == "sync":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{port}",
+                   "-w", str(args.workers), "--threads", str(args.threads), "--timeout", "120",
+                   "render_app:app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "render_asgi:app", "--port", str(port),
+                   "--workers", str(args.workers), "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/stats/memory", timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def post(port, payload, rate=None, timeout=60):
+    """POST a JPEG, optionally trickled at ``rate`` bytes/s; returns (status, seconds)."""
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.putrequest("POST", "/classify")
+        conn.putheader("Content-Type", "image/jpeg")
+        conn.putheader("Content-Length", str(len(payload)))
+        conn.endheaders()
+        if rate:
+            step = max(rate // 20, 1)
+            for i in range(0, len(payload), step):
+                conn.send(payload[i:i + step])
+                time.sleep(step / rate)
+        else:
+            conn.send(payload)
+        response = conn.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = "error"
+    finally:
+        conn.close()
+    return status, time.perf_counter() - start
+
+
+def run_load(port, args, small, large):
+    stop = time.monotonic() + args.duration
+    fast, slow = [], []
+
+    def fast_client():
+        while time.monotonic() < stop:
+            fast.append(post(port, small))
+
+    def slow_client():
+        while time.monotonic() < stop:
+            slow.append(post(port, large, rate=args.slow_rate))
+
+    threads = [threading.Thread(target=slow_client) for _ in range(args.slow_clients)]
+    threads += [threading.Thread(target=fast_client) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return fast, slow
+
+
+def summarize(name, results, duration):
+    statuses = Counter(status for status, _ in results)
+    ok = np.array([seconds for status, seconds in results if status == 200]) * 1000
+    all_times = np.array([seconds for _, seconds in results]) * 1000
+    line = f"{name:10s} {len(results):5d} req  {statuses.get(200, 0) / duration:6.1f} ok/s"
+    if len(all_times):
+        line += (f"  p50 {np.percentile(all_times, 50):7.0f}  p99 {np.percentile(all_times, 99):7.0f}"
+                 f"  max {all_times.max():7.0f} ms")
+    if len(ok):
+        line += f"  (200s p99 {np.percentile(ok, 99):.0f} ms)"
+    print(line + "  " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str)))
+    return np.percentile(all_times, 99) if len(all_times) else float("inf")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs ASGI load test with slow uploads")
+    parser.add_argument("--model", help="FUNGI_MODEL_PATH for the servers")
+    parser.add_argument("--modes", default="sync,asgi", help="sync (gunicorn) and/or asgi (uvicorn)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes per server")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per process (both modes)")
+    parser.add_argument("--max-queue", type=int, default=16, help="ASGI: queued requests before 429")
+    parser.add_argument("--deadline-ms", type=int, default=10000, help="ASGI: per-request deadline")
+    parser.add_argument("--clients", type=int, default=8, help="Clients posting small images back to back")
+    parser.add_argument("--slow-clients", type=int, default=4, help="Clients trickling 12 MP uploads")
+    parser.add_argument("--slow-rate", type=int, default=1_000_000, help="Upload speed of the slow clients, bytes/s")
+    parser.add_argument("--duration", type=float, default=15, help="Seconds of load per mode")
+    args = parser.parse_args()
+
+    small, large = jpeg(640, 480, 0), jpeg(4000, 3000, 1)
+    print(f"{args.clients} clients x 640x480 ({len(small) // 1024} KB), {args.slow_clients} slow clients x "
+          f"4000x3000 ({len(large) // 1024} KB at {args.slow_rate // 1000} KB/s), "
+          f"{args.workers} worker(s) x {args.threads} threads, {args.duration:.0f}s per mode")
+    p99 = {}
+    for mode in args.modes.split(","):
+        port = free_port()
+        process = start_server(mode, port, args)
+        try:
+            post(port, small)
+            fast, slow = run_load(port, args, small, large)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        p99[mode] = summarize(f"{mode} fast", fast, args.duration)
+        if slow:
+            summarize(f"{mode} slow", slow, args.duration)
+    if "sync" in p99 and "asgi" in p99:
+        print(f"fast-request p99: sync {p99['sync']:.0f} ms, asgi {p99['asgi']:.0f} ms "
+              f"({p99['sync'] / p99['asgi']:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
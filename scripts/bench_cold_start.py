@@ -0,0 +1,117 @@
+"""Cold-start benchmark for the serverless entry point (api/index.py).
+
+Every run is a fresh interpreter that imports api/index.py and serves one
+classify request through the Flask test client, the way a cold
+invocation does. Reports import, first-request and total wall time, and
+fails if the p99 total exceeds ``--budget-ms`` or skimage gets imported.
+
+    python scripts/bench_cold_start.py
+    python scripts/bench_cold_start.py --model scripts/rf_defungi.forest --runs 20 --budget-ms 800
+    python scripts/bench_cold_start.py --importtime
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import api.index as entry
+imported = time.perf_counter()
+with open(sys.argv[2], "rb") as f:
+    payload = f.read()
+response = entry.app.test_client().post("/api/classify-py", data=payload, content_type="image/jpeg")
+done = time.perf_counter()
+print(json.dumps({
+    "status": response.status_code,
+    "import_ms": (imported - start) * 1000,
+    "request_ms": (done - imported) * 1000,
+    "loaded": sorted(m for m in ("joblib", "sklearn", "skimage", "xgboost") if m in sys.modules),
+    "profile": entry.profile.report() if entry.profile.enabled else None,
+}))
+"""
+
+
+def sample_payload(path):
+    rng = np.random.default_rng(0)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8), (7, 7), 0)
+    cv2.imwrite(path, img)
+
+
+def cold_run(payload_path, env):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", CHILD, ROOT, payload_path], env=env,
+                         capture_output=True, text=True, check=True)
+    wall = (time.perf_counter() - start) * 1000
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["wall_ms"] = wall
+    return result
+
+
+def import_times(env, top):
+    """Cumulative import time per module from ``python -X importtime``."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {ROOT!r}); import api.index"],
+                         env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            rows.append((int(cumulative) / 1000, name.rstrip()))
+    for ms, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for api/index.py")
+    parser.add_argument("--model", help="FUNGI_MODEL_PATH for the runs (default: what api/index.py resolves)")
+    parser.add_argument("--runs", type=int, default=10, help="Cold invocations")
+    parser.add_argument("--budget-ms", type=float, default=1000, help="p99 budget for import + first request")
+    parser.add_argument("--importtime", action="store_true", help="Also list the slowest imports")
+    args = parser.parse_args()
+
+    env = dict(os.environ, FUNGI_STARTUP_PROFILE="1")
+    if args.model:
+        env["FUNGI_MODEL_PATH"] = os.path.abspath(args.model)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        payload_path = os.path.join(tmp, "sample.jpg")
+        sample_payload(payload_path)
+        runs = [cold_run(payload_path, env) for _ in range(args.runs)]
+
+    for key in ("wall_ms", "import_ms", "request_ms"):
+        values = np.array([run[key] for run in runs])
+        print(f"{key:10s} p50 {np.percentile(values, 50):7.1f}  p99 {np.percentile(values, 99):7.1f}  max {values.max():7.1f}")
+    stages = runs[-1]["profile"]["stages"]
+    print("stages (last run): " + ", ".join(f"{s['stage']} {s['ms']:.0f} ms" for s in stages))
+    loaded = sorted({m for run in runs for m in run["loaded"]})
+    print(f"heavy modules loaded: {', '.join(loaded) or 'none'}")
+    if args.importtime:
+        print("slowest imports (cumulative):")
+        import_times(env, 15)
+
+    failures = []
+    if any(run["status"] != 200 for run in runs):
+        failures.append("classify request failed")
+    if "skimage" in loaded:
+        failures.append("skimage was imported")
+    p99 = np.percentile([run["wall_ms"] for run in runs], 99)
+    if p99 > args.budget_ms:
+        failures.append(f"p99 {p99:.0f} ms over the {args.budget_ms:.0f} ms budget")
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print(f"p99 {p99:.0f} ms within the {args.budget_ms:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
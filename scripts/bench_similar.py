@@ -0,0 +1,117 @@
+"""Query latency of the similar-sample index as it grows.
+
+For each size, builds an index (fungiscope/similar.py) in a temporary
+directory and times, per query and for a batch of 32:
+
+    flat:     the memory-mapped blocked scan the servers use
+    brute:    float64 distances to every row + argsort (the naive scan)
+    kd/ball:  sklearn KDTree / BallTree (build time, then queries)
+
+Recall@k of each against the brute-force neighbours is reported next to
+the latencies. Rows are the given features repeated with small jitter,
+or synthetic correlated 40-column rows.
+
+    python scripts/bench_similar.py
+    python scripts/bench_similar.py --features X.npy --sizes 10000,100000,300000 --k 10
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.similar import build_index, load_index
+
+
+def synthetic_rows(n, n_features=40, seed=0):
+    """Clustered rows on a low-dimensional subspace, like real feature columns."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 3, (20, 8))
+    latent = centers[rng.integers(0, len(centers), n)] + rng.normal(0, 1, (n, 8))
+    return latent @ rng.normal(0, 1, (8, n_features)) + rng.normal(0, 0.1, (n, n_features))
+
+
+def grow(base, n, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = base[rng.integers(0, len(base), n)]
+    return rows + rng.normal(0, 0.02, rows.shape) * base.std(axis=0)
+
+
+def timed(fn, queries, batch):
+    """(p50 ms per single query, p95 ms, ms per batch of ``batch`` queries)."""
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q[None])
+        times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch):
+        fn(queries[i:i + batch])
+    batches = max(1, len(queries) // batch)
+    return (float(np.percentile(times, 50)) * 1e3, float(np.percentile(times, 95)) * 1e3,
+            (time.perf_counter() - start) / batches * 1e3)
+
+
+def recall(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similar-sample index benchmark")
+    parser.add_argument("--features", help="Base .npy feature matrix (default: synthetic rows)")
+    parser.add_argument("--sizes", default="10000,30000,100000,300000", help="Index sizes")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--no-trees", action="store_true", help="Skip the sklearn KDTree/BallTree rows")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    base = np.load(args.features).astype(np.float64) if args.features else synthetic_rows(max(sizes))
+    mean, scale = base.mean(axis=0), base.std(axis=0)
+    scale[scale == 0] = 1.0
+    queries = grow(base, args.queries, seed=1)
+    scratch = tempfile.mkdtemp()
+    print(f"k={args.k}, {args.queries} queries, batches of {args.batch}")
+    print(f"  {'rows':>8s} {'method':6s} {'build':>8s} {'p50':>9s} {'p95':>9s} {'batch':>9s} {'recall':>7s}")
+    try:
+        for n in sizes:
+            X = grow(base, n) if args.features else base[:n]
+            path = os.path.join(scratch, f"index-{n}")
+            start = time.perf_counter()
+            build_index(path, X, np.zeros(n, int), [f"{i}.jpg" for i in range(n)], mean, scale)
+            index = load_index(path)
+            rows = {"flat": (time.perf_counter() - start, lambda q: index.search(q, args.k)[0])}
+
+            Z = (X - mean) / scale
+
+            def brute(q):
+                return np.vstack([np.argsort(np.sqrt(((Z - (row - mean) / scale) ** 2).sum(axis=1)),
+                                             kind="stable")[:args.k] for row in q])
+
+            rows["brute"] = (0.0, brute)
+            if not args.no_trees:
+                from sklearn.neighbors import BallTree, KDTree
+                for name, tree_type in (("kd", KDTree), ("ball", BallTree)):
+                    start = time.perf_counter()
+                    tree = tree_type(Z)
+                    rows[name] = (time.perf_counter() - start,
+                                  lambda q, tree=tree: tree.query((q - mean) / scale, k=args.k)[1])
+
+            truth = np.vstack([brute(q[None]) for q in queries])
+            for name, (build, fn) in rows.items():
+                p50, p95, per_batch = timed(fn, queries, args.batch)
+                print(f"  {n:8d} {name:6s} {build:7.2f}s {p50:7.2f}ms {p95:7.2f}ms {per_batch:7.2f}ms"
+                      f" {recall(fn(queries), truth):7.3f}")
+            shutil.rmtree(path)
+    finally:
+        shutil.rmtree(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Per-stage micro-benchmarks of the classify pipeline, with baselines.
+
+Times every stage of ``decode_data_url`` -> ``decode_image`` ->
+``extract_all_features`` -> ``predict_proba`` on its own, on generated
+images from 256x256 up to 4000x3000, and ``predict_proba`` at several
+batch sizes. Runs offline: without ``--model`` a random forest is trained
+on random 40-feature rows and exported like scripts/export_forest.py does.
+
+    python scripts/bench_stages.py --save bench/baseline.json
+    python scripts/bench_stages.py --compare bench/baseline.json --threshold 0.15
+    python scripts/bench_stages.py --model scripts/rf_defungi.forest --sizes 640x480,4000x3000
+
+``--compare`` exits 1 when any stage is more than ``--threshold`` slower
+than the baseline (and by more than ``--min-ms``, to ignore noise on
+stages that take microseconds). On a busy machine ``--stat min_ms`` is
+steadier than the median.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.features import (IMAGE_SIZE, N_FEATURES, decode_data_url, decode_image,
+                                 extract_all_features, extract_glcm_features, extract_hsv_features,
+                                 extract_lbp_features)
+
+SIZES = "256x256,640x480,1600x1200,4000x3000"
+BATCH_SIZES = "1,8,32,128"
+
+
+def synthetic_jpeg(width, height, seed=0):
+    """Smooth blobs plus sensor noise, encoded like a camera JPEG."""
+    rng = np.random.default_rng(seed)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (max(height // 8, 1), max(width // 8, 1), 3), dtype=np.uint8),
+                            (9, 9), 0)
+    img = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = np.clip(img + rng.normal(0, 4, img.shape), 0, 255).astype(np.uint8)
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+
+
+def synthetic_model(seed=0):
+    from sklearn.ensemble import RandomForestClassifier
+    from fungiscope.forest import export_forest
+    rng = np.random.default_rng(seed)
+    X = rng.random((2000, N_FEATURES))
+    y = rng.integers(0, 5, len(X))
+    return export_forest(RandomForestClassifier(n_estimators=200, random_state=seed).fit(X, y))
+
+
+def measure(fn, min_time, min_runs=5, max_runs=1000):
+    """Median / p90 / min of ``fn()`` in ms, repeated for at least ``min_time`` seconds."""
+    fn()  # warm caches and lazy initialisation
+    times = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < min_runs or (time.perf_counter() < deadline and len(times) < max_runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1e3
+    return {"median_ms": float(np.median(times)), "p90_ms": float(np.percentile(times, 90)),
+            "min_ms": float(times.min()), "runs": len(times)}
+
+
+def image_stages(width, height):
+    """``[(stage, fn)]`` for one image size; each fn reuses the previous stage's output."""
+    payload = synthetic_jpeg(width, height)
+    data_url = "data:image/jpeg;base64," + base64.b64encode(payload).decode()
+    image = decode_image(payload)
+    resized = cv2.resize(image, IMAGE_SIZE)
+    gray = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+    hsv = cv2.cvtColor(resized, cv2.COLOR_BGR2HSV)
+    return [
+        ("b64decode", lambda: decode_data_url(data_url)),
+        ("imdecode", lambda: decode_image(payload)),
+        ("resize", lambda: cv2.resize(image, IMAGE_SIZE)),
+        ("gray", lambda: cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)),
+        ("hsv", lambda: cv2.cvtColor(resized, cv2.COLOR_BGR2HSV)),
+        ("glcm", lambda: extract_glcm_features(gray)),
+        ("lbp", lambda: extract_lbp_features(gray)),
+        ("hsv_hist", lambda: extract_hsv_features(hsv)),
+        ("extract_all", lambda: extract_all_features(image)),
+        ("end_to_end", lambda: extract_all_features(decode_image(decode_data_url(data_url)))),
+    ]
+
+
+def run(args):
+    if args.model:
+        from fungiscope.model import load_model
+        model = load_model(args.model)
+    else:
+        model = synthetic_model()
+    results = {}
+    for size in args.sizes.split(","):
+        width, height = (int(v) for v in size.lower().split("x"))
+        for stage, fn in image_stages(width, height):
+            key = f"{stage}@{width}x{height}"
+            results[key] = measure(fn, args.min_time)
+            print(f"  {key:28s} {results[key]['median_ms']:9.3f} ms  (p90 {results[key]['p90_ms']:.3f})", flush=True)
+    rng = np.random.default_rng(1)
+    for batch_size in (int(v) for v in args.batch_sizes.split(",")):
+        X = rng.random((batch_size, N_FEATURES))
+        key = f"predict_proba@batch{batch_size}"
+        results[key] = measure(lambda: model.predict_proba(X), args.min_time)
+        results[key]["per_row_ms"] = results[key]["median_ms"] / batch_size
+        print(f"  {key:28s} {results[key]['median_ms']:9.3f} ms  ({results[key]['per_row_ms']:.4f} ms/row)",
+              flush=True)
+    return results
+
+
+def environment():
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.machine(), "cpus": os.cpu_count(), "numpy": np.__version__,
+            "opencv": cv2.__version__, "opencv_threads": cv2.getNumThreads()}
+
+
+def compare(results, baseline, threshold, min_ms, stat="median_ms"):
+    """Print the per-stage ratio to the baseline and return the regressions."""
+    regressions = []
+    print(f"{'stage':28s} {'baseline':>10s} {'now':>10s} {'ratio':>7s}")
+    for key, result in results.items():
+        if key not in baseline["results"]:
+            print(f"{key:28s} {'-':>10s} {result[stat]:10.3f}    new")
+            continue
+        before = baseline["results"][key][stat]
+        ratio = result[stat] / before if before else float("inf")
+        flag = ""
+        if ratio > 1 + threshold and result[stat] - before > min_ms:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"{key:28s} {before:10.3f} {result[stat]:10.3f} {ratio:7.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of feature extraction and prediction")
+    parser.add_argument("--model", help="Model to time (default: synthetic 200-tree forest)")
+    parser.add_argument("--sizes", default=SIZES, help="Comma separated WIDTHxHEIGHT image sizes")
+    parser.add_argument("--batch-sizes", default=BATCH_SIZES, help="Comma separated predict_proba batch sizes")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds spent per stage")
+    parser.add_argument("--save", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown (0.10 = 10%%)")
+    parser.add_argument("--stat", choices=["median_ms", "min_ms", "p90_ms"], default="median_ms",
+                        help="Statistic compared against the baseline")
+    parser.add_argument("--min-ms", type=float, default=0.05, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": environment(),
+                       "model": args.model or "synthetic", "results": results}, f, indent=2)
+        print(f"baseline written to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("environment", {}).get("platform") != environment()["platform"]:
+            print("note: baseline was recorded on a different platform")
+        if baseline.get("model") != (args.model or "synthetic"):
+            print(f"note: baseline timed model {baseline.get('model')}, this run {args.model or 'synthetic'}")
+        regressions = compare(results, baseline, args.threshold, args.min_ms, args.stat)
+        if regressions:
+            print(f"FAIL: {len(regressions)} stage(s) more than {args.threshold:.0%} slower: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"no stage more than {args.threshold:.0%} slower than {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
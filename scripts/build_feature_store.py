@@ -0,0 +1,70 @@
+"""Build or update the offline feature store for a training dataset.
+
+    python scripts/build_feature_store.py --dataset dataset/ --store feature_store/
+    python scripts/build_feature_store.py --dataset dataset/ --store feature_store_nb/ --preset notebook
+    python scripts/build_feature_store.py --dataset dataset/ --store feature_store/ --set lbp.radius=2 --set lbp.points=16
+
+Only new or changed images are extracted; changing a group's settings
+(``--set``) recomputes just that group. Load the result with
+``fungiscope.feature_store.load_features(store)``.
+"""
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.feature_store import PRESETS, update_store
+
+
+def apply_overrides(config, overrides):
+    """``group.key=value`` overrides; values are parsed as JSON when possible."""
+    config = copy.deepcopy(config)
+    for override in overrides:
+        target, _, value = override.partition("=")
+        group, _, key = target.partition(".")
+        if group not in config["groups"] or not key or not value:
+            raise SystemExit(f"Bad --set {override!r}: expected <group>.<key>=<value> with group in "
+                             f"{', '.join(config['groups'])}")
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        config["groups"][group][key] = value
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental feature store builder")
+    parser.add_argument("--dataset", required=True, help="Dataset root (<class>/<image> layout)")
+    parser.add_argument("--store", required=True, help="Store directory")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="serving",
+                        help="serving: fungiscope.features (40); notebook: model_final.ipynb (55)")
+    parser.add_argument("--set", action="append", default=[], metavar="GROUP.KEY=VALUE",
+                        help="Override one extractor setting, e.g. lbp.radius=3")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: CPU count)")
+    args = parser.parse_args()
+
+    config = apply_overrides(PRESETS[args.preset], args.set)
+    last = [0.0]
+
+    def progress(done, total):
+        now = time.perf_counter()
+        if done == total or now - last[0] > 2:
+            last[0] = now
+            print(f"  {done}/{total} extracted", flush=True)
+
+    start = time.perf_counter()
+    summary = update_store(args.dataset, args.store, config, workers=args.workers, progress=progress)
+    elapsed = time.perf_counter() - start
+    recomputed = ", ".join(f"{name} {count}" for name, count in summary["recomputed"].items())
+    print(f"{summary['rows']} rows in {args.store} ({elapsed:.1f}s): {summary['new']} new, "
+          f"{summary['changed']} changed, {summary['unchanged']} unchanged, {summary['removed']} removed, "
+          f"{summary['failed']} failed; recomputed {recomputed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Build the similar-sample index the servers use for /similar and "top_k".
+
+Reads the training feature vectors, standardizes them with the training
+scaler and writes a memory-mapped index directory (see
+fungiscope/similar.py). Use the feature store built with the serving
+preset: its 40 columns are what the servers extract from a query image
+and what scaler_defungi.joblib was fitted on.
+
+    python scripts/build_similar_index.py --store feature_store/ --output models/similar
+    FUNGI_SIMILAR_INDEX=models/similar FUNGI_SIMILAR_IMAGES=dataset/ gunicorn -c gunicorn.conf.py render_app:app
+    curl -F image=@sample.jpg "localhost:5000/similar?top_k=5"
+"""
+import argparse
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.feature_store import load_features
+from fungiscope.similar import build_index, load_index
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similar-sample index")
+    parser.add_argument("--store", help="Feature store from scripts/build_feature_store.py (serving preset)")
+    parser.add_argument("--features", help="Alternatively, a .npy feature matrix ...")
+    parser.add_argument("--labels", help="... a .npy label vector ...")
+    parser.add_argument("--paths", help="... and a text file with one image path per row")
+    parser.add_argument("--scaler", default=os.path.join(SCRIPTS, "scaler_defungi.joblib"),
+                        help="Fitted StandardScaler for the feature columns")
+    parser.add_argument("--output", default="models/similar", help="Index directory")
+    args = parser.parse_args()
+
+    if args.store:
+        X, labels, paths = load_features(args.store)
+    elif args.features and args.labels and args.paths:
+        X, labels = np.load(args.features), np.load(args.labels, allow_pickle=False)
+        with open(args.paths) as f:
+            paths = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        parser.error("give --store, or --features, --labels and --paths")
+    if not len(X) == len(labels) == len(paths):
+        parser.error(f"{len(X)} feature rows, {len(labels)} labels and {len(paths)} paths")
+
+    scaler = joblib.load(args.scaler)
+    start = time.perf_counter()
+    build_index(args.output, X, labels, paths, scaler.mean_, scaler.scale_)
+    seconds = time.perf_counter() - start
+
+    index = load_index(args.output)
+    # every row should find itself first
+    sample = np.arange(0, len(index), max(1, len(index) // 100))
+    indices, distances = index.search(np.asarray(X)[sample], 1)
+    found = float((distances[:, 0] < 1e-4).mean())
+    print(f"{len(index)} references, {len(index.classes)} classes, built in {seconds:.2f}s -> {args.output}; "
+          f"{found:.0%} of {len(sample)} sampled rows find themselves")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Timing, memory and feature drift of reduced JPEG decoding.
+
+Decodes each JPEG at full resolution and with ``decode_image(min_side=...)``
+and reports decode time, peak memory of decode + feature extraction, and
+the relative drift of every feature group against the full decode. Fails
+if the median drift of any group exceeds ``--tolerance``.
+
+    python scripts/check_decode.py
+    python scripts/check_decode.py --images captures/ --min-side 512
+    python scripts/check_decode.py --sweep
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.features import FEATURE_GROUPS, decode_image, extract_all_features, jpeg_size
+
+SWEEP = (256, 512, 1024)
+
+
+def synthetic_jpegs(seed=0):
+    """Large smooth captures with sensor noise, like the microscope output."""
+    rng = np.random.default_rng(seed)
+    for width, height in [(4000, 3000), (3000, 4000), (1600, 1200), (800, 600)]:
+        base = cv2.GaussianBlur(rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8), (9, 9), 0)
+        img = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+        img = np.clip(img + rng.normal(0, 4, img.shape), 0, 255).astype(np.uint8)
+        yield f"synthetic-{width}x{height}", cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+
+
+def folder_jpegs(root, limit):
+    paths = sorted(p for p in glob.glob(os.path.join(root, "**", "*"), recursive=True)
+                   if p.lower().endswith((".jpg", ".jpeg")))
+    for path in paths[:limit]:
+        with open(path, "rb") as f:
+            yield path, f.read()
+
+
+def measure(image_bytes, min_side, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        img = decode_image(image_bytes, min_side)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    img = decode_image(image_bytes, min_side)
+    features, _ = extract_all_features(img)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, img.shape, features
+
+
+def relative_drift(actual, expected):
+    return np.abs(actual - expected) / (np.abs(expected) + 1e-3)
+
+
+def report(inputs, min_side, repeat, baseline):
+    times, peaks, drifts = [], [], []
+    for (name, image_bytes), (full_time, full_peak, _, expected) in zip(inputs, baseline):
+        elapsed, peak, shape, features = measure(image_bytes, min_side, repeat)
+        times.append((full_time, elapsed))
+        peaks.append((full_peak, peak))
+        drifts.append(relative_drift(features, expected))
+        print(f"  {name:28s} -> {shape[1]}x{shape[0]}  decode {full_time * 1e3:6.1f} -> {elapsed * 1e3:6.1f} ms"
+              f"  peak {full_peak / 1e6:6.1f} -> {peak / 1e6:6.1f} MB")
+    drifts = np.array(drifts)
+    full, reduced = np.sum(times, axis=0)
+    print(f"  total decode {full * 1e3:.1f} -> {reduced * 1e3:.1f} ms (x{full / reduced:.1f}),"
+          f" max peak {max(p for p, _ in peaks) / 1e6:.1f} -> {max(p for _, p in peaks) / 1e6:.1f} MB")
+    medians = {}
+    for group, sl in FEATURE_GROUPS.items():
+        medians[group] = float(np.median(drifts[:, sl]))
+        print(f"  drift [{group}] median {medians[group]:.3f}  max {float(drifts[:, sl].max()):.3f}")
+    return medians
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reduced JPEG decode check")
+    parser.add_argument("--images", type=str, help="Optional folder of JPEG captures to include")
+    parser.add_argument("--limit", type=int, default=50, help="Max images to read from --images")
+    parser.add_argument("--min-side", type=int, default=int(os.environ.get("FUNGI_REDUCED_DECODE", 0)) or 1024,
+                        help="Setting to check (default: FUNGI_REDUCED_DECODE or 1024)")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Max median relative drift per group")
+    parser.add_argument("--sweep", action="store_true", help=f"Also report min-side {', '.join(map(str, SWEEP))}")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repeats per image (best is kept)")
+    args = parser.parse_args()
+
+    inputs = list(synthetic_jpegs())
+    if args.images:
+        inputs += list(folder_jpegs(args.images, args.limit))
+    inputs = [(name, data) for name, data in inputs if jpeg_size(data) is not None]
+    baseline = [measure(data, None, args.repeat) for _, data in inputs]
+
+    if args.sweep:
+        for min_side in SWEEP:
+            if min_side != args.min_side:
+                print(f"min-side {min_side}")
+                report(inputs, min_side, args.repeat, baseline)
+
+    print(f"min-side {args.min_side} (tolerance {args.tolerance})")
+    medians = report(inputs, args.min_side, args.repeat, baseline)
+    failed = [group for group, drift in medians.items() if drift > args.tolerance]
+    if failed:
+        print(f"FAIL: drift above tolerance in {', '.join(failed)}")
+        sys.exit(1)
+    print(f"{len(inputs)} images checked, drift within tolerance")
+
+
+if __name__ == "__main__":
+    main()
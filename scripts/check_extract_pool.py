@@ -0,0 +1,81 @@
+"""Parity and throughput of the process-pool extraction backend.
+
+Checks that ``ProcessExtractor`` returns exactly the features of
+``extract_all_features``, then extracts the same decoded images from
+``--threads`` concurrent callers with the in-thread backend and with the
+process pool, and reports images per second for each.
+
+    python scripts/check_extract_pool.py
+    python scripts/check_extract_pool.py --processes 8 --threads 16 --images 400 --size 1600x1200
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.cache import dhash
+from fungiscope.extract_pool import ProcessExtractor, available_cores
+from fungiscope.features import extract_all_features, prepare_image
+
+
+def synthetic_images(count, width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        base = cv2.GaussianBlur(rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8), (9, 9), 0)
+        img = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+        images.append(np.clip(img + rng.normal(0, 6, img.shape), 0, 255).astype(np.uint8))
+    return images
+
+
+def throughput(extract, images, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(extract, images))
+    return len(images) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process-pool extraction backend check")
+    parser.add_argument("--processes", type=int, default=None, help="Pool size (default: available cores)")
+    parser.add_argument("--threads", type=int, default=None, help="Concurrent callers (default: 2 x processes)")
+    parser.add_argument("--images", type=int, default=200, help="Images per run")
+    parser.add_argument("--size", default="640x480", help="WIDTHxHEIGHT of the decoded images")
+    args = parser.parse_args()
+
+    processes = args.processes or available_cores()
+    threads = args.threads or 2 * processes
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    # a few distinct images, repeated
+    images = (synthetic_images(8, width, height) * (args.images // 8 + 1))[:args.images]
+
+    start = time.perf_counter()
+    extractor = ProcessExtractor(processes)
+    print(f"pool of {processes} processes started and warmed in {time.perf_counter() - start:.2f}s")
+    try:
+        mismatches = 0
+        for image in images[:8] + synthetic_images(2, 4000, 3000, seed=1):
+            expected, _ = extract_all_features(image)
+            features, phash = extractor.extract(image, phash=True)
+            if not np.array_equal(features, expected) or phash != dhash(prepare_image(image)[0]):
+                mismatches += 1
+        print(f"parity: {mismatches} mismatches in 10 images (incl. 4000x3000)")
+
+        in_thread = throughput(extract_all_features, images, threads)
+        pooled = throughput(extractor.extract, images, threads)
+        print(f"{args.images} x {width}x{height}, {threads} callers: thread {in_thread:.1f} img/s, "
+              f"process {pooled:.1f} img/s ({pooled / in_thread:.2f}x)")
+    finally:
+        extractor.close()
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Parity check between fungiscope.features and the original per-server extractors.
+
+Runs both implementations over synthetic images (and optionally a folder of
+real captures) and fails if any feature group drifts beyond the tolerance.
+LBP and HSV must match bit for bit; the GLCM engine only matches skimage up
+to float rounding, hence its relative tolerance. ``--timing`` also reports
+per-group speedups.
+
+    python scripts/check_features.py
+    python scripts/check_features.py --images dataset/ --limit 200 --timing
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from skimage.feature import graycomatrix, graycoprops, local_binary_pattern
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.features import (FEATURE_GROUPS, extract_all_features, extract_glcm_features,
+                                 extract_hsv_features, extract_lbp_features, prepare_image)
+from fungiscope.lbp import uniform_lbp
+
+EXACT_GROUPS = ("lbp", "hsv")
+
+# serving config and the training notebook's config
+LBP_CONFIGS = [(8, 1), (24, 3)]
+
+
+# reference: the extractors as they were copied into every server
+
+def legacy_glcm_features(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    glcm = graycomatrix(gray, distances=[1], angles=[0, np.pi/4, np.pi/2, 3*np.pi/4],
+                        levels=256, symmetric=True, normed=True)
+    features = []
+    props = ['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM']
+    for prop in props:
+        val = graycoprops(glcm, prop).mean()
+        features.append(val)
+    return np.array(features)
+
+def legacy_lbp_features(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    radius = 1
+    n_points = 8 * radius
+    lbp = local_binary_pattern(gray, n_points, radius, method='uniform')
+    hist, _ = np.histogram(lbp.ravel(), bins=np.arange(0, n_points + 3), range=(0, n_points + 2))
+    hist = hist.astype("float")
+    hist /= (hist.sum() + 1e-7)
+    return hist
+
+def legacy_hsv_features(image):
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    bins = 8
+    hist_h = cv2.calcHist([hsv], [0], None, [bins], [0, 180])
+    hist_s = cv2.calcHist([hsv], [1], None, [bins], [0, 256])
+    hist_v = cv2.calcHist([hsv], [2], None, [bins], [0, 256])
+    cv2.normalize(hist_h, hist_h)
+    cv2.normalize(hist_s, hist_s)
+    cv2.normalize(hist_v, hist_v)
+    return np.concatenate([hist_h.flatten(), hist_s.flatten(), hist_v.flatten()])
+
+def legacy_all_features(image):
+    img = cv2.resize(image, (256, 256))
+    feat_glcm = legacy_glcm_features(img)
+    feat_lbp = legacy_lbp_features(img)
+    feat_hsv = legacy_hsv_features(img)
+    return np.concatenate([feat_glcm, feat_lbp, feat_hsv])
+
+
+# inputs
+
+def synthetic_images(seed=0):
+    rng = np.random.default_rng(seed)
+    yield "noise-256", rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)
+    yield "noise-640x480", rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    yield "flat", np.full((300, 300, 3), 127, np.uint8)
+    yield "black", np.zeros((256, 256, 3), np.uint8)
+    ramp = np.tile(np.linspace(0, 255, 512, dtype=np.uint8), (384, 1))
+    yield "ramp", np.dstack([ramp, ramp[::-1], np.flipud(ramp)])
+    blobs = cv2.GaussianBlur(rng.integers(0, 256, (1024, 768, 3), dtype=np.uint8), (31, 31), 0)
+    yield "blobs-1024x768", blobs
+    yield "tiny-32", rng.integers(0, 256, (32, 48, 3), dtype=np.uint8)
+
+
+def folder_images(root, limit):
+    paths = sorted(p for p in glob.glob(os.path.join(root, "**", "*"), recursive=True)
+                   if p.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")))
+    for path in paths[:limit]:
+        img = cv2.imread(path)
+        if img is not None:
+            yield path, img
+
+
+def check_lbp_configs(inputs):
+    """The LBP engine must reproduce skimage's label image for every config we use."""
+    failures = 0
+    for points, radius in LBP_CONFIGS:
+        for name, img in inputs:
+            gray = cv2.cvtColor(cv2.resize(img, (256, 256)), cv2.COLOR_BGR2GRAY)
+            expected = local_binary_pattern(gray, points, radius, method='uniform')
+            if not np.array_equal(uniform_lbp(gray, points, radius), expected):
+                failures += 1
+                print(f"FAIL {name} [lbp P={points} R={radius}] label image differs")
+    return failures
+
+
+def best_time(fn, arg, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report_timing(inputs, repeat):
+    pairs = {
+        "glcm": (legacy_glcm_features, extract_glcm_features),
+        "lbp": (legacy_lbp_features, extract_lbp_features),
+        "hsv": (legacy_hsv_features, extract_hsv_features),
+    }
+    totals = {group: [0.0, 0.0] for group in pairs}
+    for _, img in inputs:
+        img = cv2.resize(img, (256, 256))
+        gray, hsv = prepare_image(img)
+        for group, (legacy, current) in pairs.items():
+            totals[group][0] += best_time(legacy, img, repeat)
+            totals[group][1] += best_time(current, hsv if group == "hsv" else gray, repeat)
+    for group, (old, new) in totals.items():
+        n = len(inputs)
+        print(f"{group:5s} legacy {old / n * 1e3:8.3f} ms   current {new / n * 1e3:8.3f} ms   x{old / new:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Feature extractor parity check")
+    parser.add_argument("--images", type=str, help="Optional folder of real images to include")
+    parser.add_argument("--limit", type=int, default=100, help="Max images to read from --images")
+    parser.add_argument("--rtol", type=float, default=1e-9, help="Relative tolerance per GLCM feature")
+    parser.add_argument("--atol", type=float, default=1e-12, help="Absolute tolerance per GLCM feature")
+    parser.add_argument("--timing", action="store_true", help="Also time each group, legacy vs current")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repeats per image (best is kept)")
+    args = parser.parse_args()
+
+    inputs = list(synthetic_images())
+    if args.images:
+        inputs += list(folder_images(args.images, args.limit))
+
+    failures = 0
+    for name, img in inputs:
+        expected = legacy_all_features(img)
+        actual, groups = extract_all_features(img)
+        for group, sl in FEATURE_GROUPS.items():
+            assert np.shares_memory(groups[group], actual)
+            if group in EXACT_GROUPS:
+                ok = np.array_equal(actual[sl], expected[sl])
+            else:
+                ok = np.allclose(actual[sl], expected[sl], rtol=args.rtol, atol=args.atol)
+            if not ok:
+                failures += 1
+                err = float(np.max(np.abs(actual[sl] - expected[sl])))
+                print(f"FAIL {name} [{group}] max abs diff {err:.3e}")
+    failures += check_lbp_configs(inputs)
+    print(f"{len(inputs)} images checked, {failures} mismatches")
+    if args.timing:
+        report_timing(inputs, args.repeat)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Memory per worker for N forked workers, the way gunicorn runs them.
+
+``private``: every worker loads the model itself after the fork (gunicorn
+without --preload). ``preload``: the master loads it once and the workers
+inherit it. Each worker runs a batch of predictions first so the model
+pages are actually touched, then reports RSS, shared, private and PSS;
+the PSS sum is the real footprint of all workers together.
+
+    python scripts/check_memory.py scripts/rf_defungi.joblib --workers 4
+    python scripts/export_forest.py scripts/rf_defungi.joblib --bundle
+    python scripts/check_memory.py scripts/rf_defungi.forest --workers 16
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.features import N_FEATURES
+from fungiscope.memory import process_memory
+from fungiscope.model import load_model
+
+_model = None
+
+
+def _worker(model_path, rows, barrier, results):
+    model = _model if _model is not None else load_model(model_path)
+    model.predict_proba(rows)
+    # everyone must be alive while measuring, or PSS does not split the sharing
+    barrier.wait()
+    results.put(process_memory())
+    barrier.wait()
+
+
+def run(model_path, mode, n_workers, rows):
+    global _model
+    ctx = multiprocessing.get_context("fork")
+    _model = load_model(model_path) if mode == "preload" else None
+    barrier, results = ctx.Barrier(n_workers), ctx.Queue()
+    workers = [ctx.Process(target=_worker, args=(model_path, rows, barrier, results)) for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+    memory = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    _model = None
+    return memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-worker memory, private vs preloaded model")
+    parser.add_argument("model", help="joblib model, .npz or bundle directory")
+    parser.add_argument("--workers", type=int, default=4, help="Number of forked workers")
+    parser.add_argument("--rows", type=int, default=256, help="Rows each worker predicts before measuring")
+    parser.add_argument("--features", type=int, default=N_FEATURES, help="Features per row")
+    args = parser.parse_args()
+
+    # the parent does not load the model itself, like a gunicorn master without preload
+    rows = np.random.default_rng(0).random((args.rows, args.features))
+    for mode in ("private", "preload"):
+        memory = run(args.model, mode, args.workers, rows)
+        mean = {key: np.mean([m.get(key, 0) for m in memory]) / 1e6 for key in ("rss", "shared", "private", "pss")}
+        total = sum(m.get("pss", m["rss"]) for m in memory) / 1e6
+        print(f"{mode:8s} {args.workers} workers: per worker rss {mean['rss']:.1f} MB, shared {mean['shared']:.1f} MB,"
+              f" private {mean['private']:.1f} MB, pss {mean['pss']:.1f} MB; total pss {total:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
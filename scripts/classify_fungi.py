@@ -1,75 +1,28 @@
 import cv2
 import numpy as np
-from skimage.feature import graycomatrix, graycoprops, local_binary_pattern
-import joblib
 import argparse
+import csv
+import glob
+import json
 import sys
 import os
+from multiprocessing import Pool
 
-# feat ex
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def extract_glcm_features(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
-    # Calculate GLCM (distance 1 pixel, angles 0, 45, 90, 135 degrees)
-    glcm = graycomatrix(gray, distances=[1], angles=[0, np.pi/4, np.pi/2, 3*np.pi/4], 
-                        levels=256, symmetric=True, normed=True)
-    
-    features = []
-    props = ['contrast', 'dissimilarity', 'homogeneity', 'energy', 'correlation', 'ASM']
-    
-    for prop in props:
-        val = graycoprops(glcm, prop).mean()
-        features.append(val)
-        
-    return np.array(features)
-
-def extract_lbp_features(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
-    radius = 1
-    n_points = 8 * radius
-    
-    lbp = local_binary_pattern(gray, n_points, radius, method='uniform')
-    
-    hist, _ = np.histogram(lbp.ravel(), bins=np.arange(0, n_points + 3), range=(0, n_points + 2))
-    
-    hist = hist.astype("float")
-    hist /= (hist.sum() + 1e-7)
-    
-    return hist
-
-def extract_hsv_features(image):
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    
-    bins = 8
-    hist_h = cv2.calcHist([hsv], [0], None, [bins], [0, 180])
-    hist_s = cv2.calcHist([hsv], [1], None, [bins], [0, 256])
-    hist_v = cv2.calcHist([hsv], [2], None, [bins], [0, 256])
-    
-    cv2.normalize(hist_h, hist_h)
-    cv2.normalize(hist_s, hist_s)
-    cv2.normalize(hist_v, hist_v)
-    
-    return np.concatenate([hist_h.flatten(), hist_s.flatten(), hist_v.flatten()])
-
-def extract_all_features(image):
-    img = cv2.resize(image, (256, 256))
-    
-    feat_glcm = extract_glcm_features(img)
-    feat_lbp = extract_lbp_features(img)
-    feat_hsv = extract_hsv_features(img)
-    
-    return np.concatenate([feat_glcm, feat_lbp, feat_hsv])
+from fungiscope.cache import cache_from_env
+from fungiscope.features import decode_image, extract_all_features, split_features
+from fungiscope.metrics import instrument, stage
+from fungiscope.model import load_model, predict_batch, predict_staged
+from fungiscope.registry import registry_from_env
+from fungiscope.serving import (REDUCED_DECODE_MIN_SIDE, UploadError, batch_request_images, classify_batch,
+                                extract_features, model_admin, request_image_bytes, request_top_k)
+from fungiscope.similar import index_from_env
 
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
 
 # classification model 
 
-def load_model(model_path):
-    if not os.path.exists(model_path):
-        raise FileNotFoundError(f"Model file not found: {model_path}")
-    return joblib.load(model_path)
-
 def classify_image(image_path, model_path):
     # Load image
     img = cv2.imread(image_path)
@@ -80,12 +33,12 @@ def classify_image(image_path, model_path):
     model = load_model(model_path)
     
     # Extract features
-    features = extract_all_features(img)
-    features = features.reshape(1, -1)
+    features, _ = extract_all_features(img)
     
     # Predict
-    prediction = model.predict(features)[0]
-    probabilities = model.predict_proba(features)[0]
+    labels, probabilities = predict_batch(model, features)
+    prediction = labels[0]
+    probabilities = probabilities[0]
     confidence = max(probabilities)
     
     return {
@@ -95,6 +48,130 @@ def classify_image(image_path, model_path):
     }
 
 
+# batch mode
+
+def _init_worker():
+    # one process per core already; keep OpenCV from spawning its own threads
+    cv2.setNumThreads(1)
+
+def _extract_file(image_path):
+    """Pool worker: decode and extract one file, never raise."""
+    try:
+        if REDUCED_DECODE_MIN_SIDE:
+            img = decode_image(np.fromfile(image_path, np.uint8), REDUCED_DECODE_MIN_SIDE)
+        else:
+            img = cv2.imread(image_path)
+        if img is None:
+            return image_path, None, "Could not load image"
+        features, _ = extract_all_features(img)
+        return image_path, features, None
+    except Exception as e:
+        return image_path, None, str(e)
+
+def find_images(input_dir, pattern="**/*"):
+    paths = glob.glob(os.path.join(input_dir, pattern), recursive=True)
+    return sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(p))
+
+def read_checkpoint(checkpoint_path):
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path) as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+class ResultWriter:
+    """Append results to a JSONL or CSV file as they are produced."""
+
+    CSV_FIELDS = ["image", "class", "confidence", "error"]
+
+    def __init__(self, output_path, fmt=None, class_labels=()):
+        self.fmt = fmt or ("csv" if output_path.lower().endswith(".csv") else "jsonl")
+        self.class_labels = [str(c) for c in class_labels]
+        is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self.file = open(output_path, "a", newline="")
+        if self.fmt == "csv":
+            self.csv = csv.writer(self.file)
+            if is_new:
+                self.csv.writerow(self.CSV_FIELDS + [f"p_{c}" for c in self.class_labels])
+
+    def write(self, result):
+        if self.fmt == "csv":
+            probs = result.get("probabilities", {})
+            self.csv.writerow([result["image"], result.get("class", ""), result.get("confidence", ""),
+                               result.get("error", "")] + [probs.get(c, "") for c in self.class_labels])
+        else:
+            self.file.write(json.dumps(result) + "\n")
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def classify_directory(input_dir, model_path, output_path, pattern="**/*", workers=None,
+                       chunk_size=64, checkpoint_path=None, fmt=None):
+    """Classify every image under ``input_dir`` and stream results to ``output_path``.
+
+    The model is loaded once. Decoding and feature extraction run in a
+    process pool; feature vectors are grouped into chunks of ``chunk_size``
+    and each chunk is scored with one ``predict_proba`` call. After a chunk
+    is written its paths are appended to ``checkpoint_path``, and images
+    already listed there are skipped, so an interrupted run can resume.
+    Returns ``(n_done, n_skipped)``.
+    """
+    checkpoint_path = checkpoint_path or output_path + ".done"
+    done = read_checkpoint(checkpoint_path)
+    listed = find_images(input_dir, pattern)
+    paths = [p for p in listed if p not in done]
+    # only this run's images: the checkpoint may list files since removed or outside --glob
+    skipped = len(listed) - len(paths)
+    if not paths:
+        return 0, skipped
+
+    model = load_model(model_path)
+    labels = [c.item() if hasattr(c, "item") else c for c in model.classes_]
+    writer = ResultWriter(output_path, fmt, labels)
+    checkpoint = open(checkpoint_path, "a")
+    n_done = 0
+
+    def flush_chunk(chunk, failed):
+        results = list(failed)
+        if chunk:
+            predicted, probabilities = predict_batch(model, [features for _, features in chunk])
+            for (image_path, _), label, probs in zip(chunk, predicted, probabilities):
+                results.append({
+                    "image": image_path,
+                    "class": label.item() if hasattr(label, "item") else label,
+                    "confidence": float(probs.max()),
+                    "probabilities": {str(c): float(p) for c, p in zip(labels, probs)},
+                })
+        for result in results:
+            writer.write(result)
+        writer.flush()
+        # only checkpoint once the results are on disk
+        checkpoint.writelines(result["image"] + "\n" for result in results)
+        checkpoint.flush()
+        return len(results)
+
+    try:
+        with Pool(workers or os.cpu_count(), initializer=_init_worker) as pool:
+            chunk, failed = [], []
+            for image_path, features, error in pool.imap_unordered(_extract_file, paths, chunksize=4):
+                if error is None:
+                    chunk.append((image_path, features))
+                else:
+                    failed.append({"image": image_path, "error": error})
+                if len(chunk) + len(failed) >= chunk_size:
+                    n_done += flush_chunk(chunk, failed)
+                    chunk, failed = [], []
+            if chunk or failed:
+                n_done += flush_chunk(chunk, failed)
+    finally:
+        writer.close()
+        checkpoint.close()
+    return n_done, skipped
+
+
 # flask server
 
 def run_server(model_path, host='0.0.0.0', port=5000):
@@ -102,7 +179,6 @@ def run_server(model_path, host='0.0.0.0', port=5000):
     try:
         from flask import Flask, request, jsonify
         from flask_cors import CORS
-        import base64
     except ImportError:
         print("Please install Flask and flask-cors: pip install flask flask-cors")
         sys.exit(1)
@@ -110,40 +186,52 @@ def run_server(model_path, host='0.0.0.0', port=5000):
     app = Flask(__name__)
     CORS(app)
     
-    # Load model once at startup
-    model = load_model(model_path)
+    # Load model once at startup; FUNGI_MODEL_WATCH_INTERVAL / FUNGI_MODEL_DIR
+    # and POST /admin/model reload it while the server runs
+    # (/classify returns the feature vector, so only the batch route is cached)
+    models = registry_from_env(model_path, cache_factory=cache_from_env)
+    if models.current is None:
+        sys.exit(f"Could not load model: {models.last_error}")
+    # GET /metrics and Server-Timing headers
+    instrument(app, cache=models.cache)
+    # nearest references for "top_k" (FUNGI_SIMILAR_INDEX / --similar-index)
+    similar_index = index_from_env()
     
     @app.route('/classify', methods=['POST'])
     def classify():
+        # in-flight requests finish on the model they started with
+        with models.use() as active:
+            return classify_with(active)
+    
+    def classify_with(active):
         try:
-            data = request.json
-            image_data = data.get('image', '')
+            # raw body, multipart file "image" or JSON {"image": <base64>}
+            try:
+                image_bytes = request_image_bytes(request)
+                top_k = request_top_k(request)
+            except UploadError as e:
+                return jsonify({"error": str(e)}), e.status
+            if top_k and similar_index is None:
+                return jsonify({"error": "Similar-image search is not enabled"}), 400
             
-            # Decode base64 image
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_data)
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            with stage("decode"):
+                img = decode_image(image_bytes, REDUCED_DECODE_MIN_SIDE)
             
             if img is None:
                 return jsonify({"error": "Invalid image"}), 400
             
-            # Extract features
-            features = extract_all_features(img)
+            # Extract features (groups are views into the same vector)
+            with stage("extract"):
+                features = extract_features(img)
+            groups = split_features(features)
             features = features.reshape(1, -1)
             
             # Predict
-            prediction = model.predict(features)[0]
-            probabilities = model.predict_proba(features)[0]
+            with stage("predict"):
+                labels, probabilities, stages = predict_staged(active.model, features)
+                prediction, probabilities = labels[0], probabilities[0]
             confidence = max(probabilities)
             
-            # Return feature counts for UI
-            feat_glcm = extract_glcm_features(cv2.resize(img, (256, 256)))
-            feat_lbp = extract_lbp_features(cv2.resize(img, (256, 256)))
-            feat_hsv = extract_hsv_features(cv2.resize(img, (256, 256)))
-
             if(prediction==0):
                 prediction = "Candida Albicans"
             elif(prediction==1):
@@ -157,19 +245,44 @@ def run_server(model_path, host='0.0.0.0', port=5000):
             else:
                 prediction = "Unable to Classify Species"
             
-            return jsonify({
+            response = {
                 "class": prediction,
                 "confidence": float(confidence),
+                "stage": str(stages[0]),
+                "model_version": active.version,
                 "features": {
-                    "glcm": feat_glcm.tolist(),
-                    "lbp": feat_lbp.tolist(),
-                    "hsv": feat_hsv.tolist()
+                    "glcm": groups["glcm"].tolist(),
+                    "lbp": groups["lbp"].tolist(),
+                    "hsv": groups["hsv"].tolist()
                 }
-            })
+            }
+            if top_k:
+                with stage("similar"):
+                    response["similar"] = similar_index.similar(features, top_k)
+            return jsonify(response)
             
         except Exception as e:
             return jsonify({"error": str(e)}), 500
     
+    @app.route('/classify/batch', methods=['POST'])
+    def classify_batch_route():
+        try:
+            images, error, status = batch_request_images(request)
+            if error:
+                return jsonify({"error": error}), status
+            with models.use() as active:
+                return jsonify({"results": classify_batch(active.model, images, cache=active.cache),
+                                "model_version": active.version})
+            
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    
+    @app.route('/admin/model', methods=['GET', 'POST'])
+    def model_admin_route():
+        # FUNGI_ADMIN_TOKEN enables it: GET = active version, POST = reload
+        body, status = model_admin(models, request)
+        return jsonify(body), status
+    
     print(f"Starting server on http://{host}:{port}")
     app.run(host=host, port=port, debug=False)
 
@@ -182,11 +295,32 @@ if __name__ == "__main__":
     parser.add_argument("--model", type=str, default="model.joblib", help="Path to model file")
     parser.add_argument("--server", action="store_true", help="Run as Flask server")
     parser.add_argument("--port", type=int, default=5000, help="Server port")
+    parser.add_argument("--input-dir", type=str, help="Classify every image in this directory")
+    parser.add_argument("--glob", type=str, default="**/*", help="Pattern under --input-dir (default: all images, recursive)")
+    parser.add_argument("--output", type=str, default="predictions.jsonl", help="Batch output file (.jsonl or .csv)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="Batch output format (default: from --output extension)")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Images per predict_proba call")
+    parser.add_argument("--checkpoint", type=str, help="Checkpoint file for resuming (default: <output>.done)")
+    parser.add_argument("--backend", choices=["thread", "process"],
+                        help="Server feature extraction: in request threads or a shared-memory process pool "
+                             "(default: FUNGI_EXTRACT_BACKEND or thread); --input-dir always uses processes")
+    parser.add_argument("--similar-index", type=str,
+                        help="Server: index from scripts/build_similar_index.py for \"top_k\" (default: FUNGI_SIMILAR_INDEX)")
     
     args = parser.parse_args()
+    if args.backend:
+        os.environ["FUNGI_EXTRACT_BACKEND"] = args.backend
+    if args.similar_index:
+        os.environ["FUNGI_SIMILAR_INDEX"] = args.similar_index
     
     if args.server:
         run_server(args.model, port=args.port)
+    elif args.input_dir:
+        n_done, n_skipped = classify_directory(args.input_dir, args.model, args.output, pattern=args.glob,
+                                               workers=args.workers, chunk_size=args.chunk_size,
+                                               checkpoint_path=args.checkpoint, fmt=args.format)
+        print(f"Classified {n_done} images ({n_skipped} already done) -> {args.output}")
     elif args.image:
         result = classify_image(args.image, args.model)
         print(f"\nClassification Result:")
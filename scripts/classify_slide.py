@@ -0,0 +1,95 @@
+"""Classify a whole-slide image tile by tile.
+
+Slides a 256x256 window over the image at native resolution (see
+fungiscope/tiles.py), prints the slide label aggregated over all windows
+and optionally saves the per-tile probability map and a heatmap of the
+top class per tile.
+
+    python scripts/classify_slide.py slide.jpg --model scripts/rf_defungi.joblib
+    python scripts/classify_slide.py slide.png --stride 64 --aggregate vote --output slide_map.npz --heatmap slide_map.png
+
+A ``.npy`` slide (H x W x 3, BGR uint8) is memory-mapped instead of read,
+for images too large for cv2.imread.
+"""
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.model import CLASS_NAMES, class_name, load_model
+from fungiscope.tiles import DEFAULT_STRIDE, TILE, classify_tiles
+
+# BGR colour per class for the heatmap
+CLASS_COLORS = [(76, 177, 34), (36, 28, 237), (232, 162, 0), (0, 201, 255), (164, 73, 163)]
+
+
+def read_slide(path):
+    if path.endswith(".npy"):
+        slide = np.load(path, mmap_mode="r")
+        if slide.ndim != 3 or slide.shape[2] != 3 or slide.dtype != np.uint8:
+            raise ValueError(f"Expected an H x W x 3 uint8 array, got {slide.shape} {slide.dtype}")
+        return slide
+    slide = cv2.imread(path)
+    if slide is None:
+        raise ValueError(f"Could not load image: {path}")
+    return slide
+
+
+def heatmap(slide, result, max_side=1024):
+    """Slide thumbnail tinted with the top class of each tile, by confidence."""
+    height, width = slide.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    step = max(1, int(1 / scale))
+    thumb = cv2.resize(np.ascontiguousarray(slide[::step, ::step]), (round(width * scale), round(height * scale)))
+    colors = np.zeros(thumb.shape, np.float64)
+    weight = np.zeros(thumb.shape[:2], np.float64)
+    # where tiles overlap their colours are averaged
+    for i, y in enumerate(result["ys"]):
+        for j, x in enumerate(result["xs"]):
+            probs = result["probabilities"][i, j]
+            top = int(probs.argmax())
+            y0, y1 = round(y * scale), round((y + TILE) * scale)
+            x0, x1 = round(x * scale), round((x + TILE) * scale)
+            colors[y0:y1, x0:x1] += np.array(CLASS_COLORS[top % len(CLASS_COLORS)]) * probs[top]
+            weight[y0:y1, x0:x1] += 1
+    colors /= np.maximum(weight, 1)[..., None]
+    return cv2.addWeighted(thumb, 0.5, colors.astype(np.uint8), 0.5, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiled whole-slide classification")
+    parser.add_argument("slide", help="Image file, or a .npy H x W x 3 BGR array (memory-mapped)")
+    parser.add_argument("--model", default="scripts/rf_defungi.joblib", help="Path to model file")
+    parser.add_argument("--stride", type=int, default=DEFAULT_STRIDE, help="Window stride in pixels")
+    parser.add_argument("--strip-rows", type=int, default=64, help="Rows converted at a time")
+    parser.add_argument("--aggregate", choices=["mean", "vote"], default="mean",
+                        help="Slide label from mean tile probabilities or a majority vote")
+    parser.add_argument("--output", help="Save the probability map (.npz: probabilities, ys, xs, classes)")
+    parser.add_argument("--heatmap", help="Save a heatmap PNG of the top class per tile")
+    args = parser.parse_args()
+
+    slide = read_slide(args.slide)
+    model = load_model(args.model)
+    result = classify_tiles(model, slide, stride=args.stride, strip_rows=args.strip_rows, method=args.aggregate)
+
+    rows, cols = result["probabilities"].shape[:2]
+    print(f"{args.slide}: {slide.shape[1]}x{slide.shape[0]}, {rows}x{cols} tiles at stride {args.stride}")
+    print(f"  Class: {result['class']} ({result['confidence']:.2%}, {args.aggregate})")
+    for label, score in zip(model.classes_, result["scores"]):
+        print(f"  {class_name(label, str(label))}: {score:.2%}")
+
+    if args.output:
+        np.savez_compressed(args.output, probabilities=result["probabilities"], ys=result["ys"], xs=result["xs"],
+                            classes=np.asarray(model.classes_), class_names=np.asarray(CLASS_NAMES))
+        print(f"probability map -> {args.output}")
+    if args.heatmap:
+        cv2.imwrite(args.heatmap, heatmap(slide, result))
+        print(f"heatmap -> {args.heatmap}")
+
+
+if __name__ == "__main__":
+    main()
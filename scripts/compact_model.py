@@ -0,0 +1,358 @@
+"""Export a smaller serving model: depth cap, tree selection, float32 arrays.
+
+Starting from the trained joblib model (or an exported forest, which
+skips the depth cap):
+
+1. depth cap (random forests): each ``--depths`` candidate cuts the trees
+   at that depth, the nodes there becoming leaves with their class
+   distribution; the shallowest one within half the budget is kept
+2. tree selection: trees are added greedily, each time the one that brings
+   the running average closest to the original's probabilities. The
+   greedy order fits the rows it was built on, so the tree count is
+   cross-fitted: the selection rows are split in two, and the order built
+   on one half must meet the budget on the other; the larger count is
+   kept. For XGBoost only whole trailing boosting rounds can go, so the
+   shortest prefix of rounds is kept instead
+3. float32: thresholds rounded down to float32 (the forest already compares
+   float32 features, so every split goes the same way), float32 leaf
+   values, uint8 feature indices
+
+The budget is against the original model, not the labels: at most
+``--max-accuracy-drop`` of the rows may change their top class and the
+probabilities may move by ``--max-prob-change`` on average (total
+variation). Fitting the labels of a few hundred rows tends to pick a
+handful of lucky trees.
+
+Both choices are made on one half of the held-out rows; the report uses
+the other half: file size, load time, memory of a worker after loading
+and predicting, latency for one row and a batch of 256, and accuracy
+and agreement against the original.
+
+    python scripts/compact_model.py scripts/rf_defungi.joblib --features X_test.npy --labels y_test.npy
+    python scripts/compact_model.py scripts/rf_defungi.joblib --store feature_store/ --max-accuracy-drop 0.002
+    FUNGI_MODEL_PATH=scripts/rf_defungi-compact gunicorn -c gunicorn.conf.py render_app:app
+
+The output is an artifact directory (``forest/`` bundle + ``metadata.json``
+with the report) that ``load_model`` reads like a train_model.py artifact.
+It is built next to ``--output`` and renamed into place; an existing
+``--output`` is only replaced if it is an earlier compact artifact (or
+with ``--force``).
+With ``--store`` the held-out rows are the ``--test-size``/``--seed``
+split of scripts/train_model.py; ``--features``/``--labels`` are used as
+held-out rows as they are.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.feature_store import load_features
+from fungiscope.forest import ArrayForest, export_forest
+from fungiscope.memory import process_memory
+from fungiscope.model import load_model
+
+DEPTHS = "24,20,16,14,12,10,8"
+
+
+def median_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def predict(model, X):
+    return np.asarray(model.classes_)[model.predict_proba(X).argmax(axis=1)]
+
+
+def closeness(probabilities, reference):
+    """Share of rows with the same top class, and mean total-variation distance."""
+    agreement = float((probabilities.argmax(axis=1) == reference.argmax(axis=1)).mean())
+    return agreement, float(np.abs(probabilities - reference).sum(axis=1).mean() / 2)
+
+
+def choose_depth(model, depths, X, reference, min_agreement, max_change):
+    """Shallowest depth cap close enough to the ``reference`` probabilities, or None."""
+    chosen = None
+    for depth in sorted(depths, reverse=True):
+        capped = export_forest(model, max_depth=depth)
+        agreement, change = closeness(capped.predict_proba(X), reference)
+        print(f"  depth {depth:3d}: {capped.n_nodes:8d} nodes, agreement {agreement:.2%}, "
+              f"probability change {change:.4f}")
+        if agreement < min_agreement or change > max_change:
+            break
+        chosen = depth
+    return chosen
+
+
+def greedy_curve(forest, X, reference):
+    """Trees in greedy order, each the one bringing the running average closest
+    to ``reference`` (squared error), with the closeness after each step (rf)."""
+    per_tree = forest.value[forest.apply(X)].astype(np.float64).transpose(1, 0, 2)  # trees x rows x classes
+    running = np.zeros(per_tree.shape[1:])
+    remaining = list(range(forest.n_trees))
+    order, curve = [], []
+    while remaining:
+        candidates = (running + per_tree[remaining]) / (len(order) + 1)
+        best = int(((candidates - reference) ** 2).sum(axis=(1, 2)).argmin())
+        tree = remaining.pop(best)
+        running += per_tree[tree]
+        order.append(tree)
+        curve.append(closeness(running / len(order), reference))
+    return order, curve
+
+
+def round_curve(forest, X, reference):
+    """Trees round by round and the closeness after each whole round (xgb)."""
+    # trees go round by round, class by class: a round ends where class 0 comes back
+    tree_class = np.asarray(forest.tree_class)
+    index = np.arange(len(tree_class))
+    first_other = index[tree_class != 0].min(initial=len(tree_class))
+    per_round = int(index[(tree_class == 0) & (index > first_other)].min(initial=len(tree_class)))
+    leaf_values = forest.value[forest.apply(X), 0]  # rows x trees
+    margin = np.tile(forest.base_margin, (len(X), 1))
+    curve = []
+    for start in range(0, forest.n_trees, per_round):
+        margin += leaf_values[:, start:start + per_round] @ forest._tree_onehot[start:start + per_round]
+        probabilities = np.exp(margin - margin.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        curve.extend([closeness(probabilities, reference)] * min(per_round, forest.n_trees - start))
+    return list(range(forest.n_trees)), curve
+
+
+def order_curve(forest, order, X, reference):
+    """Closeness to ``reference`` on rows ``X`` after each tree of ``order``."""
+    if forest.kind == "xgb":
+        return round_curve(forest, X, reference)[1]
+    per_tree = forest.value[forest.apply(X)][:, order].astype(np.float64).transpose(1, 0, 2)
+    running = np.cumsum(per_tree, axis=0) / np.arange(1, len(order) + 1)[:, None, None]
+    return [closeness(probabilities, reference) for probabilities in running]
+
+
+def smallest_within(ends, curve, min_agreement, max_change):
+    return next(k for k in ends if curve[k - 1][0] >= min_agreement and curve[k - 1][1] <= max_change
+                or k == ends[-1])
+
+
+def select_trees(forest, X, reference, min_agreement, max_change, n_trees=None, seed=0):
+    """Tree indices to keep: the smallest set close enough to ``reference``.
+
+    Random-forest trees can go in any order; XGBoost trees only as whole
+    trailing rounds, since each round corrects the ones before it. The
+    count is the larger of the two cross-fitted ones (order from one half
+    of ``X``, budget checked on the other).
+    """
+    curve_fn = round_curve if forest.kind == "xgb" else greedy_curve
+    order, _ = curve_fn(forest, X, reference)
+    ends = list(range(1, len(order) + 1))
+    if forest.kind == "xgb":
+        ends = [k for k in ends if k == len(order) or forest.tree_class[k] == 0 and forest.tree_class[k - 1] != 0]
+    if n_trees:
+        keep = min(ends, key=lambda k: abs(k - n_trees))
+    else:
+        halves = np.array_split(np.random.default_rng(seed).permutation(len(X)), 2)
+        keep = 0
+        for fit, check in (halves, halves[::-1]):
+            fold_order, _ = curve_fn(forest, X[fit], reference[fit])
+            curve = order_curve(forest, fold_order, X[check], reference[check])
+            keep = max(keep, smallest_within(ends, curve, min_agreement, max_change))
+    return order[:keep]
+
+
+def disk_size(path):
+    if os.path.isdir(path):
+        return sum(disk_size(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def _worker_memory(path, X, results):
+    before = process_memory()
+    model = load_model(path)
+    model.predict_proba(X)
+    after = process_memory()
+    results.put({key: after.get(key, 0) - before.get(key, 0) for key in ("rss", "private")})
+
+
+def worker_memory(path, X):
+    """RSS and private memory a freshly forked worker adds by loading and predicting."""
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=_worker_memory, args=(path, X, results))
+    process.start()
+    memory = results.get(timeout=300)
+    process.join()
+    return memory
+
+
+def profile(name, path, original, X, y, repeat):
+    load_model(path)  # warm the page cache and imports
+    load_seconds = median_time(lambda: load_model(path), 5)
+    model = load_model(path)
+    predicted = predict(model, X)
+    row, batch = X[:1], X[:256]
+    report = {
+        "name": name, "path": path, "size_bytes": disk_size(path), "load_ms": load_seconds * 1e3,
+        "worker_memory": worker_memory(path, batch),
+        "row_ms": median_time(lambda: model.predict_proba(row), repeat) * 1e3,
+        "batch_ms": median_time(lambda: model.predict_proba(batch), max(3, repeat // 5)) * 1e3,
+        "accuracy": float((predicted == y).mean()),
+        "agreement": float((predicted == original).mean()),
+    }
+    if isinstance(model, ArrayForest):
+        report.update(trees=model.n_trees, nodes=model.n_nodes, max_depth=model.max_depth)
+    return report
+
+
+def is_compact_artifact(path):
+    try:
+        with open(os.path.join(path, "metadata.json")) as f:
+            return "compact" in json.load(f)
+    except (OSError, ValueError):
+        return False
+
+
+def replace_path(staging, output):
+    """Move the finished ``staging`` directory to ``output``, removing what was there."""
+    if not os.path.lexists(output):
+        os.replace(staging, output)
+        return
+    # a directory cannot be replaced in one rename: move the old one aside first
+    old = tempfile.mkdtemp(prefix=".old-", dir=os.path.dirname(os.path.abspath(output)))
+    os.replace(output, os.path.join(old, "previous"))
+    os.replace(staging, output)
+    shutil.rmtree(old)
+
+
+def write_metadata(output, metadata):
+    with open(os.path.join(output, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def labels_for(model, labels):
+    # the model's label space: class indices (train_model.py) or the raw labels
+    classes = np.asarray(model.classes_)
+    if set(np.unique(labels)) <= set(classes.tolist()):
+        return np.asarray(labels)
+    return np.searchsorted(np.unique(labels), labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact serving model export")
+    parser.add_argument("model", help="Trained model (.joblib; an exported forest skips the depth cap)")
+    parser.add_argument("--store", help="Feature store; held-out rows are the train_model.py split")
+    parser.add_argument("--features", help="Held-out .npy feature matrix ...")
+    parser.add_argument("--labels", help="... and its .npy labels")
+    parser.add_argument("--output", help="Artifact directory (default: <model>-compact next to the model)")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.005,
+                        help="Accuracy the compact model may lose against the original")
+    parser.add_argument("--max-prob-change", type=float, default=0.05,
+                        help="Mean total-variation distance allowed from the original's probabilities")
+    parser.add_argument("--depths", default=DEPTHS, help="Depth caps to try (random forests)")
+    parser.add_argument("--max-depth", type=int, help="Use this depth cap instead of searching")
+    parser.add_argument("--trees", type=int, help="Keep this many trees instead of searching")
+    parser.add_argument("--test-size", type=float, default=0.2, help="Held-out fraction with --store")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=30, help="Timing repeats")
+    parser.add_argument("--force", action="store_true",
+                        help="Replace --output even if it is not an earlier compact artifact")
+    args = parser.parse_args()
+
+    if args.store:
+        X, labels, _ = load_features(args.store)
+        _, X, _, labels = train_test_split(X, labels, test_size=args.test_size, random_state=args.seed,
+                                           stratify=labels)
+    elif args.features and args.labels:
+        X, labels = np.load(args.features), np.load(args.labels, allow_pickle=False)
+    else:
+        parser.error("give --store, or --features and --labels")
+    X = np.asarray(X, dtype=np.float64)
+    model = load_model(args.model)
+    y = labels_for(model, labels)
+    X_select, X_report, y_select, y_report = train_test_split(X, y, test_size=0.5, random_state=args.seed,
+                                                              stratify=y)
+
+    exported = model if isinstance(model, ArrayForest) else export_forest(model)
+    reference = exported.predict_proba(X_select)
+    print(f"original: {exported.n_trees} trees, {exported.n_nodes} nodes, depth {exported.max_depth}, "
+          f"accuracy {(exported.classes_[reference.argmax(axis=1)] == y_select).mean():.4f} "
+          f"on {len(y_select)} selection rows")
+
+    depth = args.max_depth
+    cappable = exported.kind == "rf" and not isinstance(model, ArrayForest)
+    if depth is not None and not cappable:
+        parser.error("--max-depth needs a scikit-learn random forest joblib (not XGBoost or an exported forest)")
+    if depth is None and cappable:
+        depths = [int(d) for d in args.depths.split(",") if int(d) < exported.max_depth]
+        depth = choose_depth(model, depths, X_select, reference, 1 - args.max_accuracy_drop / 2,
+                             args.max_prob_change / 2)
+    forest = export_forest(model, max_depth=depth) if depth is not None else exported
+    trees = select_trees(forest, X_select, reference, 1 - args.max_accuracy_drop, args.max_prob_change,
+                         args.trees, args.seed)
+    compact = forest.subset(trees).to_float32()
+    print(f"compact: depth cap {depth}, {compact.n_trees} trees, {compact.n_nodes} nodes")
+
+    output = args.output or os.path.splitext(args.model.rstrip("/"))[0] + "-compact"
+    if os.path.lexists(output) and not args.force and not is_compact_artifact(output):
+        parser.error(f"{output} exists and is not a compact artifact; pick another --output or add --force")
+    # built next to the output and renamed into place, as ArrayForest.save_bundle does
+    staging = tempfile.mkdtemp(prefix=f".{os.path.basename(output)}-", dir=os.path.dirname(os.path.abspath(output)))
+    compact.save_bundle(os.path.join(staging, "forest"))
+    metadata = {
+        "name": os.path.basename(output),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "source": os.path.abspath(args.model),
+        "compact": {"max_depth": depth, "trees": [int(t) for t in trees], "dtype": "float32",
+                    "max_accuracy_drop": args.max_accuracy_drop,
+                    "max_prob_change": args.max_prob_change},
+        "labels": [str(label) for label in compact.classes_],
+        "n_features": int(compact.n_features_in_),
+    }
+    # written before the report so the directory already loads as an artifact
+    write_metadata(staging, metadata)
+    os.chmod(staging, 0o755)  # mkdtemp makes it private
+    replace_path(staging, output)
+
+    original = predict(model, X_report)
+    scratch = tempfile.mkdtemp()
+    try:
+        bundle = os.path.join(scratch, "original.forest")
+        exported.save_bundle(bundle)
+        rows = [profile("original", args.model, original, X_report, y_report, args.repeat)]
+        if not isinstance(model, ArrayForest):
+            rows.append(profile("exported", bundle, original, X_report, y_report, args.repeat))
+        rows.append(profile("compact", output, original, X_report, y_report, args.repeat))
+    finally:
+        shutil.rmtree(scratch)
+    rows[-1]["path"] = output
+
+    print(f"{len(y_report)} report rows:")
+    print(f"  {'model':9s} {'size':>9s} {'load':>9s} {'worker rss':>11s} {'private':>9s}"
+          f" {'1 row':>9s} {'256 rows':>9s} {'accuracy':>9s} {'agree':>7s}")
+    for row in rows:
+        memory = row["worker_memory"]
+        print(f"  {row['name']:9s} {row['size_bytes'] / 1e6:7.2f}MB {row['load_ms']:7.1f}ms"
+              f" {memory['rss'] / 1e6:9.1f}MB {memory['private'] / 1e6:7.1f}MB {row['row_ms']:7.2f}ms"
+              f" {row['batch_ms']:7.2f}ms {row['accuracy']:9.4f} {row['agreement']:7.2%}")
+    change = rows[-1]["accuracy"] - rows[0]["accuracy"]
+    print(f"accuracy change {change:+.4f}, {rows[0]['size_bytes'] / rows[-1]['size_bytes']:.1f}x smaller -> {output}")
+
+    if change < -args.max_accuracy_drop or rows[-1]["agreement"] < 1 - args.max_accuracy_drop:
+        print(f"warning: accuracy dropped, or more than {args.max_accuracy_drop:.2%} of the predictions "
+              "changed, on the report rows; try a smaller --max-accuracy-drop or more held-out rows")
+    metadata["report"] = {"rows": int(len(y_report)), "models": rows, "accuracy_change": change}
+    write_metadata(output, metadata)
+
+if __name__ == "__main__":
+    main()
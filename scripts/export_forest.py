@@ -0,0 +1,96 @@
+"""Export a trained forest/XGBoost joblib model to the array format in fungiscope.forest.
+
+    python scripts/export_forest.py scripts/best_xgb_defungi.joblib
+    python scripts/export_forest.py scripts/rf_defungi.joblib --output scripts/rf_defungi.npz --features X_test.npy
+    python scripts/export_forest.py scripts/rf_defungi.joblib --bundle
+
+The exported file is reloaded and checked against the original model on
+validation rows (``--features``, or rows sampled across every split
+threshold), then single-row and batch latency are reported for both.
+``--bundle`` writes a directory of ``.npy`` files instead, which the
+servers memory-map so gunicorn workers share one copy of the trees.
+The sha1 of the joblib is recorded in the export, so the servers keep
+preferring it after a git checkout resets the file times.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.forest import export_forest
+from fungiscope.model import file_digest, load_model
+
+
+def threshold_rows(forest, n_rows, seed=0):
+    """Random rows spanning the threshold range of every feature, so both
+    sides of most splits get exercised."""
+    rng = np.random.default_rng(seed)
+    internal = ~forest._is_leaf
+    rows = rng.random((n_rows, forest.n_features_in_))
+    for j in range(forest.n_features_in_):
+        thresholds = forest.threshold[internal & (forest.feature == j)]
+        if len(thresholds):
+            lo, hi = float(thresholds.min()), float(thresholds.max())
+            pad = 0.1 * (hi - lo) + 1e-6
+            rows[:, j] = rng.uniform(lo - pad, hi + pad, n_rows)
+    return rows
+
+
+def median_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a tree ensemble to fungiscope's array format")
+    parser.add_argument("model", help="Path to the joblib model")
+    parser.add_argument("--output", help="Output .npz, or directory with --bundle (default: next to the model)")
+    parser.add_argument("--bundle", action="store_true", help="Write a memory-mappable .npy bundle directory")
+    parser.add_argument("--features", help="Optional .npy feature matrix to validate on")
+    parser.add_argument("--rows", type=int, default=2000, help="Validation rows when --features is not given")
+    parser.add_argument("--atol", type=float, default=1e-5, help="Max allowed probability difference")
+    parser.add_argument("--repeat", type=int, default=20, help="Timing repeats")
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.model)[0] + (".forest" if args.bundle else ".npz")
+    model = load_model(args.model)
+    forest = export_forest(model)
+    forest.source = file_digest(args.model)
+    if args.bundle:
+        forest.save_bundle(output)
+        size = sum(os.path.getsize(os.path.join(output, name)) for name in os.listdir(output))
+    else:
+        forest.save(output)
+        size = os.path.getsize(output)
+    forest = load_model(output)
+    print(f"Exported {forest.n_trees} trees, {forest.n_nodes} nodes, depth {forest.max_depth} -> {output}")
+    print(f"  size: joblib {os.path.getsize(args.model) / 1e6:.2f} MB, exported {size / 1e6:.2f} MB")
+
+    X = np.load(args.features) if args.features else threshold_rows(forest, args.rows)
+    expected = model.predict_proba(X)
+    actual = forest.predict_proba(X)
+    max_diff = float(np.abs(expected - actual).max())
+    agreement = float((expected.argmax(axis=1) == actual.argmax(axis=1)).mean())
+    print(f"  validation on {len(X)} rows: max |dp| {max_diff:.2e}, argmax agreement {agreement:.2%}")
+
+    row, batch = X[:1], X[:256]
+    for name, m in [("original", model), ("array", forest)]:
+        single = median_time(lambda: m.predict_proba(row), args.repeat)
+        batched = median_time(lambda: m.predict_proba(batch), max(3, args.repeat // 5))
+        print(f"  {name:8s} 1 row {single * 1e3:7.2f} ms   {len(batch)} rows {batched * 1e3:7.2f} ms")
+
+    if max_diff > args.atol:
+        print(f"FAIL: probabilities differ by more than {args.atol}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
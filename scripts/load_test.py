@@ -0,0 +1,441 @@
+"""End-to-end load test of a locally started server, for sizing deployments.
+
+Starts one of the servers on a free localhost port, sends synthetic
+base64 JPEG payloads of mixed sizes and records throughput, latency
+percentiles, errors and the server's memory. Every combination of the
+list-valued options is one run; each run appends a JSON line to
+``--output`` so runs with different configurations (or commits) can be
+compared later. Everything is local: images are generated, the model is
+whatever FUNGI_MODEL_PATH / ``--model`` points at.
+
+    python scripts/load_test.py --server render --runner gunicorn --workers 1,2,4 --threads 4 --concurrency 8
+    python scripts/load_test.py --server api --runner flask --rate 2,5,10 --duration 30
+    python scripts/load_test.py --server cli --model scripts/rf_defungi.forest --concurrency 1,4
+    python scripts/load_test.py --summary load_test.jsonl
+
+Servers: ``render`` (render_app.py), ``api`` (api/index.py) and ``cli``
+(``classify_fungi.py --server``, Flask dev server only); runners: the
+Flask dev server (threaded) or gunicorn with gunicorn.conf.py and
+``--workers``/``--threads``.
+
+Load is closed-loop (``--concurrency`` clients posting back to back) or
+open-loop (``--rate`` requests/s with Poisson arrivals, up to
+``--max-inflight`` at once). Open-loop latency is measured from the
+scheduled send time, so time spent waiting for a free client counts
+against the server rather than being hidden (coordinated omission).
+
+Server memory is the sum over the server process and its children
+(gunicorn workers, extraction pools) from /proc: peak RSS sampled during
+the run, and RSS/PSS at the end (PSS does not double-count the shared
+model pages). The prediction cache is off unless ``--cache`` is given,
+since the payloads repeat.
+
+The client runs on the same machine: on a small box its threads compete
+with the server for CPU, which the recorded ``cpus`` helps to keep in
+mind when comparing results.
+"""
+import argparse
+import base64
+import datetime
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fungiscope.memory import process_memory
+
+SERVERS = {
+    # module:app for gunicorn, classify path
+    "render": ("render_app:app", "/classify"),
+    "api": ("api.index:app", "/api/classify-py"),
+    "cli": (None, "/classify"),
+}
+
+FLASK_CHILD = r"""
+import importlib, sys
+sys.path.insert(0, sys.argv[1])
+module, _, name = sys.argv[2].partition(":")
+app = getattr(importlib.import_module(module), name)
+app.run(host="127.0.0.1", port=int(sys.argv[3]), threaded=True)
+"""
+
+
+def jpeg(width, height, seed):
+    rng = np.random.default_rng(seed)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8), (9, 9), 0)
+    img = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = np.clip(img + rng.normal(0, 6, img.shape), 0, 255).astype(np.uint8)
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes()
+
+
+def payloads(sizes, weights, variants, body):
+    """``(size name, weight, [(content type, bytes), ...])`` per image size."""
+    out = []
+    for i, (size, weight) in enumerate(zip(sizes, weights)):
+        width, height = (int(v) for v in size.lower().split("x"))
+        items = []
+        for seed in range(variants):
+            image = jpeg(width, height, seed=1000 * i + seed)
+            if body == "json":
+                data = json.dumps({"image": "data:image/jpeg;base64," + base64.b64encode(image).decode()})
+                items.append(("application/json", data.encode()))
+            else:
+                items.append(("image/jpeg", image))
+        out.append((size, weight, items))
+    return out
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, server, runner, workers, threads, port):
+    env = dict(os.environ)
+    if not args.cache:
+        env["FUNGI_CACHE_SIZE"] = "0"
+    if args.model:
+        env["FUNGI_MODEL_PATH"] = os.path.abspath(args.model)
+    target, path = SERVERS[server]
+    if runner == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b", f"127.0.0.1:{port}",
+                   "-w", str(workers), "--threads", str(threads), "--timeout", "120", target]
+    elif server == "cli":
+        # run_server binds 0.0.0.0 on the given port
+        model = os.path.abspath(args.model or os.path.join(ROOT, "scripts", "rf_defungi.joblib"))
+        command = [sys.executable, os.path.join(ROOT, "scripts", "classify_fungi.py"), "--server",
+                   "--model", model, "--port", str(port)]
+    else:
+        command = [sys.executable, "-c", FLASK_CHILD, ROOT, target, str(port)]
+    log = open(args.server_log, "ab") if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{server} server exited with {process.returncode} (see --server-log)")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            conn.close()
+            return process, path
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"{server} server did not start within {args.startup_timeout:.0f}s")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def process_tree(pid):
+    """``pid`` and all its descendants (Linux /proc)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the command name may contain spaces; ppid follows the closing paren
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def tree_memory(pid):
+    """Summed rss/pss of a process tree, None without /proc."""
+    if not os.path.exists(f"/proc/{pid}/smaps_rollup"):
+        return None
+    total = {"processes": 0, "rss": 0, "pss": 0}
+    for member in process_tree(pid):
+        memory = process_memory(member)
+        if memory.get("pid") == os.getpid():
+            continue  # the process went away and process_memory fell back to ours
+        total["processes"] += 1
+        total["rss"] += memory.get("rss", 0)
+        total["pss"] += memory.get("pss", 0)
+    return total
+
+
+class MemorySampler(threading.Thread):
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            memory = tree_memory(self.pid)
+            if memory is not None:
+                self.peak_rss = max(self.peak_rss, memory["rss"])
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def post(port, path, item, timeout):
+    """POST one payload; returns (status, seconds). Status is "error" on a connection failure."""
+    content_type, data = item
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request("POST", path, body=data, headers={"Content-Type": content_type})
+        response = conn.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = "error"
+    finally:
+        conn.close()
+    return status, time.perf_counter() - start
+
+
+class Picker:
+    """Weighted random payload choice, reproducible per run."""
+
+    def __init__(self, groups, seed=0):
+        self.groups = groups
+        self.weights = [weight for _, weight, _ in groups]
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            size, _, items = self.random.choices(self.groups, self.weights)[0]
+            return size, self.random.choice(items)
+
+
+def closed_loop(port, path, picker, concurrency, warmup, duration, timeout):
+    """``concurrency`` clients back to back; returns ([(size, status, seconds, sent, done)], window)."""
+    results, lock = [], threading.Lock()
+    start = time.monotonic()
+    measure_from, stop = start + warmup, start + warmup + duration
+
+    def client():
+        while time.monotonic() < stop:
+            size, item = picker()
+            sent = time.monotonic()
+            status, seconds = post(port, path, item, timeout)
+            with lock:
+                results.append((size, status, seconds, sent, time.monotonic()))
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, (measure_from, stop)
+
+
+def open_loop(port, path, picker, rate, max_inflight, warmup, duration, timeout, seed=0):
+    """Poisson arrivals at ``rate``/s; latency counted from the scheduled send time."""
+    results, lock = [], threading.Lock()
+    rng = random.Random(seed)
+    start = time.monotonic()
+    measure_from, stop = start + warmup, start + warmup + duration
+
+    def send(size, item, scheduled):
+        status, _ = post(port, path, item, timeout)
+        done = time.monotonic()
+        with lock:
+            results.append((size, status, done - scheduled, scheduled, done))
+
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        scheduled = start
+        while True:
+            scheduled += rng.expovariate(rate)
+            if scheduled >= stop:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            size, item = picker()
+            pool.submit(send, size, item, scheduled)
+    return results, (measure_from, stop)
+
+
+def percentiles(seconds):
+    if not seconds:
+        return None
+    ms = np.asarray(seconds) * 1e3
+    return {"p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95)),
+            "p99": float(np.percentile(ms, 99)), "max": float(ms.max()), "mean": float(ms.mean())}
+
+
+def summarize(results, window):
+    """Latency and errors of the requests sent in the measured window; throughput
+    from the successful ones that also finished in it."""
+    start, stop = window
+    measured = [(size, status, seconds) for size, status, seconds, sent, _ in results if start <= sent < stop]
+    completed = sum(status == 200 and start <= done < stop for _, status, _, _, done in results)
+    statuses = Counter(str(status) for _, status, _ in measured)
+    ok = [seconds for _, status, seconds in measured if status == 200]
+    by_size = {}
+    for size in sorted({size for size, _, _ in measured}):
+        rows = [(status, seconds) for s, status, seconds in measured if s == size]
+        by_size[size] = {"requests": len(rows), "ok": sum(status == 200 for status, _ in rows),
+                         "latency_ms": percentiles([seconds for status, seconds in rows if status == 200])}
+    return {
+        "requests": len(measured),
+        "ok": len(ok),
+        "errors": len(measured) - len(ok),
+        "error_rate": (len(measured) - len(ok)) / len(measured) if measured else None,
+        "statuses": dict(statuses),
+        "throughput_rps": completed / (stop - start),
+        # latency of successful requests; failures are in error_rate/statuses
+        "latency_ms": percentiles(ok),
+        "by_size": by_size,
+    }
+
+
+def print_row(record):
+    latency = record["latency_ms"] or {}
+    memory = record.get("server_memory") or {}
+    load = f"c={record['concurrency']}" if record["mode"] == "closed" else f"{record['rate']:g}/s"
+    print(f"  {record['server']:6s} {record['runner']:8s} {record['workers']:>2}x{record['threads']:<2} {load:>7s}"
+          f" {record['throughput_rps']:7.2f} rps  p50 {latency.get('p50', float('nan')):7.1f}"
+          f"  p95 {latency.get('p95', float('nan')):7.1f}  p99 {latency.get('p99', float('nan')):7.1f} ms"
+          f"  err {record['error_rate'] or 0:6.1%}"
+          f"  rss peak {memory.get('rss_peak', 0) / 1e6:6.0f} MB  pss {memory.get('pss_end', 0) / 1e6:6.0f} MB")
+
+
+def print_summary(path):
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    print(f"{len(records)} runs in {path}")
+    for record in records:
+        print_row(record)
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local end-to-end load test")
+    parser.add_argument("--server", default="render", help="render, api and/or cli (comma-separated)")
+    parser.add_argument("--runner", default="gunicorn", help="flask and/or gunicorn (comma-separated)")
+    parser.add_argument("--workers", type=int_list, default=[1], help="gunicorn workers (comma-separated)")
+    parser.add_argument("--threads", type=int_list, default=[4], help="gunicorn threads per worker")
+    parser.add_argument("--concurrency", type=int_list, default=[4], help="Closed-loop clients")
+    parser.add_argument("--rate", help="Open-loop arrival rates in requests/s (replaces --concurrency)")
+    parser.add_argument("--max-inflight", type=int, default=64, help="Open loop: requests in flight at most")
+    parser.add_argument("--sizes", default="640x480,1280x960,2592x1944", help="Image sizes WIDTHxHEIGHT")
+    parser.add_argument("--mix", default="6,3,1", help="Relative frequency of each size")
+    parser.add_argument("--variants", type=int, default=4, help="Distinct images per size")
+    parser.add_argument("--body", choices=["json", "raw"], default="json",
+                        help="base64 JSON {\"image\": ...} or raw image/jpeg bodies")
+    parser.add_argument("--model", help="FUNGI_MODEL_PATH for the server (cli: its --model)")
+    parser.add_argument("--cache", action="store_true", help="Keep the prediction cache on")
+    parser.add_argument("--duration", type=float, default=20, help="Measured seconds per run")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds of load before that")
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout")
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--output", default="load_test.jsonl", help="JSON lines file results are appended to")
+    parser.add_argument("--label", help="Free-form tag stored with every record (e.g. a commit)")
+    parser.add_argument("--server-log", help="Append the servers' output to this file")
+    parser.add_argument("--summary", metavar="JSONL", help="Only print the runs recorded in this file")
+    args = parser.parse_args()
+
+    if args.summary:
+        print_summary(args.summary)
+        return
+
+    servers, runners = args.server.split(","), args.runner.split(",")
+    for server in servers:
+        if server not in SERVERS:
+            parser.error(f"unknown server {server!r}")
+    sizes, weights = args.sizes.split(","), [float(w) for w in args.mix.split(",")]
+    if len(sizes) != len(weights):
+        parser.error("--sizes and --mix need the same number of entries")
+    groups = payloads(sizes, weights, args.variants, args.body)
+    print("payloads: " + ", ".join(f"{size} x{weight:g} (~{len(items[0][1]) // 1024} KB)"
+                                   for size, weight, items in groups))
+
+    if args.rate:
+        loads = [("open", None, float(rate)) for rate in args.rate.split(",")]
+    else:
+        loads = [("closed", concurrency, None) for concurrency in args.concurrency]
+    for server, runner in itertools.product(servers, runners):
+        if server == "cli" and runner != "flask":
+            print("cli: classify_fungi.py --server builds its app in run_server, so only the flask runner")
+            continue
+        # the dev server has no worker/thread settings
+        shapes = list(itertools.product(args.workers, args.threads)) if runner == "gunicorn" else [(1, None)]
+        for workers, threads in shapes:
+            port = free_port()
+            process, path = start_server(args, server, runner, workers, threads, port)
+            try:
+                # one request so model loading and warm-up are not timed
+                post(port, path, groups[0][2][0], args.startup_timeout)
+                idle = tree_memory(process.pid)
+                for mode, concurrency, rate in loads:
+                    sampler = MemorySampler(process.pid)
+                    sampler.start()
+                    picker = Picker(groups)
+                    if mode == "closed":
+                        results, window = closed_loop(port, path, picker, concurrency, args.warmup, args.duration,
+                                              args.timeout)
+                    else:
+                        results, window = open_loop(port, path, picker, rate, args.max_inflight, args.warmup,
+                                            args.duration, args.timeout)
+                    sampler.stop()
+                    end = tree_memory(process.pid)
+                    record = {
+                        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                        "label": args.label, "server": server, "runner": runner,
+                        "workers": workers, "threads": threads if threads is not None else "dev",
+                        "mode": mode, "concurrency": concurrency, "rate": rate,
+                        "max_inflight": args.max_inflight if mode == "open" else None,
+                        "duration": args.duration, "warmup": args.warmup, "body": args.body,
+                        "mix": dict(zip(sizes, weights)), "cache": args.cache,
+                        "model": args.model or os.environ.get("FUNGI_MODEL_PATH"), "cpus": os.cpu_count(),
+                        **summarize(results, window),
+                        "server_memory": None if end is None else {
+                            "processes": end["processes"], "rss_idle": idle["rss"], "rss_peak": sampler.peak_rss,
+                            "rss_end": end["rss"], "pss_end": end["pss"]},
+                    }
+                    if mode == "open":
+                        record["offered_rps"] = rate
+                    print_row(record)
+                    with open(args.output, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+            finally:
+                stop_server(process)
+    print(f"results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
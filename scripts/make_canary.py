@@ -0,0 +1,73 @@
+"""Canary feature set the servers check a model against before hot-swapping it.
+
+Takes a small stratified sample of held-out feature rows (the
+``--test-size``/``--seed`` split of scripts/train_model.py with
+``--store``) and writes ``X``, ``y`` (class indices, the order
+train_model.py gives the model's classes) and ``classes`` to an ``.npz``.
+Point FUNGI_CANARY_PATH at it; FUNGI_CANARY_MIN_ACCURACY then rejects a
+reloaded model that scores below it on these rows (see
+fungiscope/registry.py). With ``--model`` the canary is run against that
+model, to pick a threshold.
+
+    python scripts/make_canary.py --store feature_store/ --rows 64 --output models/canary.npz --model models/rf-v1
+    FUNGI_MODEL_DIR=models FUNGI_CANARY_PATH=models/canary.npz FUNGI_CANARY_MIN_ACCURACY=0.8 \\
+        gunicorn -c gunicorn.conf.py render_app:app
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.feature_store import load_features
+from fungiscope.model import load_model
+from fungiscope.registry import CanaryError, validate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Canary rows for hot model reload")
+    parser.add_argument("--store", help="Feature store (serving preset); rows come from the held-out split")
+    parser.add_argument("--features", help="Alternatively, a held-out .npy feature matrix ...")
+    parser.add_argument("--labels", help="... and its .npy labels")
+    parser.add_argument("--rows", type=int, default=64, help="Rows in the canary")
+    parser.add_argument("--test-size", type=float, default=0.2, help="Held-out fraction with --store")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="models/canary.npz")
+    parser.add_argument("--model", help="Report the canary accuracy of this model")
+    args = parser.parse_args()
+
+    if args.store:
+        X, labels, _ = load_features(args.store)
+        _, X, _, labels = train_test_split(X, labels, test_size=args.test_size, random_state=args.seed,
+                                           stratify=labels)
+    elif args.features and args.labels:
+        X, labels = np.load(args.features), np.load(args.labels, allow_pickle=False)
+    else:
+        parser.error("give --store, or --features and --labels")
+
+    X, labels = np.asarray(X, dtype=np.float64), np.asarray(labels)
+    if args.rows < len(X):
+        X, _, labels, _ = train_test_split(X, labels, train_size=args.rows, random_state=args.seed,
+                                           stratify=labels)
+    if np.issubdtype(labels.dtype, np.integer):
+        # already class indices
+        classes, y = np.unique(labels).astype(str), labels
+    else:
+        classes, y = np.unique(labels.astype(str), return_inverse=True)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    np.savez(args.output, X=X, y=y, classes=classes)
+    print(f"{len(X)} canary rows, {len(classes)} classes -> {args.output}")
+
+    if args.model:
+        try:
+            summary = validate(load_model(args.model), X, y)
+        except CanaryError as e:
+            sys.exit(f"{args.model}: {e}")
+        print(f"{args.model}: canary accuracy {summary['accuracy']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
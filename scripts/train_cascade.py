@@ -0,0 +1,201 @@
+"""Train the colour stage of a two-stage cascade and pick its threshold.
+
+Fits a small random forest on the 24 HSV columns of the feature store,
+then scores the cascade (colour model, main model for the rows where the
+colour model's top probability is below the threshold) over a range of
+thresholds on held-out rows. For each threshold it reports accuracy, the
+share answered by the colour stage and the average per-image latency,
+from timings of each stage on this machine:
+
+    colour: resize + HSV conversion + HSV histograms + colour model
+    full:   GLCM + LBP + main model, paid by the rows it falls through to
+
+The held-out rows are split in half: the threshold is chosen on one half
+(the fastest one within ``--max-accuracy-drop`` of the main model) and
+its accuracy is confirmed on the other. Use the same ``--test-size`` and
+``--seed`` as scripts/train_model.py so the main model never saw them.
+
+    python scripts/train_cascade.py --store feature_store/ --model models/rf-v1 --output models/
+    FUNGI_MODEL_PATH=models/cascade-v1 gunicorn -c gunicorn.conf.py render_app:app
+    # another trade-off from the table, without retraining
+    FUNGI_CASCADE_THRESHOLD=0.9 FUNGI_MODEL_PATH=models/cascade-v1 gunicorn -c gunicorn.conf.py render_app:app
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+import cv2
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.cascade import Cascade
+from fungiscope.feature_store import load_features
+from fungiscope.features import (FEATURE_GROUPS, extract_glcm_features, extract_hsv_features,
+                                 extract_lbp_features, prepare_image)
+from fungiscope.forest import export_forest
+from fungiscope.model import load_model
+
+ARTIFACT_VERSION = 1
+THRESHOLDS = [0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 0.99, 1.01]
+
+
+def median_ms(fn, repeat=30):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1e3
+
+
+def stage_latency(color_model, model, X):
+    """Per-image milliseconds of each step, on a 640x480 image and one feature row."""
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8), (9, 9), 0)
+    gray, hsv = prepare_image(image)
+    row = X[:1]
+    return {
+        "prepare_hsv": median_ms(lambda: extract_hsv_features(prepare_image(image)[1])),
+        "color_model": median_ms(lambda: color_model.predict_proba(row[:, FEATURE_GROUPS["hsv"]])),
+        "texture": median_ms(lambda: (extract_glcm_features(gray), extract_lbp_features(gray))),
+        "main_model": median_ms(lambda: model.predict_proba(row)),
+    }
+
+
+def threshold_table(color_probs, full_probs, classes, y, color_ms, full_ms):
+    full_pred = classes[full_probs.argmax(axis=1)]
+    color_pred = classes[color_probs.argmax(axis=1)]
+    confidence = color_probs.max(axis=1)
+    rows = []
+    for threshold in THRESHOLDS:
+        early = confidence >= threshold
+        predicted = np.where(early, color_pred, full_pred)
+        rows.append({"threshold": threshold, "accuracy": float((predicted == y).mean()),
+                     "color_share": float(early.mean()),
+                     "color_accuracy": float((color_pred[early] == y[early]).mean()) if early.any() else None,
+                     "latency_ms": color_ms + (1 - early.mean()) * full_ms})
+    return rows
+
+
+def choose(table, full_accuracy, max_drop):
+    eligible = [row for row in table if row["accuracy"] >= full_accuracy - max_drop]
+    return min(eligible, key=lambda row: (row["latency_ms"], -row["accuracy"]))
+
+
+def next_artifact_dir(output):
+    os.makedirs(output, exist_ok=True)
+    versions = [int(name.rsplit("-v", 1)[1]) for name in os.listdir(output)
+                if name.startswith("cascade-v") and name.rsplit("-v", 1)[1].isdigit()]
+    return os.path.join(output, f"cascade-v{max(versions, default=0) + 1}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Colour-first cascade training")
+    parser.add_argument("--store", help="Feature store from scripts/build_feature_store.py")
+    parser.add_argument("--features", help="Alternatively, a .npy feature matrix ...")
+    parser.add_argument("--labels", help="... and a .npy label vector")
+    parser.add_argument("--model", required=True, help="Main model (artifact dir, .forest, .npz or .joblib)")
+    parser.add_argument("--output", default="models", help="Directory for versioned artifacts")
+    parser.add_argument("--n-estimators", type=int, default=50, help="Trees in the colour model")
+    parser.add_argument("--max-depth", type=int, default=12, help="Depth of the colour model's trees")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.005,
+                        help="Accuracy the cascade may lose against the main model")
+    parser.add_argument("--test-size", type=float, default=0.2, help="Held-out fraction (as in train_model.py)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Threads for the fit")
+    args = parser.parse_args()
+
+    if args.store:
+        X, labels, _ = load_features(args.store)
+    elif args.features and args.labels:
+        X, labels = np.load(args.features), np.load(args.labels, allow_pickle=False)
+    else:
+        parser.error("give --store, or --features and --labels")
+    X = np.asarray(X, dtype=np.float64)
+    model = load_model(args.model)
+    classes = np.asarray(model.classes_)
+    # the main model's label space: class indices (train_model.py) or the raw labels
+    if set(np.unique(labels)) <= set(classes.tolist()):
+        y = np.asarray(labels)
+    else:
+        y = np.searchsorted(np.unique(labels), labels)
+        if not set(np.unique(y)) <= set(classes.tolist()):
+            parser.error(f"labels do not match the main model's classes {classes.tolist()}")
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size,
+                                                        random_state=args.seed, stratify=y)
+    X_calib, X_check, y_calib, y_check = train_test_split(X_test, y_test, test_size=0.5,
+                                                          random_state=args.seed, stratify=y_test)
+
+    hsv = FEATURE_GROUPS["hsv"]
+    start = time.perf_counter()
+    color_model = RandomForestClassifier(n_estimators=args.n_estimators, max_depth=args.max_depth,
+                                         class_weight="balanced", random_state=args.seed, n_jobs=args.n_jobs)
+    color_model.fit(X_train[:, hsv], y_train)
+    fit_seconds = time.perf_counter() - start
+    color_forest = export_forest(color_model)
+    if not np.array_equal(color_forest.classes_, classes):
+        parser.error(f"colour model classes {color_forest.classes_.tolist()} != main model {classes.tolist()}")
+
+    latency = stage_latency(color_forest, model, X_test)
+    color_ms = latency["prepare_hsv"] + latency["color_model"]
+    full_ms = latency["texture"] + latency["main_model"]
+    main_ms = latency["prepare_hsv"] + full_ms
+    full_calib = model.predict_proba(X_calib)
+    full_accuracy = float((classes[full_calib.argmax(axis=1)] == y_calib).mean())
+    table = threshold_table(color_forest.predict_proba(X_calib[:, hsv]), full_calib, classes, y_calib,
+                            color_ms, full_ms)
+
+    print(f"colour model: {args.n_estimators} trees, depth {args.max_depth}, fit {fit_seconds:.1f}s; "
+          f"per image: colour stage {color_ms:.2f} ms, fall-through +{full_ms:.2f} ms")
+    print(f"main model alone: accuracy {full_accuracy:.4f}, {main_ms:.2f} ms "
+          f"({len(y_calib)} calibration rows)")
+    print(" threshold  accuracy  colour share  colour acc  latency")
+    for row in table:
+        color_accuracy = f"{row['color_accuracy']:.4f}" if row["color_accuracy"] is not None else "     -"
+        print(f"  {row['threshold']:8.2f}  {row['accuracy']:8.4f}  {row['color_share']:12.1%}"
+              f"  {color_accuracy:>10s}  {row['latency_ms']:5.2f} ms")
+
+    chosen = choose(table, full_accuracy, args.max_accuracy_drop)
+    cascade = Cascade(color_forest, model, chosen["threshold"])
+    check_probs, check_stages = cascade.predict_stages(X_check)
+    check_accuracy = float((classes[check_probs.argmax(axis=1)] == y_check).mean())
+    check_full = float((model.predict(X_check) == y_check).mean())
+    print(f"threshold {chosen['threshold']:.2f}: accuracy {check_accuracy:.4f} (main model {check_full:.4f}), "
+          f"colour stage answered {(check_stages == 'color').mean():.1%} of {len(y_check)} check rows")
+
+    artifact = next_artifact_dir(args.output)
+    os.makedirs(artifact)
+    joblib.dump(color_model, os.path.join(artifact, "color.joblib"))
+    color_forest.save_bundle(os.path.join(artifact, "color"))
+    metadata = {
+        "artifact_version": ARTIFACT_VERSION,
+        "name": os.path.basename(artifact),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "cascade": {"threshold": chosen["threshold"],
+                    "model": os.path.relpath(os.path.abspath(args.model), os.path.abspath(artifact)),
+                    "color_features": "hsv"},
+        "color_model": {"n_estimators": args.n_estimators, "max_depth": args.max_depth,
+                        "fit_seconds": fit_seconds},
+        "latency_ms": dict(latency, main_only=main_ms),
+        "calibration": {"rows": int(len(y_calib)), "main_accuracy": full_accuracy,
+                        "max_accuracy_drop": args.max_accuracy_drop, "thresholds": table},
+        "check": {"rows": int(len(y_check)), "accuracy": check_accuracy, "main_accuracy": check_full,
+                  "color_share": float((check_stages == "color").mean())},
+        "labels": [str(label) for label in classes],
+        "data": {"rows": int(len(y)), "test_size": args.test_size, "seed": args.seed},
+    }
+    with open(os.path.join(artifact, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+    print(f"wrote {artifact}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Train the classifier from precomputed features with successive halving.
+
+Every configuration of the notebook's ``rf_params`` / ``xgb_params`` grids
+starts on a small stratified sample of the training set; each round keeps
+the best 1/``--factor`` and multiplies the sample size by ``--factor``, so
+bad configurations are dropped after costing a fraction of a full fit.
+Each evaluation records fit time, peak RSS and the per-row latency of one
+fold's model exported to the array format the servers load. Pruning
+ranks the configurations within ``--latency-budget-ms`` by
+cross-validated accuracy ahead of the ones over it (fastest first), so a
+fast, slightly less accurate configuration is not dropped for a slow one.
+The finalists are refit on the whole training set and timed again; the
+most accurate one within the budget wins.
+
+    python scripts/build_feature_store.py --dataset dataset/ --store feature_store/
+    python scripts/train_model.py --store feature_store/ --output models/
+    FUNGI_MODEL_PATH=models/rf-v1 gunicorn -c gunicorn.conf.py render_app:app
+
+The artifact directory ``<output>/<family>-v<N>/`` holds ``model.joblib``,
+the memory-mappable ``forest/`` bundle and ``metadata.json`` (parameters,
+metrics, every candidate's record, label order and feature configuration).
+"""
+import argparse
+import datetime
+import hashlib
+import itertools
+import json
+import math
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold, cross_validate, train_test_split
+from sklearn.preprocessing import LabelEncoder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fungiscope.feature_store import load_features, read_manifest
+from fungiscope.forest import export_forest
+from fungiscope.memory import PeakRSS
+
+ARTIFACT_VERSION = 1
+
+# the notebook's grids
+RF_PARAMS = {
+    'n_estimators': [100, 200],
+    'max_depth': [None, 10],
+    'min_samples_split': [2, 5],
+    'class_weight': ['balanced', 'balanced_subsample'],
+}
+XGB_PARAMS = {
+    'n_estimators': [100, 200],
+    'learning_rate': [0.01, 0.1, 0.2],
+    'max_depth': [3, 6, 10],
+    'subsample': [0.8, 1.0],
+}
+
+
+def make_model(family, params, seed, n_jobs):
+    if family == "rf":
+        return RandomForestClassifier(random_state=seed, n_jobs=n_jobs, **params)
+    from xgboost import XGBClassifier
+    return XGBClassifier(eval_metric='mlogloss', random_state=seed, n_jobs=n_jobs, **params)
+
+
+def candidates(families):
+    grids = {"rf": RF_PARAMS, "xgb": XGB_PARAMS}
+    for family in families:
+        grid = grids[family]
+        for values in itertools.product(*grid.values()):
+            yield family, dict(zip(grid, values))
+
+
+def subsample(X, y, n, seed):
+    if n >= len(y):
+        return X, y
+    X_sub, _, y_sub, _ = train_test_split(X, y, train_size=n, stratify=y, random_state=seed)
+    return X_sub, y_sub
+
+
+def rank_key(record, latency_budget_ms):
+    # within the budget: most accurate first; over it: after those, fastest first
+    if record["latency_ms"] <= latency_budget_ms:
+        return 0, -record["cv_accuracy"]
+    return 1, record["latency_ms"]
+
+
+def successive_halving(pool, X, y, factor, min_samples, cv, seed, n_jobs, latency_budget_ms, finalists=3):
+    """Returns ``(finalists, history)``; every evaluation is appended to history.
+
+    The last round runs on all of ``X`` and keeps the best ``finalists``
+    (see ``rank_key``).
+    """
+    n_rounds = min(math.ceil(math.log(len(pool), factor)) + 1,
+                   int(math.log(max(len(y) / min_samples, 1), factor)) + 1)
+    history = []
+    for round_ in range(n_rounds):
+        n = len(y) if round_ == n_rounds - 1 else min(len(y), min_samples * factor ** round_)
+        X_round, y_round = subsample(X, y, n, seed + round_)
+        folds = StratifiedKFold(cv, shuffle=True, random_state=seed)
+        scored = []
+        for candidate in pool:
+            family, params = candidate
+            with PeakRSS() as rss:
+                start = time.perf_counter()
+                cv_result = cross_validate(make_model(family, params, seed, n_jobs), X_round, y_round, cv=folds,
+                                           return_estimator=True)
+                elapsed = time.perf_counter() - start
+            scores = cv_result["test_score"]
+            # one fold's model, exported as the servers would load it; trees grow
+            # with the sample, so this is re-measured every round
+            single_ms, batch_ms = row_latency(export_forest(cv_result["estimator"][0]), X_round, repeat=20)
+            record = {"family": family, "params": params, "round": round_, "n_samples": len(y_round),
+                      "cv_accuracy": float(scores.mean()), "cv_std": float(scores.std()),
+                      "fit_seconds": elapsed, "peak_rss_mb": rss.peak / 1e6, "rss_growth_mb": rss.delta / 1e6,
+                      "latency_ms": single_ms, "batch_latency_ms_per_row": batch_ms}
+            history.append(record)
+            scored.append((rank_key(record, latency_budget_ms), candidate))
+            print(f"  round {round_} n={len(y_round):6d}  {family:3s} {json.dumps(params)}"
+                  f"  acc {record['cv_accuracy']:.4f}  {elapsed:6.1f}s  peak {record['peak_rss_mb']:.0f} MB"
+                  f"  {single_ms:.2f} ms/row", flush=True)
+        scored.sort(key=lambda item: item[0])
+        keep = finalists if round_ == n_rounds - 1 else max(finalists, math.ceil(len(pool) / factor))
+        pool = [candidate for _, candidate in scored[:keep]]
+    return pool, history
+
+
+def row_latency(model, X, repeat=50):
+    """Median single-row and per-row (batch of 256) predict_proba time, in ms."""
+    single = []
+    for i in range(repeat):
+        row = X[i % len(X)][None, :]
+        start = time.perf_counter()
+        model.predict_proba(row)
+        single.append(time.perf_counter() - start)
+    batch = X[:256]
+    batched = []
+    for _ in range(5):
+        start = time.perf_counter()
+        model.predict_proba(batch)
+        batched.append(time.perf_counter() - start)
+    return float(np.median(single)) * 1e3, float(np.median(batched)) / len(batch) * 1e3
+
+
+def next_artifact_dir(output, family):
+    os.makedirs(output, exist_ok=True)
+    versions = [int(name.rsplit("-v", 1)[1]) for name in os.listdir(output)
+                if name.startswith(f"{family}-v") and name.rsplit("-v", 1)[1].isdigit()]
+    return os.path.join(output, f"{family}-v{max(versions, default=0) + 1}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Successive-halving training pipeline")
+    parser.add_argument("--store", help="Feature store from scripts/build_feature_store.py")
+    parser.add_argument("--features", help="Alternatively, a .npy feature matrix ...")
+    parser.add_argument("--labels", help="... and a .npy label vector")
+    parser.add_argument("--output", default="models", help="Directory for versioned artifacts")
+    parser.add_argument("--families", default="rf,xgb", help="Model families to search (rf, xgb)")
+    parser.add_argument("--factor", type=int, default=3, help="Keep 1/factor per round, grow samples by factor")
+    parser.add_argument("--min-samples", type=int, default=500, help="Training rows in the first round")
+    parser.add_argument("--finalists", type=int, default=3, help="Candidates refit and timed after the search")
+    parser.add_argument("--cv", type=int, default=3, help="Folds per evaluation")
+    parser.add_argument("--latency-budget-ms", type=float, default=5.0,
+                        help="Max single-row predict time of the exported model")
+    parser.add_argument("--test-size", type=float, default=0.2, help="Held-out fraction (notebook: 0.2)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Threads per fit")
+    args = parser.parse_args()
+
+    if args.store:
+        X, labels, _ = load_features(args.store)
+        feature_config = read_manifest(args.store)
+        feature_config = {"order": feature_config["order"],
+                          "groups": {name: info["config"] for name, info in feature_config["groups"].items()}}
+    elif args.features and args.labels:
+        X, labels = np.load(args.features), np.load(args.labels, allow_pickle=False)
+        feature_config = None
+    else:
+        parser.error("give --store, or --features and --labels")
+    X = np.asarray(X, dtype=np.float64)
+    encoder = LabelEncoder()
+    y = encoder.fit_transform(labels)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=args.test_size,
+                                                        random_state=args.seed, stratify=y)
+
+    families = [family.strip() for family in args.families.split(",") if family.strip()]
+    pool = list(candidates(families))
+    print(f"{len(pool)} configurations, {len(y_train)} training rows, {X.shape[1]} features")
+    search_start = time.perf_counter()
+    finalists, history = successive_halving(pool, X_train, y_train, args.factor, args.min_samples,
+                                             args.cv, args.seed, args.n_jobs, args.latency_budget_ms,
+                                             args.finalists)
+    search_seconds = time.perf_counter() - search_start
+
+    results = []
+    for family, params in finalists:
+        model = make_model(family, params, args.seed, args.n_jobs)
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            model.fit(X_train, y_train)
+            fit_seconds = time.perf_counter() - start
+        forest = export_forest(model)
+        single_ms, batch_ms = row_latency(forest, X_test)
+        result = {"family": family, "params": params,
+                  "cv_accuracy": next(r["cv_accuracy"] for r in reversed(history)
+                                      if r["family"] == family and r["params"] == params),
+                  "test_accuracy": float((forest.predict(X_test) == y_test).mean()),
+                  "fit_seconds": fit_seconds, "peak_rss_mb": rss.peak / 1e6,
+                  "latency_ms": single_ms, "batch_latency_ms_per_row": batch_ms,
+                  "within_budget": single_ms <= args.latency_budget_ms}
+        results.append((result, model, forest))
+        print(f"final {family:3s} {json.dumps(params)}  cv {result['cv_accuracy']:.4f}"
+              f"  test {result['test_accuracy']:.4f}  {single_ms:.2f} ms/row"
+              f"  ({batch_ms:.3f} ms/row batched)  fit {fit_seconds:.1f}s")
+
+    # selection uses the cross-validated score; the test set is only reported
+    eligible = [r for r in results if r[0]["within_budget"]]
+    if eligible:
+        chosen = max(eligible, key=lambda r: r[0]["cv_accuracy"])
+    else:
+        chosen = min(results, key=lambda r: r[0]["latency_ms"])
+        # pruning kept the fastest configurations, so none of the grid fits the budget
+        print(f"WARNING: no configuration within {args.latency_budget_ms} ms/row, taking the fastest")
+    result, model, forest = chosen
+
+    artifact = next_artifact_dir(args.output, result["family"])
+    os.makedirs(artifact)
+    joblib.dump(model, os.path.join(artifact, "model.joblib"))
+    forest.save_bundle(os.path.join(artifact, "forest"))
+    metadata = {
+        "artifact_version": ARTIFACT_VERSION,
+        "name": os.path.basename(artifact),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "family": result["family"],
+        "params": result["params"],
+        "metrics": {key: result[key] for key in ("cv_accuracy", "test_accuracy", "latency_ms",
+                                                 "batch_latency_ms_per_row", "fit_seconds", "peak_rss_mb")},
+        "latency_budget_ms": args.latency_budget_ms,
+        "labels": [str(label) for label in encoder.classes_],
+        "n_features": int(X.shape[1]),
+        "feature_config": feature_config,
+        "data": {"rows": int(len(y)), "train_rows": int(len(y_train)), "test_size": args.test_size,
+                 "seed": args.seed, "sha1": hashlib.sha1(np.ascontiguousarray(X).tobytes()).hexdigest()},
+        "search": {"factor": args.factor, "min_samples": args.min_samples, "cv": args.cv,
+                   "configurations": len(pool),
+                   "seconds": search_seconds, "evaluations": history,
+                   "finalists": [r[0] for r in results]},
+    }
+    with open(os.path.join(artifact, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+    print(f"search {search_seconds:.0f}s over {len(history)} evaluations; wrote {artifact} "
+          f"({result['family']}, test accuracy {result['test_accuracy']:.4f}, {result['latency_ms']:.2f} ms/row)")
+
+
+if __name__ == "__main__":
+    main()